@@ -2,7 +2,7 @@ from __future__ import annotations
 import os
 import sys
 import datetime as dt
-from typing import Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any
 import logging
 if not logging.getLogger(__name__).handlers:
     logging.basicConfig(level=logging.INFO)
@@ -269,210 +269,95 @@ def execute_objective(objective: str, target_rel: str, seed_files: Optional[Dict
     return {"used_cua": True, "path": target_abs}
 
 
-def select_snap_assist_tile(name_tokens: list[str]) -> bool:
-    """Select a Snap Assist tile matching provided tokens.
+_VK_RIGHT = 0x27
+_VK_DOWN = 0x28
+_VK_RETURN = 0x0D
 
-    Order of matching phases:
-      1. specific tokens (likely document/file names)
-      2. all tokens (specific + generic labels)
-      3. relaxed generic fallback
-    """
-    global _cua_diag_last, _last_snap_success_ts
-    logger = logging.getLogger(__name__)
+
+def _snap_press(vk: int) -> None:
     try:
-        print(f"CUA: select_snap_assist_tile called with tokens={name_tokens}")
+        import ctypes as _ct
+        import time as _t
+        _ct.windll.user32.keybd_event(vk, 0, 0, 0); _t.sleep(0.03)
+        _ct.windll.user32.keybd_event(vk, 0, 0x0002, 0); _t.sleep(0.03)  # KEYEVENTF_KEYUP
     except Exception:
         pass
 
-    import os as _os_env
-    VERBOSE = bool(_os_env.environ.get('CUA_DEBUG_VERBOSE'))
 
-    # Hard timeout to prevent long scans (default 2000 ms, configurable)
+def _snap_click_xy(x: int, y: int) -> None:
     try:
-        import time as _t_sel
-        _timeout_ms = int(_os_env.environ.get('CUA_SNAP_SELECT_TIMEOUT_MS', '2000') or '2000')
+        import ctypes as _ct
+        _ct.windll.user32.SetCursorPos(int(x), int(y))
+        _ct.windll.user32.mouse_event(0x0002, 0, 0, 0, 0)  # MOUSEEVENTF_LEFTDOWN
+        _ct.windll.user32.mouse_event(0x0004, 0, 0, 0, 0)  # MOUSEEVENTF_LEFTUP
     except Exception:
-        # Fallback defaults
-        import time as _t_sel  # type: ignore
-        _timeout_ms = 2000
-    _deadline = _t_sel.time() + max(0, _timeout_ms) / 1000.0
+        pass
 
-    def _timed_out() -> bool:
-        try:
-            return _t_sel.time() >= _deadline
-        except Exception:
-            return False
 
-    # Debounce: if a snap+select just succeeded, ignore follow-up selection attempts briefly
+def _snap_assist_walk(phases: list, timed_out: Callable[[], bool], diag: Dict[str, Any], verbose: bool = False) -> tuple[Any, Any]:
+    """Debounce check, COM + UIA setup, then walk the focused Snap Assist tiles with the arrow keys.
+
+    phases: (phase_name, match, max_steps, tokens) run in order. match(normalized tile name) returns
+    a truthy hit to select that tile (click its centre, else Enter). A phase is abandoned once the
+    focus cycles known tiles (step >= 8, no new name for 6 steps); when tokens is given, only if that
+    ring is tiny (<= 3 names) and none of the tokens appears in it.
+    diag is filled in place (matched, reason, phase, method, final_name, attempts, focus_changes,
+    unique_names). Returns (automation, hit); automation is None when debounced or setup failed.
+    """
+    import time as _t
     try:
-        _debounce_ms = int(_os_env.environ.get('CUA_SNAP_DEBOUNCE_MS', '6000') or '6000')
-    except Exception:
-        _debounce_ms = 6000
-    try:
-        if _last_snap_success_ts and (_t_sel.time() - _last_snap_success_ts) < (max(0, _debounce_ms) / 1000.0):
-            _cua_diag_last = {
-                'matched': False,
-                'reason': 'debounced_recent_success',
-                'specific_tokens': [],
-                'all_tokens': [],
-            }
-            return False
+        debounce_ms = int(os.environ.get('CUA_SNAP_DEBOUNCE_MS', '6000') or '6000')
+        if _last_snap_success_ts and (_t.time() - _last_snap_success_ts) < (max(0, debounce_ms) / 1000.0):
+            diag.update(matched=False, reason='debounced_recent_success')
+            return None, None
     except Exception:
         pass
 
-    raw_tokens = [t for t in (name_tokens or []) if isinstance(t, str) and t.strip()]
-    # Group generic labels by app family so we only include groups relevant to provided tokens
-    generic_groups = {
-        'word': {"word", "microsoft word", "ms word"},
-        'code': {"visual studio code", "vs code", "vscode", "code"},
-        'browser': {"chrome", "edge", "browser"},
-    }
-    generic_all = set()
-    for _gset in generic_groups.values():
-        generic_all.update(_gset)
-
-    def _norm(s: str) -> str:
-        try:
-            import unicodedata as _ud
-            s = _ud.normalize('NFKD', s)
-            s = ''.join(ch for ch in s if not _ud.combining(ch))
-        except Exception:
-            pass
-        s = s.lower()
-        # keep alnum and spaces
-        import re as _re
-        s = _re.sub(r"[^a-z0-9\s]+", " ", s)
-        s = " ".join(s.split())
-        return s
-    specific: list[str] = []
-    seen_lower = set()
-    for t in raw_tokens:
-        tl = _norm(t)
-        if tl in seen_lower:
-            continue
-        seen_lower.add(tl)
-        if tl not in generic_all and any(c.isalpha() for c in tl) and len(tl) > 2:
-            specific.append(tl)
-            if '.' in tl:
-                stem = tl.split('.')[0]
-                stem = stem.strip()
-                if stem and _norm(stem) not in [s for s in specific] and stem not in generic_all:
-                    specific.append(_norm(stem))
-    # Include only generic groups that the caller hinted at via tokens
-    hinted = set(_norm(x) for x in raw_tokens)
-    include_groups = set()
-    if hinted & generic_groups['word']:
-        include_groups.add('word')
-    if hinted & generic_groups['code']:
-        include_groups.add('code')
-    if hinted & generic_groups['browser']:
-        include_groups.add('browser')
-    # If no explicit hint, choose no generic group to avoid accidental matches (caller should include a hint like 'word')
-    selected_generics = set()
-    for g in include_groups:
-        selected_generics.update(generic_groups[g])
-    specific_tokens = list(dict.fromkeys(_norm(s) for s in specific))
-    generic_tokens = [g for g in selected_generics if g not in specific_tokens]
-    all_tokens = specific_tokens + [g for g in generic_tokens if g not in specific_tokens]
-    if not all_tokens:
-        all_tokens = ["word"]
-
-    # Initialize COM first
-    com_ok = _ensure_com_initialized()
-    if not com_ok:
-        _cua_diag_last = {
-            'matched': False,
-            'reason': 'com_init_failed',
-            'specific_tokens': specific_tokens,
-            'all_tokens': all_tokens,
-        }
-        return False
-    # Initialize UIA
-    try:
-        from comtypes.client import GetModule, CreateObject  # type: ignore
-        GetModule('UIAutomationCore.dll')
-        from comtypes.gen import UIAutomationClient as UIA  # type: ignore
-        automation = CreateObject(UIA.CUIAutomation)
-    except Exception as e:
-        # One more attempt: re-init COM and retry once
-        _ensure_com_initialized()
+    if not _ensure_com_initialized():
+        diag.update(matched=False, reason='com_init_failed')
+        return None, None
+    automation = None
+    errors: list[str] = []
+    for _attempt in range(2):
         try:
             from comtypes.client import GetModule, CreateObject  # type: ignore
             GetModule('UIAutomationCore.dll')
             from comtypes.gen import UIAutomationClient as UIA  # type: ignore
             automation = CreateObject(UIA.CUIAutomation)
-        except Exception as e2:
-            _cua_diag_last = {
-                'matched': False,
-                'reason': 'uia_init_failed',
-                'exception': f"{str(e)[:120]} | retry: {str(e2)[:120]}",
-                'specific_tokens': specific_tokens,
-                'all_tokens': all_tokens,
-            }
-            return False
+            break
+        except Exception as e:
+            errors.append(str(e)[:120])
+            # One more attempt: re-init COM and retry once
+            _ensure_com_initialized()
+    if automation is None:
+        diag.update(matched=False, reason='uia_init_failed', exception=" | retry: ".join(errors))
+        return None, None
 
     # Small stabilization delay + optional extra from env
     try:
-        import time as _t_init, os as _os_delay
-        base_delay = 0.08
-        extra_ms = int(_os_delay.environ.get('CUA_SNAP_EXTRA_DELAY_MS', '0') or '0')
-        total = base_delay + max(0, extra_ms) / 1000.0
-        _t_init.sleep(total)
+        extra_ms = int(os.environ.get('CUA_SNAP_EXTRA_DELAY_MS', '0') or '0')
+        _t.sleep(0.08 + max(0, extra_ms) / 1000.0)
     except Exception:
         pass
 
-    import time as _t
-    import ctypes as _ct
-    VK_RIGHT = 0x27; VK_DOWN = 0x28; VK_RETURN = 0x0D; KEYEVENTF_KEYUP = 0x0002
-    MOUSEEVENTF_LEFTDOWN = 0x0002; MOUSEEVENTF_LEFTUP = 0x0004
-
-    def press(vk):
-        try:
-            _ct.windll.user32.keybd_event(vk, 0, 0, 0); _t.sleep(0.03)
-            _ct.windll.user32.keybd_event(vk, 0, KEYEVENTF_KEYUP, 0); _t.sleep(0.03)
-        except Exception:
-            pass
-
-    def click_xy(x: int, y: int):
-        try:
-            _ct.windll.user32.SetCursorPos(int(x), int(y))
-            _ct.windll.user32.mouse_event(MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
-            _ct.windll.user32.mouse_event(MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-        except Exception:
-            pass
-
-    diag_attempts = []
-    focus_changes = 0
+    attempts: list[dict] = []
     unique_names: list[str] = []
-
-    phases: list[tuple[str, list[str], int]] = []
-    # Dynamic max steps: allow a bit more time before declaring failure
-    BASE_MAX = 20 if specific_tokens else 26
-    MAX_STEPS = BASE_MAX
-    if specific_tokens:
-        phases.append(("specific", specific_tokens, MAX_STEPS))
-    phases.append(("all", all_tokens, MAX_STEPS))
-
-    # Track when a new unique name last appeared to detect repetition cycles
+    focus_changes = 0
     last_new_unique_step = -1
-    repetition_break_triggered = False
+    diag.update(matched=False, attempts=attempts, unique_names=unique_names, focus_changes=0)
+
+    def _stop(phase_name: str) -> bool:
+        if timed_out():
+            diag.update(reason='timeout', phase=phase_name, focus_changes=focus_changes)
+            return True
+        return False
 
-    for phase_name, phase_tokens, phase_limit in phases:
+    for phase_name, match, max_steps, tokens in phases:
         last_name = None
         stagnate = 0
-        for step in range(phase_limit):
-            if _timed_out():
-                _cua_diag_last = {
-                    'matched': False,
-                    'reason': 'timeout',
-                    'phase': phase_name,
-                    'attempts': diag_attempts,
-                    'focus_changes': focus_changes,
-                    'unique_names': unique_names,
-                    'specific_tokens': specific_tokens,
-                    'all_tokens': all_tokens,
-                }
-                return False
+        for step in range(max_steps):
+            if _stop(phase_name):
+                return automation, None
             try:
                 elem = automation.GetFocusedElement()
             except Exception:
@@ -483,7 +368,6 @@ def select_snap_assist_tile(name_tokens: list[str]) -> bool:
                     name = (elem.CurrentName or '')
             except Exception:
                 name = ''
-            name_l = name.lower()
             if name != last_name:
                 focus_changes += 1
                 if name and name not in unique_names:
@@ -499,112 +383,160 @@ def select_snap_assist_tile(name_tokens: list[str]) -> bool:
                     ctl_type = getattr(elem, 'CurrentControlType', None)
             except Exception:
                 pass
-            # Normalized contains check; when caller provides a small, specific token set (<=2), require ALL tokens to match
-            nname = _norm(name)
-            _ptoks = list(phase_tokens or [])
-            if 0 < len(_ptoks) <= 2:
-                matched = all(tok in nname for tok in _ptoks)
-            else:
-                matched = any(tok in nname for tok in _ptoks)
+            nname = _norm_token(name)
+            hit = match(nname) if nname else None
             attempt_rec = {
                 'phase': phase_name,
                 'step': step,
                 'name': name,
-                'matched': matched,
+                'matched': bool(hit),
                 'rect': rect,
                 'pid': pid,
                 'control_type': ctl_type,
-                'tokens_used': phase_tokens,
+                'tokens_used': tokens,
             }
-            diag_attempts.append(attempt_rec)
-            if VERBOSE:
+            attempts.append(attempt_rec)
+            if verbose:
                 try:
                     print(f"CUA_ATTEMPT: {attempt_rec}")
                 except Exception:
                     pass
-            if matched:
+            if hit:
                 # Prefer click if we have a rect
                 if rect:
-                    try:
-                        cx = int((rect[0] + rect[2]) / 2)
-                        cy = int((rect[1] + rect[3]) / 2)
-                        click_xy(cx, cy)
-                        method = 'click'
-                    except Exception:
-                        press(VK_RETURN); method = 'enter'
+                    _snap_click_xy(int((rect[0] + rect[2]) / 2), int((rect[1] + rect[3]) / 2))
+                    method = 'click'
                 else:
-                    press(VK_RETURN); method = 'enter'
-                _cua_diag_last = {
-                    'matched': True,
-                    'phase': phase_name,
-                    'method': method,
-                    'final_name': name,
-                    'focus_changes': focus_changes,
-                    'attempts': diag_attempts,
-                    'unique_names': unique_names,
-                    'specific_tokens': specific_tokens,
-                    'all_tokens': all_tokens,
-                }
-                return True
-            # Early repetition detection: if we have a very small stable set of tiles and no token matches, bail out.
-            if not matched:
-                small_set = 0 < len(unique_names) <= 3
-                no_new_names_for = (step - last_new_unique_step) if last_new_unique_step >= 0 else step
-                # If we seem to be cycling a tiny set without any token presence, bail from THIS PHASE only
-                if step >= 8 and small_set and no_new_names_for >= 6:
-                    joined_lower = _norm(" | ".join(unique_names))
-                    any_token_present = any(tok in joined_lower for tok in (phase_tokens or []))
-                    if not any_token_present:
-                        repetition_break_triggered = True
-                        # break out of current phase to try broader matching/relaxed paths
+                    _snap_press(_VK_RETURN); method = 'enter'
+                diag.update(matched=True, phase=phase_name, method=method, final_name=name, focus_changes=focus_changes)
+                return automation, hit
+            # The focus is cycling tiles already seen: give up on THIS PHASE only
+            no_new_names_for = (step - last_new_unique_step) if last_new_unique_step >= 0 else step
+            if step >= 8 and no_new_names_for >= 6:
+                if tokens is None:
+                    break
+                if 0 < len(unique_names) <= 3:
+                    joined_lower = _norm_token(" | ".join(unique_names))
+                    if not any(tok in joined_lower for tok in tokens):
                         break
 
             # Move to next tile
-            press(VK_RIGHT)
+            _snap_press(_VK_RIGHT)
             _t.sleep(0.08)
-            if _timed_out():
-                _cua_diag_last = {
-                    'matched': False,
-                    'reason': 'timeout',
-                    'phase': phase_name,
-                    'attempts': diag_attempts,
-                    'focus_changes': focus_changes,
-                    'unique_names': unique_names,
-                    'specific_tokens': specific_tokens,
-                    'all_tokens': all_tokens,
-                }
-                return False
+            if _stop(phase_name):
+                return automation, None
             if name == last_name:
                 stagnate += 1
                 if stagnate % 2 == 1:
-                    press(VK_DOWN); _t.sleep(0.08)
-                    if _timed_out():
-                        _cua_diag_last = {
-                            'matched': False,
-                            'reason': 'timeout',
-                            'phase': phase_name,
-                            'attempts': diag_attempts,
-                            'focus_changes': focus_changes,
-                            'unique_names': unique_names,
-                            'specific_tokens': specific_tokens,
-                            'all_tokens': all_tokens,
-                        }
-                        return False
+                    _snap_press(_VK_DOWN); _t.sleep(0.08)
+                    if _stop(phase_name):
+                        return automation, None
             else:
                 stagnate = 0
             last_name = name
+    diag.update(reason='tokens_not_found', focus_changes=focus_changes)
+    return automation, None
+
+
+def _tokens_matcher(tokens: list[str]) -> Callable[[str], bool]:
+    """Match a normalized name: ALL tokens for small (<=2) sets, else ANY."""
+    toks = list(tokens or [])
+    if 0 < len(toks) <= 2:
+        return lambda nname: all(tok in nname for tok in toks)
+    return lambda nname: any(tok in nname for tok in toks)
+
+
+def select_snap_assist_tile(name_tokens: list[str]) -> bool:
+    """Select a Snap Assist tile matching provided tokens.
+
+    Order of matching phases:
+      1. specific tokens (likely document/file names)
+      2. all tokens (specific + generic labels)
+      3. relaxed generic fallback
+    """
+    global _cua_diag_last
+    try:
+        print(f"CUA: select_snap_assist_tile called with tokens={name_tokens}")
+    except Exception:
+        pass
+
+    VERBOSE = bool(os.environ.get('CUA_DEBUG_VERBOSE'))
+
+    # Hard timeout to prevent long scans (default 2000 ms, configurable)
+    import time as _t
+    try:
+        _timeout_ms = int(os.environ.get('CUA_SNAP_SELECT_TIMEOUT_MS', '2000') or '2000')
+    except Exception:
+        _timeout_ms = 2000
+    _deadline = _t.time() + max(0, _timeout_ms) / 1000.0
+
+    def _timed_out() -> bool:
+        try:
+            return _t.time() >= _deadline
+        except Exception:
+            return False
+
+    raw_tokens = [t for t in (name_tokens or []) if isinstance(t, str) and t.strip()]
+    # Group generic labels by app family so we only include groups relevant to provided tokens
+    generic_groups = {
+        'word': {"word", "microsoft word", "ms word"},
+        'code': {"visual studio code", "vs code", "vscode", "code"},
+        'browser': {"chrome", "edge", "browser"},
+    }
+    generic_all = set()
+    for _gset in generic_groups.values():
+        generic_all.update(_gset)
+
+    _norm = _norm_token
+    specific: list[str] = []
+    seen_lower = set()
+    for t in raw_tokens:
+        tl = _norm(t)
+        if tl in seen_lower:
+            continue
+        seen_lower.add(tl)
+        if tl not in generic_all and any(c.isalpha() for c in tl) and len(tl) > 2:
+            specific.append(tl)
+            if '.' in tl:
+                stem = tl.split('.')[0]
+                stem = stem.strip()
+                if stem and _norm(stem) not in [s for s in specific] and stem not in generic_all:
+                    specific.append(_norm(stem))
+    # Include only generic groups that the caller hinted at via tokens
+    hinted = set(_norm(x) for x in raw_tokens)
+    include_groups = set()
+    if hinted & generic_groups['word']:
+        include_groups.add('word')
+    if hinted & generic_groups['code']:
+        include_groups.add('code')
+    if hinted & generic_groups['browser']:
+        include_groups.add('browser')
+    # If no explicit hint, choose no generic group to avoid accidental matches (caller should include a hint like 'word')
+    selected_generics = set()
+    for g in include_groups:
+        selected_generics.update(generic_groups[g])
+    specific_tokens = list(dict.fromkeys(_norm(s) for s in specific))
+    generic_tokens = [g for g in selected_generics if g not in specific_tokens]
+    all_tokens = specific_tokens + [g for g in generic_tokens if g not in specific_tokens]
+    if not all_tokens:
+        all_tokens = ["word"]
+
+    diag: Dict[str, Any] = {'matched': False, 'specific_tokens': specific_tokens, 'all_tokens': all_tokens}
+    # Dynamic max steps: allow a bit more time before declaring failure
+    max_steps = 20 if specific_tokens else 26
+    phases: list = []
+    if specific_tokens:
+        phases.append(("specific", _tokens_matcher(specific_tokens), max_steps, specific_tokens))
+    phases.append(("all", _tokens_matcher(all_tokens), max_steps, all_tokens))
+    automation, hit = _snap_assist_walk(phases, _timed_out, diag, verbose=VERBOSE)
+    if automation is None or hit or diag.get('reason') == 'timeout':
+        _cua_diag_last = diag
+        return bool(hit)
 
     # If zero focus changes -> UI absent
-    if focus_changes == 0:
-        _cua_diag_last = {
-            'matched': False,
-            'reason': 'snap_ui_absent',
-            'attempts': diag_attempts,
-            'focus_changes': focus_changes,
-            'unique_names': unique_names,
-            'specific_tokens': specific_tokens,
-            'all_tokens': all_tokens,
-        }
+    if not diag.get('focus_changes'):
+        diag['reason'] = 'snap_ui_absent'
+        _cua_diag_last = diag
         return False
 
     # Relaxed pass (generic only)
@@ -612,16 +544,8 @@ def select_snap_assist_tile(name_tokens: list[str]) -> bool:
     if relaxed_tokens:
         for rstep in range(10):
             if _timed_out():
-                _cua_diag_last = {
-                    'matched': False,
-                    'reason': 'timeout',
-                    'phase': 'relaxed',
-                    'attempts': diag_attempts,
-                    'focus_changes': focus_changes,
-                    'unique_names': unique_names,
-                    'specific_tokens': specific_tokens,
-                    'all_tokens': all_tokens,
-                }
+                diag.update(reason='timeout', phase='relaxed')
+                _cua_diag_last = diag
                 return False
             try:
                 elem = automation.GetFocusedElement()
@@ -634,35 +558,20 @@ def select_snap_assist_tile(name_tokens: list[str]) -> bool:
             except Exception:
                 name = ''
             if any(rt in _norm(name) for rt in relaxed_tokens):
-                press(VK_RETURN)
-                _cua_diag_last = {
-                    'matched': True,
-                    'relaxed': True,
-                    'method': 'enter',
-                    'phase': 'relaxed',
-                    'final_name': name,
-                    'attempts': diag_attempts,
-                    'focus_changes': focus_changes,
-                    'unique_names': unique_names,
-                    'specific_tokens': specific_tokens,
-                    'all_tokens': all_tokens,
-                }
+                _snap_press(_VK_RETURN)
+                diag.update(matched=True, relaxed=True, method='enter', phase='relaxed', final_name=name)
+                diag.pop('reason', None)
+                _cua_diag_last = diag
                 return True
-            press(VK_RIGHT); _t.sleep(0.07)
+            _snap_press(_VK_RIGHT); _t.sleep(0.07)
             if _timed_out():
-                _cua_diag_last = {
-                    'matched': False,
-                    'reason': 'timeout',
-                    'phase': 'relaxed',
-                    'attempts': diag_attempts,
-                    'focus_changes': focus_changes,
-                    'unique_names': unique_names,
-                    'specific_tokens': specific_tokens,
-                    'all_tokens': all_tokens,
-                }
+                diag.update(reason='timeout', phase='relaxed')
+                _cua_diag_last = diag
                 return False
 
     # Fallback BFS descendant search (direct tree walk) if focus-based traversal failed.
+    diag_attempts = diag['attempts']
+    unique_names = diag['unique_names']
     bfs_candidates: list[dict] = []
     try:
         root = automation.GetRootElement()
@@ -730,23 +639,14 @@ def select_snap_assist_tile(name_tokens: list[str]) -> bool:
                     if rect_obj:
                         cx = int((rect_obj.left + rect_obj.right) / 2)
                         cy = int((rect_obj.top + rect_obj.bottom) / 2)
-                        click_xy(cx, cy)
+                        _snap_click_xy(cx, cy)
                         method = 'bfs_click'
                 except Exception:
-                    press(VK_RETURN)
-                _cua_diag_last = {
-                    'matched': True,
-                    'method': method,
-                    'phase': 'bfs_fallback',
-                    'final_name': matched_name,
-                    'attempts': diag_attempts,
-                    'focus_changes': focus_changes,
-                    'unique_names': unique_names,
-                    'specific_tokens': specific_tokens,
-                    'all_tokens': all_tokens,
-                    'bfs_visited': visited,
-                    'bfs_sample': bfs_candidates,
-                }
+                    _snap_press(_VK_RETURN)
+                diag.update(matched=True, method=method, phase='bfs_fallback', final_name=matched_name,
+                            bfs_visited=visited, bfs_sample=bfs_candidates)
+                diag.pop('reason', None)
+                _cua_diag_last = diag
                 return True
             else:
                 reason = 'timeout' if _timed_out() else 'no_match_in_bfs'
@@ -754,19 +654,65 @@ def select_snap_assist_tile(name_tokens: list[str]) -> bool:
         except Exception as _bfs_e:
             diag_attempts.append({'phase': 'bfs_fallback', 'step': -1, 'name': '', 'matched': False, 'exception': str(_bfs_e)[:160]})
 
-    _cua_diag_last = {
-        'matched': False,
-        'reason': 'tokens_not_found',
-        'attempts': diag_attempts,
-        'focus_changes': focus_changes,
-        'unique_names': unique_names,
-        'specific_tokens': specific_tokens,
-        'all_tokens': all_tokens,
-        'bfs_sample': bfs_candidates,
-    }
+    diag.update(reason='tokens_not_found', bfs_sample=bfs_candidates)
+    _cua_diag_last = diag
     return False
 
 
+def select_snap_assist_tile_any(token_sets: list[list[str]], timeout_ms: Optional[int] = None) -> Dict[str, Any]:
+    """Select the first Snap Assist tile matching ANY of several token sets, walking the tiles once.
+
+    Each focused tile name is tested against every set (ALL tokens for sets of <=2, else ANY), in
+    the given order. This walk is stricter than select_snap_assist_tile(), which also has a
+    specific-token phase, a relaxed generic pass and a UIA-tree (BFS) fallback; so when the
+    walk finds nothing, select_snap_assist_tile() is run once on the first set.
+    timeout_ms overrides CUA_SNAP_SELECT_TIMEOUT_MS for the walk.
+    Returns {'selected': bool, 'tokens': matched set or None, 'final_name': str}.
+    """
+    global _cua_diag_last
+    import time as _t
+    raw_sets = [[t for t in (ts or []) if isinstance(t, str) and t.strip()] for ts in (token_sets or [])]
+    raw_sets = [ts for ts in raw_sets if ts]
+    sets = [[_norm_token(t) for t in ts] for ts in raw_sets]
+    out: Dict[str, Any] = {'selected': False, 'tokens': None, 'final_name': ''}
+    if not sets:
+        return out
+    try:
+        _timeout_ms = int(timeout_ms if timeout_ms is not None else (os.environ.get('CUA_SNAP_SELECT_TIMEOUT_MS', '2000') or '2000'))
+    except Exception:
+        _timeout_ms = 2000
+    deadline = _t.monotonic() + max(0, _timeout_ms) / 1000.0
+    matchers = [(ts, _tokens_matcher(ts)) for ts in sets]
+
+    def _first_set(nname: str):
+        return next((ts for ts, m in matchers if m(nname)), None)
+
+    diag: Dict[str, Any] = {'token_sets': sets}
+    automation, hit = _snap_assist_walk([('any', _first_set, 26, None)], lambda: _t.monotonic() >= deadline, diag)
+    if hit:
+        _cua_diag_last = diag
+        out.update(selected=True, tokens=hit, final_name=diag.get('final_name') or '')
+        return out
+    if automation is None:
+        _cua_diag_last = diag
+        return out
+    # Nothing matched every token of a set: run the full single-set matcher (specific tokens,
+    # relaxed generics, BFS over the UIA tree) for the highest-priority set
+    first = raw_sets[0]
+    try:
+        if select_snap_assist_tile(first):
+            diag = _cua_diag_last if isinstance(_cua_diag_last, dict) else {}
+            out.update(selected=True, tokens=first, final_name=str(diag.get('final_name') or ''))
+            return out
+    except Exception:
+        pass
+    walk = diag
+    diag = dict(_cua_diag_last) if isinstance(_cua_diag_last, dict) else {}
+    diag.update({'walk_reason': walk.get('reason'), 'walk_unique_names': walk.get('unique_names', []), 'token_sets': sets})
+    _cua_diag_last = diag
+    return out
+
+
 # -------------------------- New CUA convenience API --------------------------
 def trigger_snap(side: str) -> bool:
     """Trigger OS snap assist by sending Win+Arrow to the current foreground window.
@@ -28,13 +28,12 @@ import openpyxl
 import pptx
 import tempfile
 import shutil
-import glob
 try:
     import winreg  # Windows registry, used to detect Tesseract install dir
 except Exception:
     winreg = None
 from fastapi import FastAPI, Request, UploadFile, File, Form, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse  # orjson: faster serializer for the large list/history/search payloads
 from llm_inference import generate_response, summarize_text, answer_question, analyze_pdf, get_settings, set_settings
 from llm_inference import generate_response_with_options
 from llm_inference import get_model_name as llm_get_model_name, set_model_name as llm_set_model_name
@@ -50,8 +49,15 @@ from fastapi.staticfiles import StaticFiles
 import torch
 import logging
 import re, threading, time, unicodedata, asyncio, uuid
+import queue, contextlib, functools, itertools, heapq, mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
 import soundfile as sf
 import numpy as np
+try:
+    import simsimd  # Optional: runtime-dispatched SIMD (AVX2/AVX-512 VNNI/NEON) similarity kernels
+except Exception:
+    simsimd = None
 try:
     from TTS.api import TTS  # Provided by the coqui-tts package
 except Exception:
@@ -154,7 +160,7 @@ def general_health():
         info['packages']['TTS'] = {'error': str(e)}
     # pytesseract version best-effort
     try:
-        v = str(pytesseract.get_tesseract_version()) if pytesseract is not None else None
+        v = _tess_version_cached()
     except Exception:
         v = None
     info['ocr']['tesseract_version'] = v
@@ -600,17 +606,15 @@ try:
             from power_router import compute_open_doc_signature
             effective_request_id = req.request_id or compute_open_doc_signature(req)
             auto_generated = req.request_id is None
-            now = time.time()
-            with _RECENT_REQUESTS_LOCK:
-                rec = _RECENT_REQUESTS.get(effective_request_id)
-                if rec and (now - rec[0] <= _RECENT_REQUESTS_TTL):
-                    cached = dict(rec[1])
-                    cached['idempotent'] = True
-                    cached['idempotent_key'] = effective_request_id
-                    if auto_generated:
-                        cached['idempotent_auto'] = True
-                    print(f"[DIRECT] Result (cached idempotent): {cached}")
-                    return cached
+            rec = _recent_request_get(effective_request_id)
+            if rec:
+                cached = dict(rec)
+                cached['idempotent'] = True
+                cached['idempotent_key'] = effective_request_id
+                if auto_generated:
+                    cached['idempotent_auto'] = True
+                print(f"[DIRECT] Result (cached idempotent): {cached}")
+                return cached
         except Exception:
             pass
         result = open_doc_intelligently(req)
@@ -618,8 +622,7 @@ try:
             from power_router import compute_open_doc_signature
             effective_request_id = req.request_id or compute_open_doc_signature(req)
             auto_generated = req.request_id is None
-            with _RECENT_REQUESTS_LOCK:
-                _RECENT_REQUESTS[effective_request_id] = (time.time(), result)
+            _recent_request_put(effective_request_id, result)
             result['idempotent_key'] = effective_request_id
             if auto_generated:
                 result['idempotent_auto'] = True
@@ -639,12 +642,146 @@ except Exception as _e:
 
 # Load embedding model
 embedder = SentenceTransformer('all-MiniLM-L6-v2')
+EMB_DIM = int(embedder.get_sentence_embedding_dimension() or 384)
+# On CUDA (where SentenceTransformer already places the model) run it in half precision:
+# near-identical similarity ranking at half the weight/activation bandwidth. Outputs are
+# cast back to float32 before normalizing/quantizing, so stored blobs are unchanged.
+if torch.cuda.is_available():
+    try:
+        embedder.half()
+    except Exception as e:
+        logging.debug(f"Could not switch embedder to fp16: {e}")
+
+# Regenerate / duplicate sends re-embed the same prompt; keep recent encodings around.
+# Very long texts bypass the cache so it never pins large keys in memory.
+_ENCODE_CACHE_MAX_CHARS = 4096
+
+@functools.lru_cache(maxsize=2048)
+def _encode_cached(text: str) -> np.ndarray:
+    emb = np.asarray(embedder.encode(text), dtype=np.float32)
+    emb.setflags(write=False)  # shared between callers
+    return emb
+
+def _encode_text(text: str) -> np.ndarray:
+    """embedder.encode(text) memoized for repeated prompts."""
+    # Surrounding whitespace doesn't change the tokens, so don't let it split cache entries
+    text = (text or '').strip()
+    if len(text) > _ENCODE_CACHE_MAX_CHARS:
+        return np.asarray(embedder.encode(text), dtype=np.float32)
+    return _encode_cached(text)
+
+# Embeddings are persisted int8-quantized with a per-vector scale:
+#   scale (float32, 4 bytes) || int8[EMB_DIM]
+# which is ~4x smaller than raw float32 and keeps the similarity scan bandwidth-light.
+# Rows written by older versions hold raw float32 bytes; both layouts are accepted on read.
+_EMB_SCALE_BYTES = 4
+
+def _quantize_embedding(vec) -> tuple[float, np.ndarray]:
+    """Return (scale, int8 vector) such that vec ~= scale * int8."""
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    peak = float(np.max(np.abs(v))) if v.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    q = np.clip(np.rint(v / scale), -127, 127).astype(np.int8)
+    return scale, q
+
+def _embedding_to_blob(vec) -> bytes:
+    # Normalize first so every stored row decodes (scale * int8) to ~unit length and
+    # readers can treat a plain dot product as cosine similarity.
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(v))
+    if norm > 0:
+        v = v / norm
+    scale, q = _quantize_embedding(v)
+    return np.float32(scale).tobytes() + q.tobytes()
+
+def _encode_chunk_blobs(chunks: list[str]) -> list[bytes | None]:
+    """Embedding blobs for chunks from one batched encode; blank chunks map to None."""
+    blobs: list[bytes | None] = [None] * len(chunks)
+    idxs = [i for i, ch in enumerate(chunks) if ch and ch.strip()]
+    if idxs:
+        embs = embedder.encode([chunks[i] for i in idxs], batch_size=32, convert_to_numpy=True, show_progress_bar=False)
+        for i, emb in zip(idxs, embs):
+            blobs[i] = _embedding_to_blob(emb)
+    return blobs
+
+def _blob_to_quantized(blob: bytes) -> tuple[float, np.ndarray] | None:
+    """Decode a stored embedding BLOB into (scale, int8 vector); None if malformed."""
+    if not blob:
+        return None
+    n = len(blob)
+    if n == _EMB_SCALE_BYTES + EMB_DIM:
+        scale = float(np.frombuffer(blob, dtype=np.float32, count=1)[0])
+        return scale, np.frombuffer(blob, dtype=np.int8, offset=_EMB_SCALE_BYTES)
+    if n == 4 * EMB_DIM:
+        # Legacy float32 row: quantize on the fly so the scan stays uniform
+        return _quantize_embedding(np.frombuffer(blob, dtype=np.float32))
+    return None
+
+def _cosine_scores_i8(q_vec, blobs) -> tuple[np.ndarray, list[int]]:
+    """Cosine similarity of q_vec against stored embedding BLOBs using int8 matmul.
+
+    Returns (scores, kept) where kept lists the indices into blobs that decoded
+    successfully (scores[i] belongs to blobs[kept[i]]). Per-vector scales cancel out
+    in cosine similarity, so only the int8 components and their norms are needed.
+    """
+    kept: list[int] = []
+    vecs: list[np.ndarray] = []
+    for i, b in enumerate(blobs):
+        dq = _blob_to_quantized(b)
+        if dq is None:
+            continue
+        kept.append(i)
+        vecs.append(dq[1])
+    if not vecs:
+        return np.zeros(0, dtype=np.float32), kept
+    _, q_i8 = _quantize_embedding(q_vec)
+    if simsimd is not None:
+        try:
+            # int8 cosine distance straight on the stored components, no int32 widening
+            dist = np.asarray(simsimd.cdist(q_i8[None, :], np.vstack(vecs), metric='cosine'), dtype=np.float32)
+            return (1.0 - dist.ravel()).astype(np.float32), kept
+        except Exception:
+            pass
+    mat = np.vstack(vecs).astype(np.int32)
+    q = q_i8.astype(np.int32)
+    dots = (mat @ q).astype(np.float32)
+    denom = np.sqrt((mat * mat).sum(axis=1, dtype=np.int64).astype(np.float32)) * np.float32(np.sqrt(float(q @ q)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(denom > 0, dots / denom, 0.0).astype(np.float32)
+    return scores, kept
 
 # Simple in-memory idempotency cache: map request_id -> (timestamp, response_json)
 # This is best-effort and resets on process restart. Keep TTL short (e.g., 30s).
-_RECENT_REQUESTS = {}
+# Entries are kept oldest-first so expired ones can be swept from the front, and the
+# cache is capped so a long uptime with unique request ids can't grow it without bound.
+_RECENT_REQUESTS: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
 _RECENT_REQUESTS_LOCK = threading.Lock()
 _RECENT_REQUESTS_TTL = 30  # seconds
+_RECENT_REQUESTS_MAX = 4096
+
+def _recent_requests_sweep(now: float) -> None:
+    # Caller holds _RECENT_REQUESTS_LOCK. Amortized O(1): stop at the first fresh entry.
+    while _RECENT_REQUESTS:
+        ts, _ = next(iter(_RECENT_REQUESTS.values()))
+        if now - ts <= _RECENT_REQUESTS_TTL:
+            break
+        _RECENT_REQUESTS.popitem(last=False)
+
+def _recent_request_get(key: str) -> Optional[dict]:
+    now = time.time()
+    with _RECENT_REQUESTS_LOCK:
+        _recent_requests_sweep(now)
+        entry = _RECENT_REQUESTS.get(key)
+    return entry[1] if entry else None
+
+def _recent_request_put(key: str, resp: dict) -> None:
+    now = time.time()
+    with _RECENT_REQUESTS_LOCK:
+        _RECENT_REQUESTS[key] = (now, resp)
+        _RECENT_REQUESTS.move_to_end(key)
+        _recent_requests_sweep(now)
+        while len(_RECENT_REQUESTS) > _RECENT_REQUESTS_MAX:
+            _RECENT_REQUESTS.popitem(last=False)
 
 # Configure optional external tools for OCR.
 # We auto-detect reasonable defaults so users don't have to set env vars manually.
@@ -797,20 +934,24 @@ def _detect_poppler_on_windows() -> str | None:
         choco_lib,
         choco_tools,
     ] if b]
-    patterns = [
-        os.path.join('*poppler*', 'Library', 'bin'),  # zip installs
-        os.path.join('*poppler*', 'bin'),             # generic
-        os.path.join('*poppler*', 'tools'),           # Chocolatey
+    subdirs = [
+        os.path.join('Library', 'bin'),  # zip installs
+        'bin',                           # generic
+        'tools',                         # Chocolatey
     ]
     found = []
-    try:
-        for base in bases:
-            for pat in patterns:
-                for path in glob.glob(os.path.join(base, pat)):
-                    if os.path.isfile(os.path.join(path, 'pdftoppm.exe')):
-                        found.append(path)
-    except Exception:
-        pass
+    for base in bases:
+        # Plain substring test per entry instead of glob's fnmatch regex over '*poppler*'
+        try:
+            with os.scandir(base) as it:
+                entries = [e.path for e in it if 'poppler' in e.name.lower() and e.is_dir()]
+        except Exception:
+            continue
+        for entry in entries:
+            for sub in subdirs:
+                path = os.path.join(entry, sub)
+                if os.path.isfile(os.path.join(path, 'pdftoppm.exe')):
+                    found.append(path)
     if not found:
         return None
     # Prefer the one with highest version by simple lexicographic sort (good enough)
@@ -898,10 +1039,25 @@ if pytesseract is not None and TESSERACT_CMD:
     except Exception as _e:
         logging.warning(f"[OCR] Failed to set Tesseract cmd: {_e}")
 
-# Final validation: if version cannot be obtained, try one last auto-detect on Windows
-if pytesseract is not None:
+# `tesseract --version` forks a subprocess (expensive on Windows); cache it per configured command.
+@functools.lru_cache(maxsize=4)
+def _probe_tess_version(cmd: str | None) -> str:
+    return str(pytesseract.get_tesseract_version())
+
+def _tess_version_cached() -> str | None:
+    """Best-effort Tesseract version for the currently configured command (None if unavailable)."""
+    if pytesseract is None:
+        return None
     try:
-        _ver = str(pytesseract.get_tesseract_version())
+        return _probe_tess_version(getattr(pytesseract.pytesseract, 'tesseract_cmd', None))
+    except Exception:
+        return None
+
+# Final validation: if version cannot be obtained, try one last auto-detect on Windows.
+# An existing TESSERACT_CMD file already proves the binary is installed, so skip the probe then.
+if pytesseract is not None and not (TESSERACT_CMD and os.path.isfile(TESSERACT_CMD)):
+    try:
+        _ver = _probe_tess_version(getattr(pytesseract.pytesseract, 'tesseract_cmd', None))
         if not _ver and os.name == 'nt':
             # attempt detect & set again
             _auto = _detect_tesseract_on_windows()
@@ -921,6 +1077,11 @@ if pytesseract is not None:
                     pass
 
 # -------------------- OCR/Text Extraction Helpers --------------------
+# Scanned PDFs yield (almost) no text per page; if the first few pages are this empty,
+# stop walking the document and fall through to the next extractor / OCR early.
+_PDF_PROBE_PAGES = 5
+_PDF_PROBE_MIN_CHARS = 40
+
 def _extract_text_pdf_best_effort(path: str) -> str:
     """Try multiple libraries for text-based PDFs before OCR: PyMuPDF -> pdfplumber -> pdfminer.six -> PyPDF2."""
     # 1) PyMuPDF
@@ -928,13 +1089,19 @@ def _extract_text_pdf_best_effort(path: str) -> str:
         try:
             with fitz.open(path) as doc:
                 parts = []
-                for page in doc:
+                n_chars = 0
+                for i, page in enumerate(doc):
                     try:
                         t = page.get_text() or ''
                     except Exception:
                         t = ''
                     if t:
                         parts.append(t)
+                        n_chars += len(t.strip())
+                    if i + 1 == _PDF_PROBE_PAGES and n_chars < _PDF_PROBE_MIN_CHARS:
+                        # Looks scanned: drop the stray header/page-number text so the next extractor runs
+                        parts = []
+                        break
                 combined = "\n".join(parts)
                 if combined.strip():
                     return combined
@@ -945,7 +1112,10 @@ def _extract_text_pdf_best_effort(path: str) -> str:
         try:
             text = ''
             with pdfplumber.open(path) as pdf:
-                for pg in pdf.pages:
+                for i, pg in enumerate(pdf.pages):
+                    if i == _PDF_PROBE_PAGES and len(text.strip()) < _PDF_PROBE_MIN_CHARS:
+                        text = ''
+                        break
                     try:
                         text += (pg.extract_text() or '') + '\n'
                     except Exception:
@@ -973,6 +1143,151 @@ def _extract_text_pdf_best_effort(path: str) -> str:
         pass
     return ''
 
+# In-process cache of the tag/name -> folder map used by resolve_tags_to_context.
+# Folders change rarely, so reuse the map for a short TTL; folder writes bump 'ver'
+# which both expires the entry and stops an in-flight reload from storing stale data.
+_FOLDER_CACHE = {'ver': 0, 'ts': 0.0, 'map': {}}
+_FOLDER_CACHE_TTL = 30  # seconds
+_FOLDER_CACHE_LOCK = threading.Lock()
+
+def _invalidate_folder_cache() -> None:
+    with _FOLDER_CACHE_LOCK:
+        _FOLDER_CACHE['ver'] += 1
+        _FOLDER_CACHE['ts'] = 0.0
+
+def _get_folder_map(c: sqlite3.Cursor) -> dict:
+    now = time.time()
+    with _FOLDER_CACHE_LOCK:
+        if now - _FOLDER_CACHE['ts'] < _FOLDER_CACHE_TTL:
+            return _FOLDER_CACHE['map']
+        ver = _FOLDER_CACHE['ver']
+    c.execute('SELECT id, name, tag FROM mem_folder')
+    folder_by_key = {}
+    for fid, name, tag in c.fetchall() or []:
+        entry = {'id': fid, 'name': name}
+        if tag:
+            folder_by_key[str(tag).strip().lower()] = entry
+        if name:
+            folder_by_key[str(name).strip().lower()] = entry
+    with _FOLDER_CACHE_LOCK:
+        if _FOLDER_CACHE['ver'] == ver:
+            _FOLDER_CACHE['map'] = folder_by_key
+            _FOLDER_CACHE['ts'] = now
+    return folder_by_key
+
+# Short-lived cache of the URLs harvested for a tag set (chat_endpoint link section).
+# Any mem_item write bumps 'ver', which empties the cache and keeps an in-flight
+# harvest from storing results computed against the old rows.
+_TAG_URL_CACHE = {'ver': 0, 'items': OrderedDict()}
+_TAG_URL_CACHE_TTL = 30  # seconds
+_TAG_URL_CACHE_MAX = 512
+_TAG_URL_CACHE_LOCK = threading.Lock()
+_MEM_FTS_OK = True  # flipped off the first time the mem_item_fts query fails
+
+def _invalidate_tag_url_cache() -> None:
+    with _TAG_URL_CACHE_LOCK:
+        _TAG_URL_CACHE['ver'] += 1
+        _TAG_URL_CACHE['items'].clear()
+
+# In-process similarity index over mem_item embeddings for /api/memory/search.
+# Rows are L2-normalized float32, so cosine similarity for every item is one
+# matrix-vector product. Rebuilt lazily after any mem_item write (~1.5KB/item at 384 dims).
+_MEM_INDEX = {'ver': 0, 'built_ver': -1, 'ids': np.zeros(0, dtype=np.int64), 'mat': np.zeros((0, EMB_DIM), dtype=np.float32)}
+_MEM_INDEX_LOCK = threading.Lock()
+
+def _invalidate_mem_index() -> None:
+    with _MEM_INDEX_LOCK:
+        _MEM_INDEX['ver'] += 1
+
+def _get_mem_index(c: sqlite3.Cursor) -> tuple[np.ndarray, np.ndarray]:
+    """Return (ids, unit-norm embedding matrix) for all mem_items that have an embedding."""
+    with _MEM_INDEX_LOCK:
+        if _MEM_INDEX['built_ver'] == _MEM_INDEX['ver']:
+            return _MEM_INDEX['ids'], _MEM_INDEX['mat']
+        ver = _MEM_INDEX['ver']
+    c.execute('SELECT id, embedding FROM mem_item WHERE embedding IS NOT NULL')
+    ids, vecs = [], []
+    for rid, blob in c.fetchall():
+        dq = _blob_to_quantized(blob)
+        if dq is None:
+            continue
+        ids.append(rid)
+        vecs.append(dq[1])
+    if vecs:
+        # The per-vector scale drops out under normalization, so the int8 components suffice
+        mat = np.vstack(vecs).astype(np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        np.divide(mat, norms, out=mat, where=norms > 0)
+    else:
+        mat = np.zeros((0, EMB_DIM), dtype=np.float32)
+    ids_arr = np.asarray(ids, dtype=np.int64)
+    with _MEM_INDEX_LOCK:
+        if _MEM_INDEX['ver'] == ver:
+            _MEM_INDEX.update(built_ver=ver, ids=ids_arr, mat=mat)
+    return ids_arr, mat
+
+def _mem_items_changed() -> None:
+    """Drop in-process caches derived from mem_item rows; call after any mem_item write."""
+    _invalidate_tag_url_cache()
+    _invalidate_mem_index()
+
+def _iter_unique_urls(texts):
+    """Yield distinct URLs found in texts, in order of first appearance."""
+    seen = set()
+    for text in texts:
+        for m in _URL_RE.finditer(text or ''):
+            u = m.group(0).strip().rstrip('.,);]')
+            if u and u not in seen:
+                seen.add(u)
+                yield u
+
+def _harvest_tag_urls(c: sqlite3.Cursor, tags: list[str]) -> list[str]:
+    """Return up to 20 distinct URLs found in the newest memory items matching any of tags."""
+    global _MEM_FTS_OK
+    key = tuple(tags)
+    now = time.time()
+    with _TAG_URL_CACHE_LOCK:
+        hit = _TAG_URL_CACHE['items'].get(key)
+        if hit and now - hit[0] < _TAG_URL_CACHE_TTL:
+            _TAG_URL_CACHE['items'].move_to_end(key)
+            return hit[1]
+        ver = _TAG_URL_CACHE['ver']
+    # Gather previews containing URLs for any of the tags in one query; keep results small
+    where_tags = ' OR '.join(['tags LIKE ? OR filename LIKE ?'] * len(tags))
+    params = [f"%{t}%" for t in tags for _ in (0, 1)]
+    # 'http*' / 'www' match the tokens unicode61 produces for http(s):// and www. links
+    link_filters = ["id IN (SELECT rowid FROM mem_item_fts WHERE mem_item_fts MATCH 'http* OR www')"] if _MEM_FTS_OK else []
+    link_filters.append("(text_content LIKE '%http%' OR text_content LIKE '%www.%')")
+    previews = None
+    for link_filter in link_filters:
+        try:
+            c.execute(
+                'SELECT id, substr(text_content,1,1000) as preview, filename FROM mem_item '
+                f'WHERE ({where_tags}) AND {link_filter} '
+                'ORDER BY id DESC LIMIT 20', params
+            )
+            previews = [prev or '' for _rid, prev, _fn in c.fetchall() or []]
+            break
+        except sqlite3.OperationalError:
+            if 'mem_item_fts' not in link_filter:
+                return []
+            # No FTS5 table (SQLite built without FTS5): stop trying it
+            _MEM_FTS_OK = False
+        except Exception:
+            return []
+    if previews is None:
+        return []
+    # Extract URL strings; islice stops scanning previews once the cap is reached
+    urls = list(itertools.islice(_iter_unique_urls(previews), 20))
+    with _TAG_URL_CACHE_LOCK:
+        if _TAG_URL_CACHE['ver'] == ver:
+            items = _TAG_URL_CACHE['items']
+            items[key] = (now, urls)
+            items.move_to_end(key)
+            while len(items) > _TAG_URL_CACHE_MAX:
+                items.popitem(last=False)
+    return urls
+
 def resolve_tags_to_context(tags: list[str]) -> Optional[str]:
     """Best-effort: given a list of tag strings, return a short joined preview string
     by looking up mem_folder and mem_item tables. This mirrors frontend resolveTagsToContext
@@ -980,82 +1295,224 @@ def resolve_tags_to_context(tags: list[str]) -> Optional[str]:
     """
     if not tags:
         return None
+    conn = _db_acquire()
     try:
-        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
-        # Load folders for mapping tag/name -> folder
-        c.execute('SELECT id, name, tag FROM mem_folder')
-        folders = c.fetchall() or []
-        folder_by_key = {}
-        for fid, name, tag in folders:
-            if tag:
-                folder_by_key[str(tag).strip().lower()] = {'id': fid, 'name': name}
-            if name:
-                folder_by_key[str(name).strip().lower()] = {'id': fid, 'name': name}
+        # Mapping tag/name -> folder (cached across requests)
+        folder_by_key = _get_folder_map(c)
+
+        # Split into known folders and free-text tags, then fetch previews for each
+        # group with a single statement instead of one query per tag.
+        folder_ids = []
+        unknown = []
+        for t in tags:
+            folder = folder_by_key.get(str(t).lower())
+            if folder:
+                if folder['id'] not in folder_ids:
+                    folder_ids.append(folder['id'])
+            elif t not in unknown:
+                unknown.append(t)
+
+        folder_previews: dict = {}
+        if folder_ids:
+            try:
+                c.execute(
+                    'SELECT folder_id, preview, title, filename FROM ('
+                    ' SELECT folder_id, substr(text_content,1,500) AS preview, title, filename,'
+                    ' ROW_NUMBER() OVER (PARTITION BY folder_id ORDER BY id DESC) AS rn'
+                    ' FROM mem_item WHERE folder_id IN (SELECT value FROM json_each(?))'
+                    ') WHERE rn <= 5 ORDER BY folder_id, rn',
+                    (json.dumps(folder_ids),)
+                )
+                for fid, prev, title, fn in c.fetchall() or []:
+                    p = prev or title or fn or ''
+                    if p:
+                        folder_previews.setdefault(fid, []).append(p)
+            except Exception:
+                folder_previews = {}
+
+        tag_previews: dict = {}
+        if unknown:
+            try:
+                sub = ('SELECT * FROM (SELECT ? AS k, substr(text_content,1,500), filename FROM mem_item'
+                       ' WHERE tags LIKE ? OR filename LIKE ? ORDER BY id DESC LIMIT 5)')
+                params = []
+                for i, t in enumerate(unknown):
+                    like = f"%{t}%"
+                    params.extend((i, like, like))
+                c.execute(' UNION ALL '.join([sub] * len(unknown)), params)
+                for k, prev, fn in c.fetchall() or []:
+                    p = prev or fn or ''
+                    if p:
+                        tag_previews.setdefault(unknown[k], []).append(p)
+            except Exception:
+                tag_previews = {}
 
         contexts = []
         for t in tags:
-            key = str(t).lower()
-            if key in folder_by_key:
-                folder = folder_by_key[key]
-                try:
-                    c.execute('SELECT substr(text_content,1,500) as preview, title, filename FROM mem_item WHERE folder_id=? ORDER BY id DESC LIMIT 5', (folder['id'],))
-                    rows = c.fetchall() or []
-                    previews = [r[0] or r[1] or r[2] or '' for r in rows]
-                    previews = [p for p in previews if p]
-                    if previews:
-                        contexts.append(f"Folder: {folder['name']}\n" + '\n---\n'.join(previews))
-                except Exception:
-                    continue
+            folder = folder_by_key.get(str(t).lower())
+            if folder:
+                previews = folder_previews.get(folder['id'])
+                if previews:
+                    contexts.append(f"Folder: {folder['name']}\n" + '\n---\n'.join(previews))
             else:
-                try:
-                    like = f"%{t}%"
-                    c.execute('SELECT substr(text_content,1,500), filename FROM mem_item WHERE tags LIKE ? OR filename LIKE ? ORDER BY id DESC LIMIT 5', (like, like))
-                    rows = c.fetchall() or []
-                    previews = [(r[0] or r[1] or '') for r in rows]
-                    previews = [p for p in previews if p]
-                    if previews:
-                        contexts.append(f"Tag: #{t}\n" + '\n---\n'.join(previews))
-                except Exception:
-                    continue
-        conn.close()
+                previews = tag_previews.get(t)
+                if previews:
+                    contexts.append(f"Tag: #{t}\n" + '\n---\n'.join(previews))
         if not contexts:
             return None
         joined = '\n====\n'.join(contexts)
         # Trim to a reasonable length
         return joined[:3000]
     except Exception:
+        return None
+    finally:
+        _db_release(conn)
+
+# Tesseract runs out of process, so a few pages can be OCR'd at once from threads
+_OCR_MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+def _ocr_page(img, owner, lang: str) -> str:
+    # owner (the bitmap/pixmap backing img) only needs to live until Tesseract is done with it
+    return pytesseract.image_to_string(img, lang=lang)
+
+def _ocr_pages_parallel(pages, lang: str, skip_errors: bool = False) -> str:
+    """OCR page images concurrently and join the text in page order.
+
+    pages may be a generator: pages are rendered on the calling thread while earlier
+    ones are already being recognized, but at most 2 x _OCR_MAX_WORKERS pages are
+    rendered and pending at a time. Items are images, or (image, owner) pairs whose
+    owner backs the image buffer and is released once that page is recognized.
+    With skip_errors, a failing page is dropped instead of raising.
+    """
+    parts = []
+    pending = deque()
+
+    def _collect(fut):
         try:
-            conn.close()
+            parts.append(fut.result() + '\n')
         except Exception:
-            pass
-        return None
+            if not skip_errors:
+                raise
+
+    with ThreadPoolExecutor(max_workers=_OCR_MAX_WORKERS) as ex:
+        for item in pages:
+            img, owner = item if isinstance(item, tuple) else (item, None)
+            if len(pending) >= 2 * _OCR_MAX_WORKERS:
+                _collect(pending.popleft())
+            pending.append(ex.submit(_ocr_page, img, owner, lang))
+            item = img = owner = None
+        while pending:
+            _collect(pending.popleft())
+    return ''.join(parts)
+
+def _ocr_pdf_via_pdfium(path: str, lang: str) -> str:
+    """Render each page with PDFium and OCR it with Tesseract; errors propagate to the caller."""
+    pdf = pdfium.PdfDocument(path)
+
+    def _pages():
+        for i in range(len(pdf)):
+            # ~200 DPI, rendered as 8-bit grayscale ('L') since Tesseract recognizes on gray anyway
+            bitmap = pdf[i].render(scale=2.0, rotation=0, grayscale=True)
+            # The bitmap backs the PIL image, so it travels with the page to the OCR task
+            yield bitmap.to_pil(), bitmap
+
+    return _ocr_pages_parallel(_pages(), lang)
 
 def _ocr_pdf_via_fitz(path: str, lang: str) -> str:
     """Render each page using PyMuPDF and OCR with Tesseract; avoids Poppler dependency."""
     if fitz is None or pytesseract is None:
         return ''
-    out = ''
+
+    def _pages(doc):
+        mat = fitz.Matrix(2.0, 2.0)  # ~200 DPI
+        for page in doc:
+            try:
+                # Render straight to 8-bit grayscale: 1/3 of the RGB bytes and Tesseract skips its own gray pass
+                pix = page.get_pixmap(matrix=mat, alpha=False, colorspace=fitz.csGRAY)
+                # Hand the raw samples to Tesseract as an array view (no PNG encode/decode round-trip);
+                # the pixmap owns that memory, so it travels with the page to the OCR task
+                samples = getattr(pix, 'samples_mv', None) or pix.samples
+                arr = np.frombuffer(samples, dtype=np.uint8)
+                img = arr.reshape(pix.height, pix.width) if pix.n == 1 else arr.reshape(pix.height, pix.width, pix.n)
+            except Exception:
+                continue
+            yield img, pix
+
     try:
         with fitz.open(path) as doc:
-            mat = fitz.Matrix(2.0, 2.0)  # ~200 DPI
-            for page in doc:
-                try:
-                    pix = page.get_pixmap(matrix=mat, alpha=False)
-                    img_bytes = pix.tobytes("png")
-                    pil = Image.open(io.BytesIO(img_bytes))
-                    out += pytesseract.image_to_string(pil, lang=lang) + '\n'
-                except Exception:
-                    continue
+            return _ocr_pages_parallel(_pages(doc), lang, skip_errors=True)
     except Exception:
         return ''
-    return out
 
 # SQLite DB for chat embeddings
 DB_PATH = 'chat_embeddings.db'
+
+# Small pool of long-lived connections so request handlers don't pay connect/
+# page-cache warmup on every call. Connections are handed out to one thread at a time.
+_DB_POOL_SIZE = 8
+_DB_POOL: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=_DB_POOL_SIZE)
+
+def _db_new_conn() -> sqlite3.Connection:
+    # timeout: wait up to 5s on another writer's lock before raising SQLITE_BUSY
+    conn = sqlite3.connect(DB_PATH, timeout=5.0, check_same_thread=False)
+    try:
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        # ~20MB page cache per pooled connection
+        conn.execute('PRAGMA cache_size=-20000')
+    except Exception as e:
+        logging.debug(f"[DB] Could not apply connection PRAGMAs: {e}")
+    return conn
+
+def _db_acquire() -> sqlite3.Connection:
+    try:
+        return _DB_POOL.get_nowait()
+    except queue.Empty:
+        return _db_new_conn()
+
+def _db_release(conn: sqlite3.Connection) -> None:
+    """Return a connection to the pool; uncommitted work is rolled back like close() would."""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _DB_POOL.put_nowait(conn)
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+@contextlib.contextmanager
+def _db_conn():
+    conn = _db_acquire()
+    try:
+        yield conn
+    finally:
+        _db_release(conn)
+
+# Stored in PRAGMA user_version once init_db has fully run. Bump it whenever init_db
+# gains new tables/columns/indexes so existing databases migrate exactly once.
+_SCHEMA_VERSION = 6
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
+    # Fast path: schema already current, skip the CREATE/ALTER probes entirely
+    try:
+        c.execute('PRAGMA user_version')
+        if (c.fetchone() or (0,))[0] >= _SCHEMA_VERSION:
+            conn.close()
+            return
+    except Exception:
+        pass
+    migrated = True
+    try:
+        # WAL is persistent on the database file, so set it once here
+        conn.execute('PRAGMA journal_mode=WAL')
+    except Exception as e:
+        logging.debug(f"[DB] Could not enable WAL: {e}")
     c.execute('''CREATE TABLE IF NOT EXISTS chat (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         chat_id TEXT,
@@ -1123,7 +1580,69 @@ def init_db():
         )''')
         conn.commit()
     except Exception as e:
+        migrated = False
         logging.debug(f"Could not migrate chat table to add 'service' column: {e}")
+    # Indexes backing the per-chat history / research lookups and folder previews
+    try:
+        c.execute('CREATE INDEX IF NOT EXISTS idx_chat_cid_svc ON chat(chat_id, service, id DESC)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_mem_item_folder ON mem_item(folder_id, id DESC)')
+        # Latest-row-per-chat, replace_last/user lookups and the "New Chat N" name scan
+        c.execute('CREATE INDEX IF NOT EXISTS idx_chat_chatid_id ON chat(chat_id, id DESC)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_chat_chatid_user ON chat(chat_id, user)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_chat_name ON chat(chat_name)')
+        # Chat list per service: covering, already in ORDER BY id DESC order (DISTINCT still dedupes in a temp b-tree)
+        c.execute('CREATE INDEX IF NOT EXISTS idx_chat_service_id ON chat(service, id DESC, chat_id, chat_name)')
+        # Exact/prefix tag and filename matches (substring LIKE '%x%' still scans)
+        c.execute('CREATE INDEX IF NOT EXISTS idx_mem_item_tags ON mem_item(tags)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_mem_item_filename ON mem_item(filename)')
+        # Latest chat_state / chat_artifact row per (chat_id, service)
+        c.execute('CREATE INDEX IF NOT EXISTS idx_chat_state_lookup ON chat_state(chat_id, service, id DESC)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_chat_artifact_lookup ON chat_artifact(chat_id, service, id DESC)')
+        conn.commit()
+    except Exception as e:
+        migrated = False
+        logging.debug(f"Could not create chat/mem_item indexes: {e}")
+    # Full-text index over mem_item.text_content (external content, kept in sync by triggers)
+    # so the "items containing links" lookup doesn't LIKE-scan every row. Optional: SQLite
+    # builds without FTS5 keep using the LIKE fallback in _harvest_tag_urls.
+    try:
+        c.execute('SELECT 1 FROM sqlite_master WHERE type="table" AND name="mem_item_fts"')
+        fts_exists = c.fetchone() is not None
+        c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS mem_item_fts USING fts5(text_content, content='mem_item', content_rowid='id')")
+        c.execute('''CREATE TRIGGER IF NOT EXISTS mem_item_fts_ai AFTER INSERT ON mem_item BEGIN
+            INSERT INTO mem_item_fts(rowid, text_content) VALUES (new.id, new.text_content);
+        END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS mem_item_fts_ad AFTER DELETE ON mem_item BEGIN
+            INSERT INTO mem_item_fts(mem_item_fts, rowid, text_content) VALUES ('delete', old.id, old.text_content);
+        END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS mem_item_fts_au AFTER UPDATE OF text_content ON mem_item BEGIN
+            INSERT INTO mem_item_fts(mem_item_fts, rowid, text_content) VALUES ('delete', old.id, old.text_content);
+            INSERT INTO mem_item_fts(rowid, text_content) VALUES (new.id, new.text_content);
+        END''')
+        if not fts_exists:
+            # Index rows written before the table existed
+            c.execute("INSERT INTO mem_item_fts(mem_item_fts) VALUES ('rebuild')")
+        conn.commit()
+    except Exception as e:
+        logging.debug(f"FTS5 unavailable; mem_item link lookups will use LIKE: {e}")
+    # Rewrite legacy raw-float32 embeddings into the normalized int8 layout once
+    try:
+        for table in ('chat', 'mem_item'):
+            while True:
+                # Converted rows no longer match the length filter, so each pass picks up new ones
+                c.execute(f'SELECT id, embedding FROM {table} WHERE length(embedding)=? LIMIT 500', (4 * EMB_DIM,))
+                batch = c.fetchall()
+                if not batch:
+                    break
+                c.executemany(f'UPDATE {table} SET embedding=? WHERE id=?',
+                              [(_embedding_to_blob(np.frombuffer(blob, dtype=np.float32)), rid) for rid, blob in batch])
+        conn.commit()
+    except Exception as e:
+        migrated = False
+        logging.debug(f"Could not convert legacy float32 embeddings: {e}")
+    if migrated:
+        c.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+        conn.commit()
     conn.close()
 init_db()
 print("Database initialized.")
@@ -1424,103 +1943,9 @@ def set_model(req: ModelSetRequest):
     except Exception as e:
         return JSONResponse(status_code=500, content={'error': str(e)})
 
-@app.post('/api/chat')
-def chat_endpoint(req: ChatRequest):
-    import numpy as np
-    # Quick idempotency check: if client provided request_id and we have a recent cached response, return it
-    try:
-        rid_key = getattr(req, 'request_id', None)
-    except Exception:
-        rid_key = None
-    if rid_key:
-        now = time.time()
-        with _RECENT_REQUESTS_LOCK:
-            entry = _RECENT_REQUESTS.get(rid_key)
-            if entry:
-                ts, resp = entry
-                if now - ts <= _RECENT_REQUESTS_TTL:
-                    # Return cached response (assumed to be small JSON-serializable dict)
-                    return resp
-                else:
-                    # Stale entry: remove
-                    try:
-                        del _RECENT_REQUESTS[rid_key]
-                    except Exception:
-                        pass
-
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    # --- Include previous N interactions from this chat_id as conversational context ---
-    try:
-        c.execute('SELECT user, llm, doc_info FROM chat WHERE chat_id=? ORDER BY id DESC LIMIT 3', (req.chat_id,))
-        prev_rows = c.fetchall()
-    except Exception:
-        prev_rows = []
-    # Build previous conversation text (oldest first)
-    prev_context = ''
-    if prev_rows:
-        try:
-            # If client requested replace_last, avoid including the last AI reply
-            # so the LLM doesn't simply repeat the previous answer when regenerating.
-            if getattr(req, 'replace_last', False) and len(prev_rows) > 0:
-                # prev_rows is ordered DESC (most recent first) — clear llm of most recent row
-                try:
-                    # convert to list to mutate
-                    pr = list(prev_rows)
-                    first_user, first_llm, first_di = pr[0]
-                    pr[0] = (first_user, None, first_di)
-                    rows_to_iterate = list(reversed(pr))
-                except Exception:
-                    rows_to_iterate = reversed(prev_rows)
-            else:
-                rows_to_iterate = reversed(prev_rows)
-            for ur, lr, di in rows_to_iterate:
-                if ur:
-                    prev_context += f"User: {ur}\n"
-                if lr:
-                    prev_context += f"AI: {lr}\n"
-        except Exception:
-            prev_context = ''
-
-    # --- Embedding-based similarity lookup: only run for Research service ---
-    svc = (req.service or '').lower() if req.service else ''
-    is_research = ('research' in svc) or (svc == 'research_assistant')
-    match_info = []
-    if is_research:
-        # compute embedding for the input and compare to stored user embeddings from the same chat_id/service
-        embedding = embedder.encode(req.text)
-        if req.service:
-            c.execute('SELECT user, embedding, doc_info FROM chat WHERE chat_id=? AND service=? AND user IS NOT NULL AND embedding IS NOT NULL', (req.chat_id, req.service))
-        else:
-            c.execute('SELECT user, embedding, doc_info FROM chat WHERE chat_id=? AND user IS NOT NULL AND embedding IS NOT NULL', (req.chat_id,))
-        rows = c.fetchall()
-        # Dynamic threshold based on user input length
-        input_len = len(req.text.strip().split())
-        if input_len < 10:
-            threshold = 0.35
-        elif input_len < 30:
-            threshold = 0.5
-        elif input_len < 80:
-            threshold = 0.6
-        else:
-            threshold = 0.7
-        for user_text, emb_bytes, doc_info in rows:
-            if not user_text or len(user_text.strip()) < 3 or not emb_bytes:
-                continue  # skip trivial/empty texts
-            emb = np.frombuffer(emb_bytes, dtype=np.float32)
-            # cosine similarity
-            try:
-                sim = float(np.dot(embedding, emb) / (np.linalg.norm(embedding) * np.linalg.norm(emb)))
-            except Exception:
-                continue
-            sim = abs(sim)
-            if sim >= threshold:
-                match_info.append((user_text, doc_info, sim))
-
-    # Build service-specific system prompt based on req.service
-    if 'beginner' in svc or 'teacher' in svc:
-        system_prompt = """
+# Base system prompts per assistant service; chat_endpoint appends per-request context to these.
+_SYSTEM_PROMPTS = {
+    'beginner': """
 You are a Beginner-Friendly Teacher AI. Explain topics step by step in clear, simple language.  
 
 Rules:
@@ -1536,26 +1961,23 @@ Rules:
 10. Use clean formatting: headings, steps, bullets, ✅ for confirmations, ⚠️ for warnings.  
 
 Goal: Act like a supportive teacher who makes learning easy, clear, and step-by-step for beginners.
-"""
-    elif 'daily' in svc or 'companion' in svc:
-        system_prompt = """
+""",
+    'daily': """
 You are a Daily Chat Companion.  
 Your goal is to keep conversations light, short, and friendly.  
 Give crisp answers in simple, everyday language.  
 Avoid long explanations unless the user asks.  
 Focus on being clear, approachable, and easy to understand.
-"""
-    elif 'homework' in svc:
-        system_prompt = """
+""",
+    'homework': """
 You are a Homework Helper.  
 Your job is to assist students by giving factual, accurate answers.  
 Always make sure responses are aligned with established theories, textbooks, or widely accepted academic knowledge.  
 Do not speculate or invent facts.  
 Explain step by step when needed, and keep the tone supportive and clear.  
 If the information is uncertain, clearly state that.
-"""
-    else:
-        system_prompt = """
+""",
+    'research': """
 You are a Research Partner AI. Your role is to assist the user with thoughtful, accurate, and well-structured responses.
 
 Guidelines:
@@ -1585,346 +2007,334 @@ Guidelines:
 - Respect user instructions and constraints fully.
 
 Overall, act as a reliable, insightful, and empathetic partner in research, analysis, and problem-solving.
-"""
-
-    # Append embedding-based matches (only present when is_research)
-    if match_info:
-        system_prompt += "\nBelow is info from previous chat messages and docs that may help you:"
-        for user_text, doc_info, sim in match_info:
-            system_prompt += f"\n- Info: {user_text}"
-            if doc_info:
-                system_prompt += f" (Document: {doc_info})"
-            system_prompt += f" [similarity: {sim:.2f}]"
-
-    # Append the previous conversation context (last 3 interactions) so LLM can consider recent history
-    if prev_context:
-        system_prompt += "\nPrevious conversation context:\n" + prev_context
-    # Log matches and prompt
-    print(f"[DEBUG] Matching embeddings for chat_id {req.chat_id}: {match_info}")
-    print(f"[DEBUG] System prompt sent to LLM:\n{system_prompt}\nUser input: {req.text}")
-
-    # Final prompt to LLM
-    # If the client passed memory context (from #tag), include it as supplemental context.
-    # Otherwise attempt to extract inline #tags from the user text and resolve them from the DB.
-    # Priority for mem_context sources:
-    # 1) client-provided mem_context (explicit string)
-    # 2) client-provided mem_tags (list of tag strings)
-    # 3) request.tags (list or comma-separated string)
-    # 4) inline tags found in the text (e.g. #tag)
-    # 5) most recent saved tags in DB for this chat_id (and service, if provided)
-    mem_ctx = getattr(req, 'mem_context', None)
-    mem_ctx_source = None
-    used_tags: list[str] = []  # track which tags we actually used to build context
-    if not mem_ctx:
-        # If client provided mem_tags (selected chips), use them first
-        try:
-            if getattr(req, 'mem_tags', None):
-                tags_list = []
-                for t in req.mem_tags:
-                    if not t:
-                        continue
-                    s = str(t).strip()
-                    if not s:
-                        continue
-                    if s.startswith('#'):
-                        s = s[1:]
-                    if s:
-                        tags_list.append(s)
-                if tags_list:
-                    mem_ctx = resolve_tags_to_context(tags_list)
-                    if mem_ctx:
-                        mem_ctx_source = 'mem_tags'
-                        used_tags = list(tags_list)
-        except Exception:
-            mem_ctx = None
-    # Fallback 2: request.tags (string or array)
-    if not mem_ctx:
-        try:
-            if hasattr(req, 'tags'):
-                rt = getattr(req, 'tags')
-                tags_list = []
-                if isinstance(rt, list):
-                    for t in rt:
-                        if not t:
-                            continue
-                        s = str(t).strip()
-                        if not s:
-                            continue
-                        if s.startswith('#'):
-                            s = s[1:]
-                        if s:
-                            tags_list.append(s)
-                elif isinstance(rt, str):
-                    parts = [p.strip() for p in rt.split(',')]
-                    for p in parts:
-                        if not p:
-                            continue
-                        s = p[1:] if p.startswith('#') else p
-                        if s:
-                            tags_list.append(s)
-                if tags_list:
-                    mem_ctx = resolve_tags_to_context(tags_list)
-                    if mem_ctx:
-                        mem_ctx_source = 'req.tags'
-                        used_tags = list(tags_list)
-        except Exception:
-            mem_ctx = None
-    if not mem_ctx:
-        try:
-            # find inline tags like #tag or #tag_name
-            inline_tags = re.findall(r"#([a-zA-Z0-9_-]+)", req.text or "")
-            # keep unique, preserve order
-            if inline_tags:
-                seen = {}
-                uniq = []
-                for t in inline_tags:
-                    k = str(t).strip()
-                    if not k: continue
-                    lk = k.lower()
-                    if lk not in seen:
-                        seen[lk] = True
-                        uniq.append(k)
-                if uniq:
-                    mem_ctx = resolve_tags_to_context(uniq)
-                    if mem_ctx:
-                        mem_ctx_source = 'inline'
-                        used_tags = list(uniq)
-        except Exception:
-            mem_ctx = None
-    # Fallback 4: look up most recent saved tags for this chat in DB
-    if not mem_ctx:
-        try:
-            if req.service:
-                c.execute('SELECT tags FROM chat WHERE chat_id=? AND service=? AND tags IS NOT NULL AND TRIM(tags)<>"" ORDER BY id DESC LIMIT 1', (req.chat_id, req.service))
-            else:
-                c.execute('SELECT tags FROM chat WHERE chat_id=? AND tags IS NOT NULL AND TRIM(tags)<>"" ORDER BY id DESC LIMIT 1', (req.chat_id,))
-            row = c.fetchone()
-            if row and row[0]:
-                tags_str = str(row[0])
-                tags_list = []
-                for p in tags_str.split(','):
-                    s = p.strip()
-                    if not s:
-                        continue
-                    if s.startswith('#'):
-                        s = s[1:]
-                    if s:
-                        tags_list.append(s)
-                if tags_list:
-                    mem_ctx = resolve_tags_to_context(tags_list)
-                    if mem_ctx:
-                        mem_ctx_source = 'db.tags'
-                        used_tags = list(tags_list)
-        except Exception:
-            pass
+""",
+}
 
-    # Log whether memory context came from client or was server-resolved (helps testing)
+def _system_prompt_kind(svc: str) -> str:
+    if 'beginner' in svc or 'teacher' in svc:
+        return 'beginner'
+    if 'daily' in svc or 'companion' in svc:
+        return 'daily'
+    if 'homework' in svc:
+        return 'homework'
+    return 'research'
+
+# Similarity threshold for research matches, bucketed by input word count:
+# <10 words -> 0.35, <30 -> 0.5, <80 -> 0.6, otherwise 0.7
+_SIM_LEN_BINS = np.array([10, 30, 80])
+_SIM_THRESHOLDS = np.array([0.35, 0.5, 0.6, 0.7])
+
+def _clean_tags(items) -> list[str]:
+    """Strip whitespace and one leading '#' from each tag, dropping empties (order kept)."""
+    return [t for t in (str(x).strip().removeprefix('#') for x in items if x) if t]
+
+def _parse_tag_csv(s: str) -> list[str]:
+    """Split a comma-separated tag string into clean tags."""
+    return _clean_tags(s.split(','))
+
+# Patterns used on every chat request: inline #tags in the user text and URLs in memory previews
+_INLINE_TAG_RE = re.compile(r"#([a-zA-Z0-9_-]+)")
+_URL_RE = re.compile(r'https?://[^\s)]+', re.IGNORECASE)
+
+@app.post('/api/chat')
+def chat_endpoint(req: ChatRequest):
+    import numpy as np
+    # Quick idempotency check: if client provided request_id and we have a recent cached response, return it
     try:
-        if getattr(req, 'mem_context', None):
-            logging.info(f"[CHAT] request_id={getattr(req,'request_id',None)} mem_context=client-provided len={len(str(getattr(req,'mem_context') or ''))}")
-        elif mem_ctx:
-            logging.info(f"[CHAT] request_id={getattr(req,'request_id',None)} mem_context=resolved source={mem_ctx_source} len={len(str(mem_ctx))}")
-        else:
-            logging.info(f"[CHAT] request_id={getattr(req,'request_id',None)} mem_context=none")
+        rid_key = getattr(req, 'request_id', None)
     except Exception:
-        pass
+        rid_key = None
+    if rid_key:
+        cached = _recent_request_get(rid_key)
+        if cached:
+            # Return cached response (assumed to be small JSON-serializable dict)
+            return cached
 
-    if mem_ctx:
-        system_prompt += "\nMemory context from user request:\n" + mem_ctx
+    with _db_conn() as conn:
+        c = conn.cursor()
 
-    # If we have effective tags, surface any explicit URLs from matching memory items so the model can't miss links
-    try:
-        if used_tags:
-            # Gather previews containing URLs for each tag; keep results small and deduped
-            conn2 = sqlite3.connect(DB_PATH)
-            c2 = conn2.cursor()
-            previews = []
-            seen_ids = set()
-            for t in used_tags:
-                like = f"%{t}%"
-                try:
-                    c2.execute(
-                        'SELECT id, substr(text_content,1,1000) as preview, filename FROM mem_item '\
-                        'WHERE (tags LIKE ? OR filename LIKE ?) AND ('
-                        'text_content LIKE "%http%" OR text_content LIKE "%www.%") '
-                        'ORDER BY id DESC LIMIT 20', (like, like)
-                    )
-                    for rid, prev, fn in c2.fetchall() or []:
-                        if rid in seen_ids:
-                            continue
-                        seen_ids.add(rid)
-                        previews.append(prev or '')
-                except Exception:
-                    continue
+        # --- Include previous N interactions from this chat_id as conversational context ---
+        try:
+            c.execute('SELECT user, llm, doc_info FROM chat WHERE chat_id=? ORDER BY id DESC LIMIT 3', (req.chat_id,))
+            prev_rows = c.fetchall()
+        except Exception:
+            prev_rows = []
+        # Build previous conversation text (oldest first)
+        prev_context = ''
+        if prev_rows:
+            try:
+                # If client requested replace_last, avoid including the last AI reply
+                # so the LLM doesn't simply repeat the previous answer when regenerating.
+                if getattr(req, 'replace_last', False) and len(prev_rows) > 0:
+                    # prev_rows is ordered DESC (most recent first) — clear llm of most recent row
+                    try:
+                        # convert to list to mutate
+                        pr = list(prev_rows)
+                        first_user, first_llm, first_di = pr[0]
+                        pr[0] = (first_user, None, first_di)
+                        rows_to_iterate = list(reversed(pr))
+                    except Exception:
+                        rows_to_iterate = reversed(prev_rows)
+                else:
+                    rows_to_iterate = reversed(prev_rows)
+                for ur, lr, di in rows_to_iterate:
+                    if ur:
+                        prev_context += f"User: {ur}\n"
+                    if lr:
+                        prev_context += f"AI: {lr}\n"
+            except Exception:
+                prev_context = ''
+
+        # --- Embedding-based similarity lookup: only run for Research service ---
+        svc = (req.service or '').lower() if req.service else ''
+        is_research = ('research' in svc) or (svc == 'research_assistant')
+        match_info = []
+        if is_research:
+            # compute embedding for the input and compare to stored user embeddings from the same chat_id/service
+            embedding = _encode_text(req.text)
+            if req.service:
+                c.execute('SELECT user, embedding, doc_info FROM chat WHERE chat_id=? AND service=? AND user IS NOT NULL AND embedding IS NOT NULL', (req.chat_id, req.service))
+            else:
+                c.execute('SELECT user, embedding, doc_info FROM chat WHERE chat_id=? AND user IS NOT NULL AND embedding IS NOT NULL', (req.chat_id,))
+            rows = c.fetchall()
+            # Dynamic threshold based on user input length
+            input_len = len(req.text.strip().split())
+            threshold = float(_SIM_THRESHOLDS[np.searchsorted(_SIM_LEN_BINS, input_len, side='right')])
+            # skip trivial/empty texts, then score all candidates in one int8 matmul
+            rows = [r for r in rows if r[0] and len(r[0].strip()) >= 3 and r[1]]
             try:
-                conn2.close()
+                scores, kept = _cosine_scores_i8(embedding, [r[1] for r in rows])
+            except Exception:
+                scores, kept = [], []
+            for i, sim in zip(kept, scores):
+                sim = abs(float(sim))
+                if sim >= threshold:
+                    user_text, _, doc_info = rows[i]
+                    match_info.append((user_text, doc_info, sim))
+
+        # Build service-specific system prompt based on req.service; per-request additions are
+        # collected in prompt_parts and joined once instead of repeated string concatenation.
+        prompt_parts = [_SYSTEM_PROMPTS[_system_prompt_kind(svc)]]
+
+        # Append embedding-based matches (only present when is_research)
+        if match_info:
+            prompt_parts.append("\nBelow is info from previous chat messages and docs that may help you:")
+            for user_text, doc_info, sim in match_info:
+                prompt_parts.append(f"\n- Info: {user_text}")
+                if doc_info:
+                    prompt_parts.append(f" (Document: {doc_info})")
+                prompt_parts.append(f" [similarity: {sim:.2f}]")
+
+        # Append the previous conversation context (last 3 interactions) so LLM can consider recent history
+        if prev_context:
+            prompt_parts.append("\nPrevious conversation context:\n" + prev_context)
+        # Log matches and prompt (only format the large prompt when debug logging is on)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"[CHAT] Matching embeddings for chat_id {req.chat_id}: {match_info}")
+            logging.debug(f"[CHAT] System prompt sent to LLM:\n{''.join(prompt_parts)}\nUser input: {req.text}")
+
+        # Final prompt to LLM
+        # If the client passed memory context (from #tag), include it as supplemental context.
+        # Otherwise attempt to extract inline #tags from the user text and resolve them from the DB.
+        # Priority for mem_context sources:
+        # 1) client-provided mem_context (explicit string)
+        # 2) client-provided mem_tags (list of tag strings)
+        # 3) request.tags (list or comma-separated string)
+        # 4) inline tags found in the text (e.g. #tag)
+        # 5) most recent saved tags in DB for this chat_id (and service, if provided)
+        mem_ctx = getattr(req, 'mem_context', None)
+        mem_ctx_source = None
+        used_tags: list[str] = []  # track which tags we actually used to build context
+        if not mem_ctx:
+            # If client provided mem_tags (selected chips), use them first
+            try:
+                if getattr(req, 'mem_tags', None):
+                    tags_list = _clean_tags(req.mem_tags)
+                    if tags_list:
+                        mem_ctx = resolve_tags_to_context(tags_list)
+                        if mem_ctx:
+                            mem_ctx_source = 'mem_tags'
+                            used_tags = list(tags_list)
+            except Exception:
+                mem_ctx = None
+        # Fallback 2: request.tags (string or array)
+        if not mem_ctx:
+            try:
+                if hasattr(req, 'tags'):
+                    rt = getattr(req, 'tags')
+                    tags_list = []
+                    if isinstance(rt, list):
+                        tags_list = _clean_tags(rt)
+                    elif isinstance(rt, str):
+                        tags_list = _parse_tag_csv(rt)
+                    if tags_list:
+                        mem_ctx = resolve_tags_to_context(tags_list)
+                        if mem_ctx:
+                            mem_ctx_source = 'req.tags'
+                            used_tags = list(tags_list)
+            except Exception:
+                mem_ctx = None
+        if not mem_ctx:
+            try:
+                # find inline tags like #tag or #tag_name
+                inline_tags = _INLINE_TAG_RE.findall(req.text or "")
+                # keep unique, preserve order
+                if inline_tags:
+                    # first spelling wins for case-insensitive duplicates
+                    first_seen = {}
+                    for t in _clean_tags(inline_tags):
+                        first_seen.setdefault(t.lower(), t)
+                    uniq = list(first_seen.values())
+                    if uniq:
+                        mem_ctx = resolve_tags_to_context(uniq)
+                        if mem_ctx:
+                            mem_ctx_source = 'inline'
+                            used_tags = list(uniq)
+            except Exception:
+                mem_ctx = None
+        # Fallback 4: look up most recent saved tags for this chat in DB
+        if not mem_ctx:
+            try:
+                if req.service:
+                    c.execute('SELECT tags FROM chat WHERE chat_id=? AND service=? AND tags IS NOT NULL AND TRIM(tags)<>"" ORDER BY id DESC LIMIT 1', (req.chat_id, req.service))
+                else:
+                    c.execute('SELECT tags FROM chat WHERE chat_id=? AND tags IS NOT NULL AND TRIM(tags)<>"" ORDER BY id DESC LIMIT 1', (req.chat_id,))
+                row = c.fetchone()
+                if row and row[0]:
+                    tags_list = _parse_tag_csv(str(row[0]))
+                    if tags_list:
+                        mem_ctx = resolve_tags_to_context(tags_list)
+                        if mem_ctx:
+                            mem_ctx_source = 'db.tags'
+                            used_tags = list(tags_list)
             except Exception:
                 pass
-            # Extract URL strings
-            urls = []
-            if previews:
-                url_re = re.compile(r'https?://[^\s)]+', re.IGNORECASE)
-                for pv in previews:
-                    for m in url_re.findall(pv or ''):
-                        u = m.strip().rstrip('.,);]')
-                        if u and u not in urls:
-                            urls.append(u)
-                        if len(urls) >= 20:
-                            break
-                    if len(urls) >= 20:
-                        break
-            if urls:
-                # Append a compact section to the prompt so LLM can reference them explicitly
-                system_prompt += "\nRelevant links from memory (by tags: " + ", ".join(used_tags) + "):\n" + "\n".join([f"- {u}" for u in urls])
-    except Exception:
-        pass
 
-    # Also include doc_info (filenames / doc tags) if present to help RAG
-    if getattr(req, 'doc_info', None):
+        # Log whether memory context came from client or was server-resolved (helps testing)
         try:
-            system_prompt += "\nDocument info:\n" + str(req.doc_info)
+            if getattr(req, 'mem_context', None):
+                logging.info(f"[CHAT] request_id={getattr(req,'request_id',None)} mem_context=client-provided len={len(str(getattr(req,'mem_context') or ''))}")
+            elif mem_ctx:
+                logging.info(f"[CHAT] request_id={getattr(req,'request_id',None)} mem_context=resolved source={mem_ctx_source} len={len(str(mem_ctx))}")
+            else:
+                logging.info(f"[CHAT] request_id={getattr(req,'request_id',None)} mem_context=none")
         except Exception:
             pass
 
-    final_prompt = system_prompt + "\nUser: " + req.text
-    ai_text = generate_response(final_prompt)
+        if mem_ctx:
+            prompt_parts.append("\nMemory context from user request:\n" + mem_ctx)
 
-    # Only compute/store embeddings for research chats
-    emb_to_store = None
-    if is_research:
+        # If we have effective tags, surface any explicit URLs from matching memory items so the model can't miss links.
+        # Skip when the memory context already carries links: they are in the prompt either way.
         try:
-            emb_to_store = embedder.encode(req.text)
+            if used_tags and 'http' not in (mem_ctx or ''):
+                urls = _harvest_tag_urls(c, used_tags)
+                if urls:
+                    # Append a compact section to the prompt so LLM can reference them explicitly
+                    prompt_parts.append("\nRelevant links from memory (by tags: " + ", ".join(used_tags) + "):\n" + "\n".join([f"- {u}" for u in urls]))
         except Exception:
-            emb_to_store = None
-
-    # Save user and LLM output in one row; embedding stored only for research (or None otherwise)
-    emb_blob = emb_to_store.tobytes() if emb_to_store is not None else None
+            pass
 
-    # Determine chat_name: if this chat_id already has a chat_name, reuse it; otherwise create default 'New Chat N'
-    c.execute('SELECT DISTINCT chat_name FROM chat WHERE chat_id=? AND chat_name IS NOT NULL', (req.chat_id,))
-    existing_name_row = c.fetchone()
-    if existing_name_row and existing_name_row[0]:
-        chat_name_to_use = existing_name_row[0]
-    else:
-        # compute next New Chat number globally
-        c.execute("SELECT DISTINCT chat_name FROM chat WHERE chat_name LIKE 'New Chat %'")
-        existing = [r[0] for r in c.fetchall() if r and r[0]]
-        max_n = 0
-        for en in existing:
+        # Also include doc_info (filenames / doc tags) if present to help RAG
+        if getattr(req, 'doc_info', None):
             try:
-                n = int(en.replace('New Chat ', '').strip())
-                if n > max_n:
-                    max_n = n
+                prompt_parts.append("\nDocument info:\n" + str(req.doc_info))
             except Exception:
-                continue
-        chat_name_to_use = f'New Chat {max_n + 1}'
+                pass
 
-    # Normalize incoming tags into a comma-separated string for storage (if provided).
-    # Accept either `tags` or `mem_tags` from different frontends.
-    incoming_tags_str = None
-    try:
-        tag_source = None
-        if getattr(req, 'mem_tags', None):
-            tag_source = getattr(req, 'mem_tags')
-        elif getattr(req, 'tags', None):
-            tag_source = getattr(req, 'tags')
-        if tag_source:
-            incoming_tags = [str(t).strip() for t in tag_source if t and str(t).strip()]
-            if incoming_tags:
-                incoming_tags_str = ','.join(incoming_tags)
-    except Exception:
-        incoming_tags_str = None
+        prompt_parts.append("\nUser: " + req.text)
+        final_prompt = ''.join(prompt_parts)
+        ai_text = generate_response(final_prompt)
 
-    if getattr(req, 'replace_last', False) or getattr(req, 'replace_id', None):
-        try:
-            # If client provided an explicit replace_id, prefer that (precise replace-by-id)
-            if getattr(req, 'replace_id', None):
-                try:
-                    rid = int(req.replace_id)
-                    c.execute('SELECT id FROM chat WHERE id=?', (rid,))
-                    if c.fetchone():
-                        # If client provided tags, update tags; otherwise preserve existing tags
-                        if incoming_tags_str is not None:
-                            c.execute('UPDATE chat SET llm=?, timestamp=strftime("%s","now"), doc_info=?, service=?, tags=? WHERE id=?',
-                                      (ai_text, req.doc_info, req.service, incoming_tags_str, rid))
-                        else:
-                            c.execute('UPDATE chat SET llm=?, timestamp=strftime("%s","now"), doc_info=?, service=? WHERE id=?',
-                                      (ai_text, req.doc_info, req.service, rid))
-                        conn.commit()
-                        updated = True
-                    else:
-                        updated = False
-                except Exception:
-                    updated = False
-            else:
-                updated = False
+        # Only compute/store embeddings for research chats
+        # (reuses the embedding computed for the similarity lookup above)
+        emb_to_store = embedding if is_research else None
 
-            # If not updated by id, fall back to best-effort replace_last behavior
-            if not updated and getattr(req, 'replace_last', False):
-                # Prefer to update a row that matches the same user text (most precise)
-                c.execute('SELECT id FROM chat WHERE chat_id=? AND user=? ORDER BY id DESC LIMIT 1', (req.chat_id, req.text))
-                row = c.fetchone()
-                if row:
-                    row_id = row[0]
-                    # Preserve existing tags if client did not send tags
-                    if incoming_tags_str is not None:
-                        c.execute('UPDATE chat SET llm=?, timestamp=strftime("%s","now"), doc_info=?, service=?, tags=? WHERE id=?',
-                                  (ai_text, req.doc_info, req.service, incoming_tags_str, row_id))
-                    else:
-                        c.execute('UPDATE chat SET llm=?, timestamp=strftime("%s","now"), doc_info=?, service=? WHERE id=?',
-                                  (ai_text, req.doc_info, req.service, row_id))
-                    conn.commit()
-                else:
-                    # Fallback: update the last AI row for this chat_id
-                    c.execute('SELECT id FROM chat WHERE chat_id=? AND llm IS NOT NULL ORDER BY id DESC LIMIT 1', (req.chat_id,))
-                    last = c.fetchone()
-                    if last:
-                        last_id = last[0]
-                        if incoming_tags_str is not None:
-                            c.execute('UPDATE chat SET llm=?, timestamp=strftime("%s","now"), doc_info=?, service=?, tags=? WHERE id=?',
-                                      (ai_text, req.doc_info, req.service, incoming_tags_str, last_id))
-                        else:
-                            c.execute('UPDATE chat SET llm=?, timestamp=strftime("%s","now"), doc_info=?, service=? WHERE id=?',
-                                      (ai_text, req.doc_info, req.service, last_id))
-                        conn.commit()
-                    else:
-                        # If nothing to replace, insert as new
-                        c.execute('INSERT INTO chat (chat_id, user, llm, embedding, timestamp, doc_info, service, chat_name, tags) VALUES (?, ?, ?, ?, strftime("%s", "now"), ?, ?, ?, ?)',
-                                  (req.chat_id, req.text, ai_text, emb_blob, req.doc_info, req.service, chat_name_to_use, incoming_tags_str))
-                        conn.commit()
+        # Save user and LLM output in one row; embedding stored only for research (or None otherwise)
+        emb_blob = _embedding_to_blob(emb_to_store) if emb_to_store is not None else None
+
+        # Determine chat_name: if this chat_id already has a chat_name, reuse it; otherwise create default 'New Chat N'
+        c.execute('SELECT DISTINCT chat_name FROM chat WHERE chat_id=? AND chat_name IS NOT NULL', (req.chat_id,))
+        existing_name_row = c.fetchone()
+        if existing_name_row and existing_name_row[0]:
+            chat_name_to_use = existing_name_row[0]
+        else:
+            # compute next New Chat number globally; GLOB (unlike LIKE) can seek idx_chat_name by prefix
+            c.execute("SELECT MAX(CAST(SUBSTR(chat_name, 10) AS INTEGER)) FROM chat WHERE chat_name GLOB 'New Chat [0-9]*'")
+            max_n = (c.fetchone() or (None,))[0] or 0
+            chat_name_to_use = f'New Chat {max_n + 1}'
+
+        # Normalize incoming tags into a comma-separated string for storage (if provided).
+        # Accept either `tags` or `mem_tags` from different frontends.
+        incoming_tags_str = None
+        try:
+            tag_source = None
+            if getattr(req, 'mem_tags', None):
+                tag_source = getattr(req, 'mem_tags')
+            elif getattr(req, 'tags', None):
+                tag_source = getattr(req, 'tags')
+            if tag_source:
+                incoming_tags = [str(t).strip() for t in tag_source if t and str(t).strip()]
+                if incoming_tags:
+                    incoming_tags_str = ','.join(incoming_tags)
         except Exception:
-            # On error, fall back to inserting new row
+            incoming_tags_str = None
+
+        def _update_reply(id_expr: str, params: tuple) -> bool:
+            # id_expr is '?' or a scalar subquery picking the row, so lookup + update is one statement.
+            # tags=COALESCE(?, tags): keep existing tags when the client did not send any
+            c.execute('UPDATE chat SET llm=?, timestamp=strftime("%s","now"), doc_info=?, service=?, tags=COALESCE(?, tags) WHERE id=' + id_expr,
+                      (ai_text, req.doc_info, req.service, incoming_tags_str) + params)
+            return c.rowcount > 0
+
+        def _insert_reply():
             c.execute('INSERT INTO chat (chat_id, user, llm, embedding, timestamp, doc_info, service, chat_name, tags) VALUES (?, ?, ?, ?, strftime("%s", "now"), ?, ?, ?, ?)',
                       (req.chat_id, req.text, ai_text, emb_blob, req.doc_info, req.service, chat_name_to_use, incoming_tags_str))
-            conn.commit()
-    else:
-        # Insert new row; include tags if provided
-        c.execute('INSERT INTO chat (chat_id, user, llm, embedding, timestamp, doc_info, service, chat_name, tags) VALUES (?, ?, ?, ?, strftime("%s", "now"), ?, ?, ?, ?)',
-                  (req.chat_id, req.text, ai_text, emb_blob, req.doc_info, req.service, chat_name_to_use, incoming_tags_str))
-        conn.commit()
-    # Update chat_state persistent tags if any were provided this turn
-    try:
-        if incoming_tags_str is not None:
-            tag_list = [t.strip() for t in incoming_tags_str.split(',') if t and t.strip()]
-        else:
+
+        # Update chat_state persistent tags if any were provided this turn
+        try:
+            if incoming_tags_str is not None:
+                tag_list = [t.strip() for t in incoming_tags_str.split(',') if t and t.strip()]
+            else:
+                tag_list = None
+        except Exception:
             tag_list = None
-    except Exception:
-        tag_list = None
-    try:
-        conn2 = sqlite3.connect(DB_PATH)
-        _upsert_chat_state(conn2, req.chat_id, req.service, tag_list, None)
-        conn2.close()
-    except Exception:
-        pass
-    conn.close()
+
+        # The chat row write and the chat_state upsert share one transaction (single commit)
+        with conn:
+            if getattr(req, 'replace_last', False) or getattr(req, 'replace_id', None):
+                try:
+                    # If client provided an explicit replace_id, prefer that (precise replace-by-id)
+                    updated = False
+                    if getattr(req, 'replace_id', None):
+                        try:
+                            updated = _update_reply('?', (int(req.replace_id),))
+                        except Exception:
+                            updated = False
+
+                    # If not updated by id, fall back to best-effort replace_last behavior
+                    if not updated and getattr(req, 'replace_last', False):
+                        # Prefer to update a row that matches the same user text (most precise),
+                        # then the last AI row for this chat_id; if nothing to replace, insert as new
+                        if not (_update_reply('(SELECT id FROM chat WHERE chat_id=? AND user=? ORDER BY id DESC LIMIT 1)', (req.chat_id, req.text))
+                                or _update_reply('(SELECT id FROM chat WHERE chat_id=? AND llm IS NOT NULL ORDER BY id DESC LIMIT 1)', (req.chat_id,))):
+                            _insert_reply()
+                except Exception:
+                    # On error, fall back to inserting new row
+                    _insert_reply()
+            else:
+                # Insert new row; include tags if provided
+                _insert_reply()
+            try:
+                _upsert_chat_state(conn, req.chat_id, req.service, tag_list, None, commit=False)
+            except Exception:
+                pass
     resp = {"text": ai_text, "isVoiceMessage": False, "voiceUrl": None}
     # Store in idempotency cache if request_id provided
     try:
         if getattr(req, 'request_id', None):
-            now = time.time()
-            with _RECENT_REQUESTS_LOCK:
-                # Keep a simple copy; entries will be pruned by TTL on access
-                _RECENT_REQUESTS[req.request_id] = (now, resp)
+            # Expired entries are swept and the cache is capped on every insert
+            _recent_request_put(req.request_id, resp)
     except Exception:
         pass
     return resp
@@ -1936,12 +2346,11 @@ class RenameChatRequest(BaseModel):
 
 @app.post('/api/rename_chat')
 def rename_chat(req: RenameChatRequest):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Update chat_name for all rows for this chat_id
-    c.execute('UPDATE chat SET chat_name = ? WHERE chat_id = ?', (req.new_name, req.chat_id))
-    conn.commit()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        # Update chat_name for all rows for this chat_id
+        c.execute('UPDATE chat SET chat_name = ? WHERE chat_id = ?', (req.new_name, req.chat_id))
+        conn.commit()
     return {"status": "ok", "chat_id": req.chat_id, "new_name": req.new_name}
 
 @app.post('/api/upload')
@@ -1980,11 +2389,10 @@ def upload_file(file: UploadFile = File(...)):
 # -------------------- Memory Manager Endpoints --------------------
 @app.get('/api/memory/folders')
 def list_mem_folders():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, name, tag, created_at FROM mem_folder ORDER BY id DESC')
-    rows = c.fetchall()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, name, tag, created_at FROM mem_folder ORDER BY id DESC')
+        rows = c.fetchall()
     folders = [{'id': r[0], 'name': r[1], 'tag': r[2], 'created_at': r[3]} for r in rows]
     return {'folders': folders}
 
@@ -1999,23 +2407,30 @@ async def create_mem_folder(req: Request):
     tag = data.get('tag') if isinstance(data, dict) else None
     if not name:
         return JSONResponse({'error': 'name required'}, status_code=400)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO mem_folder (name, tag, created_at) VALUES (?, ?, strftime("%s", "now"))', (name, tag))
-    conn.commit()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        c.execute('INSERT INTO mem_folder (name, tag, created_at) VALUES (?, ?, strftime("%s", "now"))', (name, tag))
+        conn.commit()
+    _invalidate_folder_cache()
     return {'status': 'ok'}
 
 @app.get('/api/memory/folders/{folder_id}/items')
 def list_folder_items(folder_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, title, filename, substr(text_content,1,200) as preview, tags, created_at FROM mem_item WHERE folder_id=? ORDER BY id DESC', (folder_id,))
-    rows = c.fetchall()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, title, filename, substr(text_content,1,200) as preview, tags, created_at FROM mem_item WHERE folder_id=? ORDER BY id DESC', (folder_id,))
+        rows = c.fetchall()
     items = [{'id': r[0], 'title': r[1], 'filename': r[2], 'preview': r[3], 'tags': r[4], 'created_at': r[5]} for r in rows]
     return {'items': items}
 
+def _insert_mem_items(rows: list[tuple]) -> None:
+    """Insert (folder_id, title, filename, text_content, tags, embedding) rows in one prepared
+    statement and one transaction (rolled back as a whole if any row fails)."""
+    with _db_conn() as conn:
+        with conn:
+            conn.executemany('INSERT INTO mem_item (folder_id, title, filename, text_content, tags, embedding, created_at) VALUES (?, ?, ?, ?, ?, ?, strftime("%s", "now"))', rows)
+    _mem_items_changed()
+
 @app.post('/api/memory/upload')
 def memory_upload(folder_id: int = Form(...), file: UploadFile = File(...), tags: str = Form('')):
     # Save file and try to extract text for embedding
@@ -2035,10 +2450,16 @@ def memory_upload(folder_id: int = Form(...), file: UploadFile = File(...), tags
             doc = docx.Document(path)
             text = '\n'.join([p.text for p in doc.paragraphs])
         elif ext in ('.xlsx', '.xls'):
-            wb = openpyxl.load_workbook(path)
-            for sh in wb.worksheets:
-                for row in sh.iter_rows(values_only=True):
-                    text += ' '.join([str(c) for c in row if c is not None]) + '\n'
+            # Streaming read-only parser; data_only gives cached cell values instead of formulas
+            wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+            try:
+                lines = []
+                for sh in wb.worksheets:
+                    for row in sh.iter_rows(values_only=True):
+                        lines.append(' '.join(str(c) for c in row if c is not None) + '\n')
+                text = ''.join(lines)
+            finally:
+                wb.close()
         else:
             try:
                 with open(path, 'r', encoding='utf-8') as fh:
@@ -2057,11 +2478,7 @@ def memory_upload(folder_id: int = Form(...), file: UploadFile = File(...), tags
         'pdfium_available': pdfium is not None,
         'error': None,
     }
-    try:
-        if pytesseract is not None:
-            ocr_info['tesseract_version'] = str(pytesseract.get_tesseract_version())
-    except Exception:
-        ocr_info['tesseract_version'] = None
+    ocr_info['tesseract_version'] = _tess_version_cached()
     # If no text was extractable from parsers, try OCR for PDFs and images (robust)
     if (not text or not text.strip()) and pytesseract is not None:
         try:
@@ -2077,12 +2494,11 @@ def memory_upload(folder_id: int = Form(...), file: UploadFile = File(...), tags
             if (not ocr_text or not ocr_text.strip()) and ext == '.pdf' and convert_from_path is not None:
                 # Convert PDF pages to images and OCR each; allow POPPLER_PATH for Windows
                 try:
-                    kwargs = {'dpi': 200}
+                    kwargs = {'dpi': 200, 'grayscale': True}  # 1 byte/pixel; Tesseract works on gray
                     if POPPLER_PATH:
                         kwargs['poppler_path'] = POPPLER_PATH
                     pages = convert_from_path(path, **kwargs)
-                    for img in pages:
-                        ocr_text += pytesseract.image_to_string(img, lang=TESSERACT_LANGS) + '\n'
+                    ocr_text += _ocr_pages_parallel(pages, TESSERACT_LANGS)
                     ocr_info['engine'] = 'pdf2image+poppler'
                 except Exception as e:
                     logging.warning(f"[OCR] pdf2image conversion failed for {filename}: {e}")
@@ -2090,26 +2506,14 @@ def memory_upload(folder_id: int = Form(...), file: UploadFile = File(...), tags
                     # Fallback to PDFium-based rendering if available
                     if pdfium is not None:
                         try:
-                            pdf = pdfium.PdfDocument(path)
-                            n_pages = len(pdf)
-                            for i in range(n_pages):
-                                page = pdf[i]
-                                bitmap = page.render(scale=2.0, rotation=0)  # ~200 DPI
-                                pil = bitmap.to_pil()
-                                ocr_text += pytesseract.image_to_string(pil, lang=TESSERACT_LANGS) + '\n'
+                            ocr_text += _ocr_pdf_via_pdfium(path, TESSERACT_LANGS)
                             ocr_info['engine'] = 'pdfium-render'
                         except Exception as e2:
                             logging.warning(f"[OCR] PDFium fallback failed for {filename}: {e2}")
                             ocr_info['error'] = f"pdfium failed: {e2}"
             elif ext == '.pdf' and convert_from_path is None and pdfium is not None and (not ocr_text or not ocr_text.strip()):
                 try:
-                    pdf = pdfium.PdfDocument(path)
-                    n_pages = len(pdf)
-                    for i in range(n_pages):
-                        page = pdf[i]
-                        bitmap = page.render(scale=2.0, rotation=0)
-                        pil = bitmap.to_pil()
-                        ocr_text += pytesseract.image_to_string(pil, lang=TESSERACT_LANGS) + '\n'
+                    ocr_text += _ocr_pdf_via_pdfium(path, TESSERACT_LANGS)
                     ocr_info['engine'] = 'pdfium-render'
                 except Exception as e:
                     logging.warning(f"[OCR] PDFium rendering failed for {filename}: {e}")
@@ -2148,25 +2552,19 @@ def memory_upload(folder_id: int = Form(...), file: UploadFile = File(...), tags
         # Do NOT use filename as text content. Store a single empty-content record (no embedding).
         chunks = ['']
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    # One batched forward pass for all chunks instead of one encode per chunk
     try:
-        for idx, chunk in enumerate(chunks):
-            chunk_title = title
-            if len(chunks) > 1 and chunk.strip():
-                chunk_title = f"{title} (part {idx+1}/{len(chunks)})"
-            emb_blob = None
-            if chunk and chunk.strip():
-                try:
-                    emb_blob = embedder.encode(chunk).tobytes()
-                except Exception as _e:
-                    logging.warning(f"[Embed] Failed to encode chunk for {filename}: {_e}")
-                    emb_blob = None
-            c.execute('INSERT INTO mem_item (folder_id, title, filename, text_content, tags, embedding, created_at) VALUES (?, ?, ?, ?, ?, ?, strftime("%s", "now"))',
-                      (folder_id, chunk_title, filename, chunk, tags, emb_blob))
-        conn.commit()
-    finally:
-        conn.close()
+        emb_blobs = _encode_chunk_blobs(chunks)
+    except Exception as _e:
+        logging.warning(f"[Embed] Failed to encode chunks for {filename}: {_e}")
+        emb_blobs = [None] * len(chunks)
+    rows = []
+    for idx, chunk in enumerate(chunks):
+        chunk_title = title
+        if len(chunks) > 1 and chunk.strip():
+            chunk_title = f"{title} (part {idx+1}/{len(chunks)})"
+        rows.append((folder_id, chunk_title, filename, chunk, tags, emb_blobs[idx]))
+    _insert_mem_items(rows)
     return {'status': 'ok', 'chunks': len(chunks), 'ocr': ocr_info}
 
 @app.post('/api/memory/note')
@@ -2183,37 +2581,27 @@ async def memory_note(req: Request):
         return JSONResponse({'error': 'folder_id and text required'}, status_code=400)
     # Chunk the note text into smaller pieces and store each with its own embedding
     chunks = split_text(text, max_len=250) if text else [text]
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        for idx, chunk in enumerate(chunks):
-            title = None
-            if len(chunks) > 1:
-                title = f"note_part_{idx+1}"
-            emb = embedder.encode(chunk)
-            c.execute('INSERT INTO mem_item (folder_id, title, filename, text_content, tags, embedding, created_at) VALUES (?, ?, ?, ?, ?, ?, strftime("%s", "now"))',
-                      (folder_id, title, None, chunk, tags, emb.tobytes()))
-        conn.commit()
-    finally:
-        conn.close()
+    emb_blobs = _encode_chunk_blobs(chunks)
+    rows = [(folder_id, f"note_part_{idx+1}" if len(chunks) > 1 else None, None, chunk, tags, emb_blobs[idx])
+            for idx, chunk in enumerate(chunks)]
+    _insert_mem_items(rows)
     return {'status': 'ok', 'chunks': len(chunks)}
 
 @app.delete('/api/memory/item/{item_id}')
 def delete_mem_item(item_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('DELETE FROM mem_item WHERE id=?', (item_id,))
-    conn.commit()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        c.execute('DELETE FROM mem_item WHERE id=?', (item_id,))
+        conn.commit()
+    _mem_items_changed()
     return {'status': 'ok'}
 
 @app.get('/api/memory/item/{item_id}/context')
 def item_context(item_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT text_content, filename, tags FROM mem_item WHERE id=?', (item_id,))
-    row = c.fetchone()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT text_content, filename, tags FROM mem_item WHERE id=?', (item_id,))
+        row = c.fetchone()
     if not row:
         return JSONResponse({'error': 'not found'}, status_code=404)
     text, filename, tags = row
@@ -2222,12 +2610,11 @@ def item_context(item_id: int):
 @app.get('/api/memory/tag/{tag}/context')
 def tag_context(tag: str):
     # Return concatenated small previews for items matching tag (efficient retrieval via DB + embeddings later)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    like = f'%{tag}%'
-    c.execute('SELECT id, substr(text_content,1,1000), filename FROM mem_item WHERE tags LIKE ? OR filename LIKE ?', (like, like))
-    rows = c.fetchall()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        like = f'%{tag}%'
+        c.execute('SELECT id, substr(text_content,1,1000), filename FROM mem_item WHERE tags LIKE ? OR filename LIKE ?', (like, like))
+        rows = c.fetchall()
     items = [{'id': r[0], 'preview': r[1], 'filename': r[2]} for r in rows]
     return {'items': items}
 
@@ -2238,7 +2625,7 @@ def memory_suggest(q: Optional[str] = None, limit: int = 10):
     This endpoint is designed to be extremely fast (simple LIKE queries) and safe to call on every keystroke.
     """
     q = (q or '').strip()
-    conn = sqlite3.connect(DB_PATH)
+    conn = _db_acquire()
     c = conn.cursor()
     suggestions = []
     try:
@@ -2247,15 +2634,20 @@ def memory_suggest(q: Optional[str] = None, limit: int = 10):
             # folder names
             c.execute('SELECT DISTINCT name FROM mem_folder WHERE name LIKE ? LIMIT ?', (like, limit))
             folders = [r[0] for r in c.fetchall() if r[0]]
-            # tags from mem_item.tags (comma separated) - simple LIKE match
+            # tags from mem_item.tags (comma separated) - simple LIKE match. LIKE is already
+            # ASCII case-insensitive and scans the covering idx_mem_item_tags; the per-tag check
+            # below is still needed because a row's tag string also holds non-matching tags.
             c.execute('SELECT DISTINCT tags FROM mem_item WHERE tags LIKE ? LIMIT ?', (like, limit))
             tags = []
+            tags_seen = set()
+            q_lower = q.lower()
             for row in c.fetchall():
                 if not row[0]:
                     continue
                 for t in str(row[0]).split(','):
                     tt = t.strip()
-                    if q.lower() in tt.lower() and tt not in tags:
+                    if q_lower in tt.lower() and tt not in tags_seen:
+                        tags_seen.add(tt)
                         tags.append(tt)
                         if len(tags) >= limit:
                             break
@@ -2270,12 +2662,14 @@ def memory_suggest(q: Optional[str] = None, limit: int = 10):
             folders = [r[0] for r in c.fetchall() if r[0]]
             c.execute('SELECT DISTINCT tags FROM mem_item ORDER BY id DESC LIMIT ?', (limit,))
             tags = []
+            tags_seen = set()
             for row in c.fetchall():
                 if not row[0]:
                     continue
                 for t in str(row[0]).split(','):
                     tt = t.strip()
-                    if tt and tt not in tags:
+                    if tt and tt not in tags_seen:
+                        tags_seen.add(tt)
                         tags.append(tt)
                         if len(tags) >= limit:
                             break
@@ -2290,11 +2684,11 @@ def memory_suggest(q: Optional[str] = None, limit: int = 10):
             'files': files[:limit]
         }
     finally:
-        conn.close()
+        _db_release(conn)
     return suggestions
 
 
-@app.post('/api/memory/search')
+@app.post('/api/memory/search', response_class=ORJSONResponse)
 async def memory_search(request: Request):
     """Search mem_items by semantic similarity to a query. POST body: { query: str, top_k: int=5, tag: Optional[str] }
     Returns top_k items with preview and similarity score.
@@ -2309,44 +2703,52 @@ async def memory_search(request: Request):
     if not q:
         return JSONResponse({'error': 'query required'}, status_code=400)
 
-    q_emb = embedder.encode(q)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if tag:
-        like = f'%{tag}%'
-        c.execute('SELECT id, text_content, filename, tags, embedding FROM mem_item WHERE tags LIKE ? OR filename LIKE ?', (like, like))
-    else:
-        c.execute('SELECT id, text_content, filename, tags, embedding FROM mem_item')
-    rows = c.fetchall()
-    conn.close()
-
-    import numpy as _np
+    # Memoized: retries/refreshes re-issue the same query. Runs of whitespace tokenize the same,
+    # so collapse them to share cache entries (case is kept: it can change the embedding)
+    q_vec = np.asarray(_encode_text(' '.join(q.split())), dtype=np.float32).ravel()
+    q_norm = float(np.linalg.norm(q_vec))
     results = []
-    for r in rows:
-        try:
-            emb_bytes = r[4]
-            if not emb_bytes:
-                continue
-            emb = _np.frombuffer(emb_bytes, dtype=_np.float32)
-            sim = float(_np.dot(q_emb, emb) / (_np.linalg.norm(q_emb) * _np.linalg.norm(emb)))
-            results.append({'id': r[0], 'preview': (r[1] or '')[:1000], 'filename': r[2], 'tags': r[3], 'score': sim})
-        except Exception:
-            continue
-    # sort by descending similarity
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return {'items': results[:top_k]}
+    with _db_conn() as conn:
+        c = conn.cursor()
+        ids, mat = _get_mem_index(c)
+        if tag:
+            like = f'%{tag}%'
+            c.execute('SELECT id FROM mem_item WHERE tags LIKE ? OR filename LIKE ?', (like, like))
+            allowed = np.fromiter((r[0] for r in c.fetchall()), dtype=np.int64)
+            cand = np.flatnonzero(np.isin(ids, allowed))
+        else:
+            cand = np.arange(len(ids))
+        k = max(0, min(top_k, len(cand)))
+        if k and q_norm > 0 and mat.shape[1] == q_vec.shape[0]:
+            q_unit = q_vec / q_norm
+            # One GEMV for all candidates, then partial selection of the top k
+            scores = mat[cand] @ q_unit if tag else mat @ q_unit
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            top_rows, top_scores = cand[top], scores[top]
+            top_ids = ids[top_rows].tolist()
+            c.execute('SELECT id, substr(text_content,1,1000), filename, tags FROM mem_item WHERE id IN (SELECT value FROM json_each(?))',
+                      (json.dumps(top_ids),))
+            by_id = {r[0]: r for r in c.fetchall()}
+            for rid, sim in zip(top_ids, top_scores.tolist()):
+                r = by_id.get(rid)
+                if r is None:
+                    continue  # deleted since the index was built
+                results.append({'id': r[0], 'preview': r[1] or '', 'filename': r[2], 'tags': r[3], 'score': float(sim)})
+    return {'items': results}
 
 
 # Delete a memory folder and all its items
 @app.delete('/api/memory/folders/{folder_id}')
 def delete_mem_folder(folder_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # delete items first
-    c.execute('DELETE FROM mem_item WHERE folder_id=?', (folder_id,))
-    c.execute('DELETE FROM mem_folder WHERE id=?', (folder_id,))
-    conn.commit()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        # delete items first
+        c.execute('DELETE FROM mem_item WHERE folder_id=?', (folder_id,))
+        c.execute('DELETE FROM mem_folder WHERE id=?', (folder_id,))
+        conn.commit()
+    _invalidate_folder_cache()
+    _mem_items_changed()
     return {'status': 'ok'}
 
 
@@ -2357,17 +2759,17 @@ class UpdateFolderRequest(BaseModel):
 
 @app.post('/api/memory/folders/{folder_id}/rename')
 def rename_mem_folder(folder_id: int, req: UpdateFolderRequest):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Only update provided fields
-    if req.name is not None and req.tag is not None:
-        c.execute('UPDATE mem_folder SET name=?, tag=? WHERE id=?', (req.name, req.tag, folder_id))
-    elif req.name is not None:
-        c.execute('UPDATE mem_folder SET name=? WHERE id=?', (req.name, folder_id))
-    elif req.tag is not None:
-        c.execute('UPDATE mem_folder SET tag=? WHERE id=?', (req.tag, folder_id))
-    conn.commit()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        # Only update provided fields
+        if req.name is not None and req.tag is not None:
+            c.execute('UPDATE mem_folder SET name=?, tag=? WHERE id=?', (req.name, req.tag, folder_id))
+        elif req.name is not None:
+            c.execute('UPDATE mem_folder SET name=? WHERE id=?', (req.name, folder_id))
+        elif req.tag is not None:
+            c.execute('UPDATE mem_folder SET tag=? WHERE id=?', (req.tag, folder_id))
+        conn.commit()
+    _invalidate_folder_cache()
     return {'status': 'ok'}
 
 
@@ -2378,28 +2780,27 @@ class UpdateItemRequest(BaseModel):
 
 @app.post('/api/memory/item/{item_id}/update')
 def update_mem_item(item_id: int, req: UpdateItemRequest):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if req.title is not None and req.tags is not None:
-        c.execute('UPDATE mem_item SET title=?, tags=? WHERE id=?', (req.title, req.tags, item_id))
-    elif req.title is not None:
-        c.execute('UPDATE mem_item SET title=? WHERE id=?', (req.title, item_id))
-    elif req.tags is not None:
-        c.execute('UPDATE mem_item SET tags=? WHERE id=?', (req.tags, item_id))
-    conn.commit()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        if req.title is not None and req.tags is not None:
+            c.execute('UPDATE mem_item SET title=?, tags=? WHERE id=?', (req.title, req.tags, item_id))
+        elif req.title is not None:
+            c.execute('UPDATE mem_item SET title=? WHERE id=?', (req.title, item_id))
+        elif req.tags is not None:
+            c.execute('UPDATE mem_item SET tags=? WHERE id=?', (req.tags, item_id))
+        conn.commit()
+    _mem_items_changed()
     return {'status': 'ok'}
 # Endpoint to get chat history (list of chat_ids)
-@app.get('/api/chats')
+@app.get('/api/chats', response_class=ORJSONResponse)
 def get_chats(service: Optional[str] = None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if service:
-        c.execute('SELECT DISTINCT chat_id, chat_name FROM chat WHERE service=? ORDER BY id DESC', (service,))
-    else:
-        c.execute('SELECT DISTINCT chat_id, chat_name, service FROM chat ORDER BY id DESC')
-    rows = c.fetchall()
-    conn.close()
+    with _db_conn() as conn:
+        c = conn.cursor()
+        if service:
+            c.execute('SELECT DISTINCT chat_id, chat_name FROM chat WHERE service=? ORDER BY id DESC', (service,))
+        else:
+            c.execute('SELECT DISTINCT chat_id, chat_name, service FROM chat ORDER BY id DESC')
+        rows = c.fetchall()
     chats = []
     for r in rows:
         # rows can be (chat_id, chat_name) or (chat_id, chat_name, service)
@@ -2412,33 +2813,51 @@ def get_chats(service: Optional[str] = None):
     return {"chats": chats}
 
 # Endpoint to get messages for a chat_id
-@app.get('/api/chat/{chat_id}')
+@app.get('/api/chat/{chat_id}', response_class=ORJSONResponse)
 def get_chat_messages(chat_id: str, service: Optional[str] = None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if service:
-        c.execute('SELECT id, user, llm, timestamp, doc_info, tags FROM chat WHERE chat_id=? AND service=? ORDER BY id ASC', (chat_id, service))
-    else:
-        c.execute('SELECT id, user, llm, timestamp, doc_info, chat_name, tags FROM chat WHERE chat_id=? ORDER BY id ASC', (chat_id,))
-    messages = []
-    chat_name = None
-    for row in c.fetchall():
-        # If chat_name is included in the row tuple, pick it up; else leave None
-        if len(row) == 6:
-            row_id, user_text, llm_text, timestamp, doc_info, tags = row
+    with _db_conn() as conn:
+        c = conn.cursor()
+        chat_name = None
+        if service:
+            c.execute('SELECT id, user, llm, timestamp, doc_info, tags FROM chat WHERE chat_id=? AND service=? ORDER BY id ASC', (chat_id, service))
+            rows = c.fetchall()
         else:
-            row_id, user_text, llm_text, timestamp, doc_info, chat_name, tags = row
-        if user_text:
-            messages.append({"sender": "user", "text": user_text, "timestamp": timestamp, "doc_info": doc_info, "row_id": row_id, "tags": tags})
-        if llm_text:
-            messages.append({"sender": "ai", "text": llm_text, "timestamp": timestamp, "doc_info": doc_info, "row_id": row_id, "tags": tags})
-    conn.close()
+            c.execute('SELECT id, user, llm, timestamp, doc_info, tags FROM chat WHERE chat_id=? ORDER BY id ASC', (chat_id,))
+            rows = c.fetchall()
+            # chat_name is constant per chat; take it from the latest row instead of projecting it per row
+            if rows:
+                c.execute('SELECT chat_name FROM chat WHERE chat_id=? ORDER BY id DESC LIMIT 1', (chat_id,))
+                name_row = c.fetchone()
+                chat_name = name_row[0] if name_row else None
+    # Each row yields a user message then an ai message, skipping empty sides
+    messages = [
+        {"sender": sender, "text": text, "timestamp": timestamp, "doc_info": doc_info, "row_id": row_id, "tags": tags}
+        for row_id, user_text, llm_text, timestamp, doc_info, tags in rows
+        for sender, text in (("user", user_text), ("ai", llm_text))
+        if text
+    ]
     return {"messages": messages, "chat_name": chat_name}
 
 # -------------------- Chat management: delete / rename --------------------
 class DeleteChatRequest(BaseModel):
     service: Optional[str] = None
 
+def _managed_doc_roots() -> tuple:
+    """Resolved managed folders a chat's doc_path may be deleted from (computed once at import)."""
+    from pathlib import Path as _P
+    roots = []
+    try:
+        roots.append(str((_P.home() / 'Documents' / 'SarvajnaGPT').resolve()))
+    except Exception:
+        pass
+    try:
+        roots.append(str((_P(__file__).resolve().parent.parent / 'SarvajnaGPT').resolve()))
+    except Exception:
+        pass
+    return tuple(roots)
+
+_MANAGED_DOC_ROOTS = _managed_doc_roots()
+
 @app.delete('/api/chat/{chat_id}')
 def delete_chat(chat_id: str, service: Optional[str] = None):
     """Delete all chat rows for a given chat_id (optionally scoped to service). Also clears chat_state.
@@ -2446,23 +2865,20 @@ def delete_chat(chat_id: str, service: Optional[str] = None):
     File deletion policy: ONLY delete the file pointed to by chat_state.doc_path for this chat/service.
     No other files are removed.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = _db_acquire()
     try:
         c = conn.cursor()
         # Look up doc_path from chat_state BEFORE deleting rows
         state = _get_chat_state(conn, chat_id, service)
         doc_path = state.get('doc_path') if isinstance(state, dict) else None
 
-        # Delete DB rows
-        if service:
-            c.execute('DELETE FROM chat WHERE chat_id=? AND service=?', (chat_id, service))
-            c.execute('DELETE FROM chat_state WHERE chat_id=? AND service=?', (chat_id, service))
-            c.execute('DELETE FROM chat_artifact WHERE chat_id=? AND service=?', (chat_id, service))
-        else:
-            c.execute('DELETE FROM chat WHERE chat_id=?', (chat_id,))
-            c.execute('DELETE FROM chat_state WHERE chat_id=?', (chat_id,))
-            c.execute('DELETE FROM chat_artifact WHERE chat_id=?', (chat_id,))
-        conn.commit()
+        # Delete DB rows in one write transaction (single WAL commit); IMMEDIATE takes the
+        # write lock up front instead of upgrading mid-way and risking SQLITE_BUSY
+        where, params = ('chat_id=? AND service=?', (chat_id, service)) if service else ('chat_id=?', (chat_id,))
+        with conn:
+            c.execute('BEGIN IMMEDIATE')
+            for table in ('chat', 'chat_state', 'chat_artifact'):
+                c.execute(f'DELETE FROM {table} WHERE {where}', params)
 
         # Delete ONLY the doc_path file (safe-guard to managed folders)
         deleted = []
@@ -2472,23 +2888,9 @@ def delete_chat(chat_id: str, service: Optional[str] = None):
             from pathlib import Path as _P
             p = _P(doc_path)
             # restrict to our managed folders
-            try:
-                home = _P.home()
-                docs = home / 'Documents'
-                allowed1 = (docs / 'SarvajnaGPT').resolve()
-            except Exception:
-                allowed1 = None
-            try:
-                repo_root = _P(__file__).resolve().parent.parent
-                allowed2 = (repo_root / 'SarvajnaGPT').resolve()
-            except Exception:
-                allowed2 = None
             def _is_allowed(path: _P) -> bool:
                 try:
-                    rp = path.resolve()
-                    ok1 = bool(allowed1 and str(rp).startswith(str(allowed1)))
-                    ok2 = bool(allowed2 and str(rp).startswith(str(allowed2)))
-                    return ok1 or ok2
+                    return str(path.resolve()).startswith(_MANAGED_DOC_ROOTS)
                 except Exception:
                     return False
             try:
@@ -2500,7 +2902,7 @@ def delete_chat(chat_id: str, service: Optional[str] = None):
 
         return {"status": "ok", "deleted_chat_id": chat_id, "service": service, **({"deleted_files": deleted} if deleted else {}), **({"failed_files": failed} if failed else {})}
     finally:
-        conn.close()
+        _db_release(conn)
 
 # -------------------- Chat State (Power Mode persistence) --------------------
 class ChatStateUpsert(BaseModel):
@@ -2527,7 +2929,7 @@ def _get_chat_state(conn: sqlite3.Connection, chat_id: str, service: Optional[st
             tags = []
     return {"id": cid, "persistent_tags": tags, "doc_path": dpath}
 
-def _upsert_chat_state(conn: sqlite3.Connection, chat_id: str, service: Optional[str], tags: Optional[List[str]], doc_path: Optional[str]):
+def _upsert_chat_state(conn: sqlite3.Connection, chat_id: str, service: Optional[str], tags: Optional[List[str]], doc_path: Optional[str], commit: bool = True):
     c = conn.cursor()
     existing = _get_chat_state(conn, chat_id, service)
     tags_str = None
@@ -2543,26 +2945,27 @@ def _upsert_chat_state(conn: sqlite3.Connection, chat_id: str, service: Optional
         c.execute('UPDATE chat_state SET persistent_tags=?, doc_path=?, updated_at=? WHERE id=?', (new_tags_str, new_doc, now, existing['id']))
     else:
         c.execute('INSERT INTO chat_state (chat_id, service, persistent_tags, doc_path, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)', (chat_id, service, tags_str, doc_path, now, now))
-    conn.commit()
+    if commit:
+        conn.commit()
 
 @app.post('/api/chat_state')
 def set_chat_state(req: ChatStateUpsert):
-    conn = sqlite3.connect(DB_PATH)
+    conn = _db_acquire()
     try:
         _upsert_chat_state(conn, req.chat_id, req.service, req.persistent_tags, req.doc_path)
         state = _get_chat_state(conn, req.chat_id, req.service)
         return {"status": "ok", "state": state}
     finally:
-        conn.close()
+        _db_release(conn)
 
 @app.get('/api/chat_state/{chat_id}')
 def get_chat_state(chat_id: str, service: Optional[str] = None):
-    conn = sqlite3.connect(DB_PATH)
+    conn = _db_acquire()
     try:
         state = _get_chat_state(conn, chat_id, service)
         return {"state": state}
     finally:
-        conn.close()
+        _db_release(conn)
 
 # -------------------- Global: Load TTS once --------------------
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -2602,6 +3005,11 @@ LANG_SPEAKER_MAP = {
 DEFAULT_SPEAKER = LANG_SPEAKER_MAP.get('en', 'Kumar Dahl')
 TTS_SAMPLE_RATE = tts_engine.synthesizer.output_sample_rate if hasattr(tts_engine, 'synthesizer') else 24000
 logging.info(f"[TTS] Model loaded once at startup ({MODEL_NAME}) on {device}")
+# One dedicated worker owns the model: calls are serialized instead of contending on the
+# GPU from several default-executor threads, and long syntheses don't starve that pool.
+# On CUDA the worker issues its kernels on its own stream so embedder inference isn't queued behind it.
+_TTS_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts')
+_TTS_CUDA_STREAM = torch.cuda.Stream() if device == "cuda" else None
 if not DEFAULT_SPEAKER:
     logging.warning("[TTS] No speakers found for the model. TTS might fail or use a default voice.")
 
@@ -2615,36 +3023,53 @@ supported_langs = [
 ]
 detector = LanguageDetectorBuilder.from_languages(*supported_langs).build()
 
+# Map lingua detection to supported TTS code
+_LINGUA_TO_TTS = {
+    'en': 'en', 'hi': 'hi', 'fr': 'fr', 'de': 'de', 'es': 'es', 'it': 'it', 'ru': 'ru', 'zh': 'zh-cn',
+    'ko': 'ko', 'ja': 'ja', 'ar': 'ar', 'pt': 'pt', 'pl': 'pl', 'nl': 'nl', 'cs': 'cs', 'tr': 'tr', 'hu': 'hu'
+}
+
+# Polling clients resend the same text for every chunk; detect its language once
+@functools.lru_cache(maxsize=1024)
+def _detect_tts_lang(text: str) -> str:
+    try:
+        detected_lang = detector.detect_language_of(text)
+        lingua_code = detected_lang.iso_code_639_1.name.lower() if detected_lang else 'en'
+        return _LINGUA_TO_TTS.get(lingua_code, 'en')
+    except Exception:
+        return 'en'
+
 # -------------------- Helpers --------------------
+# clean_text patterns, compiled once. '*' and '"' fall outside the keep-set, so the
+# symbol strip also drops markdown; digits join the same pass for non-ASCII text.
+_TTS_DROP_RE = re.compile(r'[^\w\s\u0900-\u097F.,!?()\-:]', re.UNICODE)
+_TTS_DROP_DIGITS_RE = re.compile(r'\d+|[^\w\s\u0900-\u097F.,!?()\-:]', re.UNICODE)
+_TTS_WS_RE = re.compile(r'\s*\n\s*|[ \t]+')
+
+def _tts_ws_sub(m: re.Match) -> str:
+    return '\n' if '\n' in m.group() else ' '
+
 def clean_text(text: str) -> str:
     """Normalize unicode, keep Hindi + normal punctuation, remove emojis/markdown/symbols, and clean whitespace."""
     # Normalize text
     text = unicodedata.normalize("NFC", text)
 
-    # Remove markdown-style asterisks and quotes
-    text = re.sub(r'[*"]', '', text)
-
-    # Remove numbers for non-English (to avoid TTS num2words crash)
-    # (Assume English if only ASCII, else remove numbers)
-    if not re.match(r'^[\u0000-\u007F]*$', text):
-        text = re.sub(r'\d+', '', text)
-
-    # Remove emojis and other symbols outside common ranges (keep Devanagari, Latin, punctuation)
-    text = re.sub(r'[^\w\s\u0900-\u097F.,!?()\-:]', '', text, flags=re.UNICODE)
-
-    # Collapse multiple spaces/newlines
-    text = re.sub(r'\s*\n\s*', '\n', text)   # normalize newlines
-    text = re.sub(r'[ \t]+', ' ', text)      # collapse spaces/tabs
-    text = text.strip()
+    # Remove markdown, emojis and other symbols outside common ranges (keep Devanagari, Latin, punctuation).
+    # Numbers are removed too for non-English (to avoid TTS num2words crash); assume English if only ASCII.
+    drop_re = _TTS_DROP_RE if text.isascii() else _TTS_DROP_DIGITS_RE
+    text = drop_re.sub('', text)
 
-    return text
+    # Normalize newlines and collapse spaces/tabs in one pass
+    text = _TTS_WS_RE.sub(_tts_ws_sub, text)
+    return text.strip()
 
 def split_text(text: str, max_len=150):
     words = text.split()
     chunks, current = [], []
     total_len = 0
     for w in words:
-        if total_len + len(w) + 1 > max_len:
+        # Flush only a non-empty chunk: a first word longer than max_len used to emit ""
+        if current and total_len + len(w) + 1 > max_len:
             chunks.append(" ".join(current))
             current = [w]
             total_len = len(w)
@@ -2655,6 +3080,14 @@ def split_text(text: str, max_len=150):
         chunks.append(" ".join(current))
     return chunks
 
+# Clients poll /api/voice_chunk once per chunk with the same full text; clean + split it once
+@functools.lru_cache(maxsize=256)
+def _tts_chunks(text: str) -> tuple[str, ...]:
+    return tuple(split_text(clean_text(text), max_len=100))
+
+# Upper bound on chunks synthesized per /api/voice_chunk call
+_TTS_MAX_BATCH = 8
+
 async def synthesize_chunk_async(text: str, lang_code: str):
     """Generate speech for one chunk in a thread-safe manner."""
     loop = asyncio.get_running_loop()
@@ -2667,34 +3100,80 @@ async def synthesize_chunk_async(text: str, lang_code: str):
         kwargs = {'text': text, 'language': lang_code, 'speaker': speaker}
         logging.info(f"[TTS] Calling tts_engine.tts with: {kwargs}")
         try:
-            return tts_engine.tts(**kwargs)
+            with (torch.cuda.stream(_TTS_CUDA_STREAM) if _TTS_CUDA_STREAM is not None else contextlib.nullcontext()):
+                return tts_engine.tts(**kwargs)
         except Exception as e:
             logging.error(f"[TTS] Error in tts_engine.tts: {e}\n" + traceback.format_exc())
             raise
 
-    # Offload the blocking TTS synthesis to a thread pool
-    audio_array = await loop.run_in_executor(None, tts_sync)
+    # Offload the blocking TTS synthesis to the dedicated TTS worker
+    audio_array = await loop.run_in_executor(_TTS_EXECUTOR, tts_sync)
     return np.array(audio_array)
 
-def save_and_schedule_delete(wav_array, filename, sample_rate, delay=60):
-    """Save wav and schedule auto deletion."""
-    temp_dir = tempfile.gettempdir()
-    wav_path = os.path.join(temp_dir, filename)
+# One janitor thread deletes expired TTS files: a heap of (expiry_ts, path) guarded by a condition
+_TTS_JANITOR_HEAP: list = []
+_TTS_JANITOR_COND = threading.Condition()
+_TTS_JANITOR_THREAD: Optional[threading.Thread] = None
+
+def _tts_janitor():
+    while True:
+        with _TTS_JANITOR_COND:
+            while not _TTS_JANITOR_HEAP:
+                _TTS_JANITOR_COND.wait()
+            expiry, path = _TTS_JANITOR_HEAP[0]
+            now = time.time()
+            if expiry > now:
+                # Woken early if a sooner expiry is pushed
+                _TTS_JANITOR_COND.wait(expiry - now)
+                continue
+            heapq.heappop(_TTS_JANITOR_HEAP)
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+
+def _schedule_delete(path: str, delay: float):
+    global _TTS_JANITOR_THREAD
+    with _TTS_JANITOR_COND:
+        heapq.heappush(_TTS_JANITOR_HEAP, (time.time() + delay, path))
+        if _TTS_JANITOR_THREAD is None:
+            _TTS_JANITOR_THREAD = threading.Thread(target=_tts_janitor, name='tts-janitor', daemon=True)
+            _TTS_JANITOR_THREAD.start()
+        _TTS_JANITOR_COND.notify()
+
+# TTS chunks are served as Ogg/Opus (~10x smaller than 16-bit PCM WAV) when the client reports it
+# can play it ('opus': true, from canPlayType; older Safari/iOS cannot), libsndfile has the Opus
+# encoder and the rate is one Opus supports; else WAV. Set TTS_AUDIO_FORMAT=wav to always serve WAV.
+TTS_AUDIO_FORMAT = os.environ.get('TTS_AUDIO_FORMAT', 'opus').lower()
+_OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+try:
+    _TTS_OPUS_OK = TTS_AUDIO_FORMAT == 'opus' and 'OPUS' in sf.available_subtypes('OGG')
+except Exception:
+    _TTS_OPUS_OK = False
+mimetypes.add_type('audio/ogg', '.ogg')  # not registered by default on every platform
+
+def save_and_schedule_delete(wav_array, filename, sample_rate, delay=60, opus=False):
+    """Save audio (Opus when requested and available, else wav) and schedule auto deletion. Returns its /static URL."""
     static_dir = os.path.join(os.path.dirname(__file__), "static")
     os.makedirs(static_dir, exist_ok=True)
+    if opus and _TTS_OPUS_OK and sample_rate in _OPUS_SAMPLE_RATES:
+        ogg_name = os.path.splitext(filename)[0] + '.ogg'
+        ogg_path = os.path.join(static_dir, ogg_name)
+        try:
+            sf.write(ogg_path, wav_array, sample_rate, format='OGG', subtype='OPUS')
+            _schedule_delete(ogg_path, delay)
+            return f"/static/{ogg_name}"
+        except Exception as e:
+            logging.debug(f"[TTS] Opus encode failed, falling back to WAV: {e}")
+            try:
+                os.remove(ogg_path)
+            except Exception:
+                pass
     out_path = os.path.join(static_dir, filename)
 
-    sf.write(wav_path, wav_array, sample_rate)
-    shutil.copyfile(wav_path, out_path)
-
-    def _delete():
-        time.sleep(delay)
-        try:
-            os.remove(out_path)
-            os.remove(wav_path) # Also remove from temp
-        except Exception:
-            pass
-    threading.Thread(target=_delete, daemon=True).start()
+    # Write straight into the served dir (no temp copy)
+    sf.write(out_path, wav_array, sample_rate, format='WAV', subtype='PCM_16')
+    _schedule_delete(out_path, delay)
 
     return f"/static/{filename}"
 
@@ -2705,45 +3184,41 @@ async def voice_chunk_endpoint(request: Request):
     data = await request.json()
     text = data.get("text", "")
     chunk_index = int(data.get("chunk", 0))
+    # Optional: synthesize several consecutive chunks per call (default 1 keeps one-chunk polling)
+    batch = max(1, min(int(data.get("batch", 1) or 1), _TTS_MAX_BATCH))
     session_id = data.get("session_id") or str(uuid.uuid4())
+    client_opus = bool(data.get("opus"))  # browser can play Ogg/Opus; absent (old clients) means WAV
     lang_code = data.get("lang", None)
     supported_langs = ['en', 'es', 'fr', 'de', 'it', 'pt', 'pl', 'tr', 'ru', 'nl', 'cs', 'ar', 'zh-cn', 'hu', 'ko', 'ja', 'hi']
     if not lang_code or lang_code == 'auto':
-        try:
-            detected_lang = detector.detect_language_of(text)
-            # Map lingua detection to supported TTS code
-            lingua_to_tts = {
-                'en': 'en', 'hi': 'hi', 'fr': 'fr', 'de': 'de', 'es': 'es', 'it': 'it', 'ru': 'ru', 'zh': 'zh-cn',
-                'ko': 'ko', 'ja': 'ja', 'ar': 'ar', 'pt': 'pt', 'pl': 'pl', 'nl': 'nl', 'cs': 'cs', 'tr': 'tr', 'hu': 'hu'
-            }
-            lingua_code = detected_lang.iso_code_639_1.name.lower() if detected_lang else 'en'
-            lang_code = lingua_to_tts.get(lingua_code, 'en')
-        except Exception:
-            lang_code = 'en'
+        lang_code = _detect_tts_lang(text)
     # Fallback if unsupported
     if lang_code not in supported_langs:
         lang_code = 'en'
-    processed_text = clean_text(text)
-    chunks = split_text(processed_text, max_len=100)
+    chunks = _tts_chunks(text)
     if chunk_index >= len(chunks):
         return JSONResponse({"error": "Chunk index out of range", "done": True, "chunks": []})
-    chunk = chunks[chunk_index]
+    end_index = min(chunk_index + batch, len(chunks))
     import traceback
     try:
-        audio_array = await synthesize_chunk_async(chunk, lang_code)
-        duration_sec = len(audio_array) / TTS_SAMPLE_RATE
-        filename = f"tts_{session_id}_{chunk_index}_{uuid.uuid4().hex}.wav"
-        url = save_and_schedule_delete(audio_array, filename, TTS_SAMPLE_RATE, delay=600)
-        # Always return a 'chunks' array for frontend compatibility
+        urls = []
+        duration_sec = 0.0
+        for idx in range(chunk_index, end_index):
+            audio_array = await synthesize_chunk_async(chunks[idx], lang_code)
+            duration_sec += len(audio_array) / TTS_SAMPLE_RATE
+            filename = f"tts_{session_id}_{idx}_{uuid.uuid4().hex}.wav"
+            urls.append(save_and_schedule_delete(audio_array, filename, TTS_SAMPLE_RATE, delay=600, opus=client_opus))
+        # Always return a 'chunks' array for frontend compatibility; 'next' is the index to poll next
         return JSONResponse({
-            "voiceUrl": url,
+            "voiceUrl": urls[0],
             "chunk": chunk_index,
+            "next": end_index,
             "durationSec": duration_sec,
             "lang": lang_code,
             "voice": DEFAULT_SPEAKER,
-            "done": chunk_index == len(chunks) - 1,
-            "chunks": [url],
-            "debug": f"Processed: {chunk[:50]}..."
+            "done": end_index >= len(chunks),
+            "chunks": urls,
+            "debug": f"Processed: {chunks[chunk_index][:50]}..."
         })
     except Exception as e:
         logging.error(f"[TTS] Exception in voice_chunk_endpoint: {e}\n" + traceback.format_exc())
@@ -2843,28 +3318,17 @@ async def extract_text(file: UploadFile = File(...)):
                     # pdf2image + Poppler
                     if (not content or not content.strip()) and convert_from_path is not None:
                         try:
-                            kwargs = {'dpi': 200}
+                            kwargs = {'dpi': 200, 'grayscale': True}  # 1 byte/pixel; Tesseract works on gray
                             if POPPLER_PATH:
                                 kwargs['poppler_path'] = POPPLER_PATH
                             images = convert_from_path(tmp_path, **kwargs)
-                            ocr_text = ''
-                            for im in images:
-                                ocr_text += pytesseract.image_to_string(im, lang=TESSERACT_LANGS) + '\n'
-                            content = ocr_text
+                            content = _ocr_pages_parallel(images, TESSERACT_LANGS)
                         except Exception:
                             pass
                     # PDFium
                     if (not content or not content.strip()) and pdfium is not None:
                         try:
-                            pdf = pdfium.PdfDocument(tmp_path)
-                            n_pages = len(pdf)
-                            ocr_text = ''
-                            for i in range(n_pages):
-                                page = pdf[i]
-                                bitmap = page.render(scale=2.0, rotation=0)
-                                pil = bitmap.to_pil()
-                                ocr_text += pytesseract.image_to_string(pil, lang=TESSERACT_LANGS) + '\n'
-                            content = ocr_text
+                            content = _ocr_pdf_via_pdfium(tmp_path, TESSERACT_LANGS)
                         except Exception:
                             pass
             finally:
@@ -2876,10 +3340,12 @@ async def extract_text(file: UploadFile = File(...)):
             doc = docx.Document(io.BytesIO(await file.read()))
             content = '\n'.join([p.text for p in doc.paragraphs])
         elif ext in ['xlsx', 'xls'] and openpyxl:
-            wb = openpyxl.load_workbook(io.BytesIO(await file.read()), read_only=True)
+            wb = openpyxl.load_workbook(io.BytesIO(await file.read()), read_only=True, data_only=True)
+            lines = []
             for sheet in wb:
                 for row in sheet.iter_rows(values_only=True):
-                    content += '\t'.join([str(cell) if cell is not None else '' for cell in row]) + '\n'
+                    lines.append('\t'.join(str(cell) if cell is not None else '' for cell in row) + '\n')
+            content += ''.join(lines)
         elif ext == 'pptx' and pptx:
             pres = pptx.Presentation(io.BytesIO(await file.read()))
             for slide in pres.slides:
@@ -2917,12 +3383,7 @@ async def extract_text(file: UploadFile = File(...)):
 def ocr_health():
     """Report availability of OCR-related components to help diagnose issues."""
     def _tess_version():
-        try:
-            if pytesseract is None:
-                return None
-            return str(pytesseract.get_tesseract_version())
-        except Exception:
-            return None
+        return _tess_version_cached()
     def _engine_present():
         try:
             cmd = getattr(pytesseract.pytesseract, 'tesseract_cmd', None) if pytesseract is not None else None
@@ -2930,11 +3391,8 @@ def ocr_health():
                 return False
             # If it's a bare name like 'tesseract' on Windows, accept it only if we can get a version
             if os.name == 'nt' and not os.path.isabs(cmd):
-                try:
-                    v = str(pytesseract.get_tesseract_version()) if pytesseract is not None else None
-                    return v is not None and len(v) > 0
-                except Exception:
-                    return False
+                v = _tess_version_cached()
+                return v is not None and len(v) > 0
             return os.path.isfile(cmd) if os.path.isabs(cmd) else True
         except Exception:
             return False
@@ -2958,12 +3416,7 @@ def ocr_health():
 def ocr_refresh():
     """Re-run Tesseract/Poppler auto-detection to heal environment after installs (Windows)."""
     changed = _ensure_tesseract_and_poppler()
-    version = None
-    try:
-        if pytesseract is not None:
-            version = str(pytesseract.get_tesseract_version())
-    except Exception:
-        version = None
+    version = _tess_version_cached()
     return {
         'changed': changed,
         'tesseract_cmd': getattr(pytesseract.pytesseract, 'tesseract_cmd', None) if pytesseract is not None else None,
@@ -1,21 +1,26 @@
 from __future__ import annotations
 from typing import Any, Dict, Optional
 from pathlib import Path
+from functools import lru_cache
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 import os
-import hashlib
 import datetime as _dt
+from time import monotonic, sleep
+import logging
 import re as _re
 import sqlite3 as _sqlite3
-import html as _html
+import threading
+from contextlib import contextmanager
 router = APIRouter(prefix="/api/power", tags=["power-cua-only"])
+_log = logging.getLogger(__name__)
 
 # Soft import CUA adapter
 try:
     from .cua_adapter import (
         cua_runtime_status,
         select_snap_assist_tile,
+        select_snap_assist_tile_any,
         snap_current_and_select,
         trigger_snap,
         capture_inline_selection,
@@ -36,6 +41,7 @@ try:
         arrange_three_columns,
         arrange_right_stack,
         layout_left_right_stack,
+        layout_any_right_stack,
             snap_to,
     )  # type: ignore
 except Exception:  # pragma: no cover
@@ -43,6 +49,7 @@ except Exception:  # pragma: no cover
         from cua_adapter import (
             cua_runtime_status,
             select_snap_assist_tile,
+            select_snap_assist_tile_any,
             snap_current_and_select,
             trigger_snap,
             capture_inline_selection,
@@ -61,12 +68,57 @@ except Exception:  # pragma: no cover
             paste_text_to_foreground_app,
             paste_rich_text_to_foreground_app,
             arrange_three_columns,
+            arrange_right_stack,
             layout_left_right_stack,
+            layout_any_right_stack,
             snap_to,
         )  # type: ignore
     except Exception:
-        cua_runtime_status = None  # type: ignore
-        select_snap_assist_tile = None  # type: ignore
+        pass
+
+# Resolve the optional CUA helpers once: each is either a callable or None, so call sites can
+# test `helper is not None` and never hit an undefined name when the adapter import failed.
+_CUA_HELPERS = (
+    'cua_runtime_status', 'select_snap_assist_tile', 'select_snap_assist_tile_any', 'snap_current_and_select',
+    'trigger_snap',
+    'capture_inline_selection', 'capture_full_document_text_and_restore_selection',
+    'cua_open_path', 'cua_open_path_background', 'cua_open_vscode', 'cua_open_browser_to_path',
+    'wait_for_focus', 'focus_previous_window', 'focus_window_by_tokens', 'wait_for_window_appearance',
+    'ensure_focus', 'ensure_focus_top', 'get_focused_window_name',
+    'paste_text_to_foreground_app', 'paste_rich_text_to_foreground_app',
+    'arrange_three_columns', 'arrange_right_stack', 'layout_left_right_stack', 'layout_any_right_stack', 'snap_to',
+)
+for _name in _CUA_HELPERS:
+    if not callable(globals().get(_name)):
+        globals()[_name] = None
+del _name
+
+
+# Snap Assist tile token sets for picking the SarvajñaGPT browser tab (title variants x browser
+# brands), then generic browser-only fallbacks. Built once; the adapter only reads them.
+_BROWSER_BRANDS = ("microsoft edge", "google chrome", "mozilla firefox", "brave")
+_SAR_BROWSER_TOKENS: tuple[tuple[str, ...], ...] = tuple(
+    (name, brand)
+    for brand in _BROWSER_BRANDS
+    for name in ("sarvajnagpt", "sarvajna gpt", "sarvajña", "sarvajna")
+)
+_GENERIC_BROWSER_TOKENS: tuple[tuple[str, ...], ...] = tuple((brand,) for brand in _BROWSER_BRANDS)
+# Window-title tokens for the three-pane (app | browser | code) layouts; callers copy them into
+# per-request lists together with the file-specific titles.
+_SAR_APP_TOKENS = ("sarvajña", "sarvajna", "sarvajnagpt", "sarvajna gpt")
+_EDGE_CHROME_TOKENS = ("microsoft edge", "edge", "google chrome", "chrome")
+_VSCODE_TOKENS = ("visual studio code", "vs code", "vscode", "code")
+# Substrings that identify a SarvajñaGPT / browser tile name in lowercased snap diagnostics
+# ("sarvajnagpt" contains "sarvajna", so it needs no entry of its own)
+_SARVAJ_NAME_TOKENS = ("sarvajna", "sarvajña")
+_BROWSER_NAME_TOKENS = ("chrome", "edge", "firefox", "brave")
+# File types opened next to the app as a Word document vs. in a code editor
+_WORD_SUFFIXES = frozenset({".doc", ".docx", ".rtf"})
+_CODE_LIKE_SUFFIXES = frozenset({".py", ".js", ".ts", ".tsx", ".jsx", ".html", ".css"})
+# Reported when no snap was attempted; shared and never mutated
+_EMPTY_SNAP: Dict[str, Any] = {"attempted": False, "selected": False}
+# Window-title hints for a browser preview window
+_BROWSER_TITLE_TOKENS = ("microsoft edge", "edge", "google chrome", "chrome", "mozilla firefox", "firefox", "brave")
 
 
 class OpenDocCUARequest(BaseModel):
@@ -75,10 +127,58 @@ class OpenDocCUARequest(BaseModel):
 
 
 # ----------------------------- Text cleaning utils -----------------------------
+# Markdown/LLM-output patterns, compiled once instead of per call / per line
+_THINK_RE = _re.compile(r"<think[^>]*>.*?</think>", _re.I | _re.S)
+_HEADING_RE = _re.compile(r"^\s*#{1,6}\s*")
+# Matches: **bold**, __bold__, *italic*, _italic_
+_INLINE_EMPH_RE = _re.compile(r"(\*\*[^*]+\*\*|__[^_]+__|\*[^*]+\*|_[^_]+_)")
+
+
+def _md_bullet_item(lstr: str) -> Optional[str]:
+    """'- text' / '* text' (already left-stripped) -> 'text'; None if not a bullet line."""
+    if lstr[:1] in ('-', '*') and lstr[1:2].isspace():
+        return lstr[2:].lstrip()
+    return None
+
+
+def _md_ordered_item(lstr: str) -> Optional[str]:
+    """'12. text' / '3) text' (already left-stripped) -> 'text'; None if not a numbered line."""
+    i = 0
+    n = len(lstr)
+    while i < n and lstr[i].isdecimal():
+        i += 1
+    if i and lstr[i:i + 1] in ('.', ')') and lstr[i + 1:i + 2].isspace():
+        return lstr[i + 2:].lstrip()
+    return None
+
+
+_MD_EMPH_DROP = str.maketrans('', '', '*_`')
+
+
+def _strip_emph_chars(line: str) -> str:
+    """Drop emphasis/code markers (*, _, `) in one translate pass, keeping a leading '* ' bullet."""
+    # Only the leading run of whitespace/marker characters can form the bullet; resolve it the
+    # way the sequential '**', '__', '`' removals would before deciding
+    i = 0
+    n = len(line)
+    while i < n and (line[i] in '*_`' or line[i].isspace()):
+        i += 1
+    head = line[:i].replace("**", "").replace("__", "").replace("`", "")
+    stripped = head.lstrip()
+    if stripped.startswith("* "):
+        prefix_len = len(head) - len(stripped)
+        return head[:prefix_len] + "* " + (stripped[2:] + line[i:]).translate(_MD_EMPH_DROP)
+    return line.translate(_MD_EMPH_DROP)
+
+
 def _strip_think_blocks(s: str) -> str:
     """Remove <think>...</think> blocks (case-insensitive, multiline)."""
+    s = s or ""
+    # Fast path: most outputs have no think block, so skip the DOTALL regex entirely
+    if "<" not in s or "<think" not in s.lower():
+        return s.strip()
     try:
-        return _re.sub(r"(?is)<think[^>]*>.*?</think>", "", s or "").strip()
+        return _THINK_RE.sub("", s).strip()
     except Exception:
         return s or ""
 
@@ -92,28 +192,16 @@ def _plain_from_markdown(md: str) -> str:
     lines = (s or "").splitlines()
     out_lines: list[str] = []
     in_code = False
-    for line in lines:
-        l = line.rstrip("\n\r")
-        if l.strip().startswith("```"):
+    # splitlines() already drops terminators; only leading whitespace matters for the fence check
+    for l in lines:
+        if l.lstrip().startswith("```"):
             in_code = not in_code
             continue  # drop fence lines
         if not in_code:
             # Strip heading markers at start
-            l = _re.sub(r"^\s*#{1,6}\s*", "", l)
-            # Remove bold/italic markers
-            l = l.replace("**", "").replace("__", "")
-            l = l.replace("`", "")
-            stripped = l.lstrip()
-            if stripped.startswith("* "):
-                # keep leading '* ' as bullet
-                # remove other stray '*' in the line
-                prefix_len = len(l) - len(stripped)
-                l = l[:prefix_len] + "* " + stripped[2:].replace("*", "")
-            else:
-                # remove stray '*' used for italics
-                l = l.replace("*", "")
-            # remove stray '_' used for italics
-            l = l.replace("_", "")
+            l = _HEADING_RE.sub("", l)
+            # Remove bold/italic/code markers, keeping a leading '* ' as bullet
+            l = _strip_emph_chars(l)
         out_lines.append(l)
     return ("\n".join(out_lines)).strip()
 
@@ -143,6 +231,45 @@ def _strip_meta_disclaimers(s: str) -> str:
         return s or ""
 
 
+def _docx_add_formatted_paragraph(doc, text: str, style: Any = None):
+    """Append a paragraph to a python-docx Document, rendering **bold**/__bold__ and *italic*/_italic_ runs."""
+    p = doc.add_paragraph()
+    if style:
+        try:
+            p.style = style
+        except Exception:
+            pass
+    # Inline bold/italic parsing
+    idx = 0
+    for m in _INLINE_EMPH_RE.finditer(text):
+        if m.start() > idx:
+            p.add_run(text[idx:m.start()])
+        chunk = m.group(0)
+        run_text = chunk
+        run_bold = False
+        run_italic = False
+        if chunk.startswith("**") and chunk.endswith("**"):
+            run_text = chunk[2:-2]
+            run_bold = True
+        elif chunk.startswith("__") and chunk.endswith("__"):
+            run_text = chunk[2:-2]
+            run_bold = True
+        elif chunk.startswith("*") and chunk.endswith("*"):
+            run_text = chunk[1:-1]
+            run_italic = True
+        elif chunk.startswith("_") and chunk.endswith("_"):
+            run_text = chunk[1:-1]
+            run_italic = True
+        r = p.add_run(run_text)
+        if run_bold:
+            r.bold = True
+        if run_italic:
+            r.italic = True
+        idx = m.end()
+    if idx < len(text):
+        p.add_run(text[idx:])
+
+
 def _docx_from_markdown(md: str, out_path: str) -> bool:
     """Create a .docx file from Markdown with minimal formatting (headings, bullets, bold/italic).
     Returns True on success. Falls back to plain text if python-docx isn't available.
@@ -158,52 +285,21 @@ def _docx_from_markdown(md: str, out_path: str) -> bool:
             return False
     try:
         doc = docx.Document()
-
-        def add_formatted_paragraph(text: str, style: str | None = None):
-            p = doc.add_paragraph()
-            if style:
-                try:
-                    p.style = style
-                except Exception:
-                    pass
-            # Inline bold/italic parsing
-            # Matches: **bold**, __bold__, *italic*, _italic_
-            pattern = _re.compile(r"(\*\*[^*]+\*\*|__[^_]+__|\*[^*]+\*|_[^_]+_)")
-            idx = 0
-            for m in pattern.finditer(text):
-                if m.start() > idx:
-                    p.add_run(text[idx:m.start()])
-                chunk = m.group(0)
-                run_text = chunk
-                run_bold = False
-                run_italic = False
-                if chunk.startswith("**") and chunk.endswith("**"):
-                    run_text = chunk[2:-2]
-                    run_bold = True
-                elif chunk.startswith("__") and chunk.endswith("__"):
-                    run_text = chunk[2:-2]
-                    run_bold = True
-                elif chunk.startswith("*") and chunk.endswith("*"):
-                    run_text = chunk[1:-1]
-                    run_italic = True
-                elif chunk.startswith("_") and chunk.endswith("_"):
-                    run_text = chunk[1:-1]
-                    run_italic = True
-                r = p.add_run(run_text)
-                if run_bold:
-                    r.bold = True
-                if run_italic:
-                    r.italic = True
-                idx = m.end()
-            if idx < len(text):
-                p.add_run(text[idx:])
-
+        # Resolve paragraph styles once per document; assigning a style object skips the
+        # by-name style lookup python-docx would otherwise repeat for every paragraph
+        styles: Dict[str, Any] = {}
+        for name in ('Heading 1', 'Heading 2', 'Heading 3', 'List Bullet', 'List Number'):
+            try:
+                styles[name] = doc.styles[name]
+            except Exception:
+                pass
         s = _strip_think_blocks(md or "")
         lines = s.splitlines()
         in_code = False
-        for raw in lines:
-            line = raw.rstrip("\n\r")
-            if line.strip().startswith("```"):
+        # splitlines() already drops terminators; left-strip once per line for every prefix check
+        for line in lines:
+            lstr = line.lstrip()
+            if lstr.startswith("```"):
                 in_code = not in_code
                 continue
             if in_code:
@@ -211,32 +307,31 @@ def _docx_from_markdown(md: str, out_path: str) -> bool:
                 doc.add_paragraph(line)
                 continue
             # Headings
-            if line.lstrip().startswith("### "):
-                add_formatted_paragraph(line.lstrip()[4:], style='Heading 3')
+            if lstr.startswith("### "):
+                _docx_add_formatted_paragraph(doc, lstr[4:], style=styles.get('Heading 3'))
                 continue
-            if line.lstrip().startswith("## "):
-                add_formatted_paragraph(line.lstrip()[3:], style='Heading 2')
+            if lstr.startswith("## "):
+                _docx_add_formatted_paragraph(doc, lstr[3:], style=styles.get('Heading 2'))
                 continue
-            if line.lstrip().startswith("# "):
-                add_formatted_paragraph(line.lstrip()[2:], style='Heading 1')
+            if lstr.startswith("# "):
+                _docx_add_formatted_paragraph(doc, lstr[2:], style=styles.get('Heading 1'))
                 continue
             # Lists
-            lstr = line.lstrip()
             if lstr.startswith("- ") or lstr.startswith("* "):
                 try:
-                    add_formatted_paragraph(lstr[2:], style='List Bullet')
+                    _docx_add_formatted_paragraph(doc, lstr[2:], style=styles.get('List Bullet'))
                 except Exception:
                     doc.add_paragraph(lstr[2:])
                 continue
-            if _re.match(r"^\s*\d+[\.)]\s+", line):
-                item = _re.sub(r"^\s*\d+[\.)]\s+", "", line)
+            item = _md_ordered_item(lstr)
+            if item is not None:
                 try:
-                    add_formatted_paragraph(item, style='List Number')
+                    _docx_add_formatted_paragraph(doc, item, style=styles.get('List Number'))
                 except Exception:
                     doc.add_paragraph(item)
                 continue
             # Paragraph
-            add_formatted_paragraph(line)
+            _docx_add_formatted_paragraph(doc, line)
 
         doc.save(out_path)
         return True
@@ -248,91 +343,186 @@ def _docx_from_markdown(md: str, out_path: str) -> bool:
             return False
 
 
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def _docx_paragraph_texts(path: str, max_chars: Optional[int] = None) -> list[str]:
+    """Non-empty paragraph texts of a .docx, streamed from word/document.xml.
+    Skips python-docx's object model (styles, numbering, relationships) when only the text is needed;
+    with max_chars, parsing stops once slightly more than that much text has been collected.
+    """
+    import zipfile
+    import xml.etree.ElementTree as ET
+    p_tag, t_tag, tab_tag, br_tag, cr_tag = _W_NS + 'p', _W_NS + 't', _W_NS + 'tab', _W_NS + 'br', _W_NS + 'cr'
+    limit = (max_chars + 1024) if max_chars else None
+    paragraphs: list[str] = []
+    running_len = 0
+    with zipfile.ZipFile(path) as z, z.open('word/document.xml') as fh:
+        for _event, para in ET.iterparse(fh, events=('end',)):
+            if para.tag != p_tag:
+                continue
+            parts: list[str] = []
+            for el in para.iter():
+                tag = el.tag
+                if tag == t_tag:
+                    parts.append(el.text or '')
+                elif tag == tab_tag:
+                    parts.append('\t')
+                elif tag == br_tag or tag == cr_tag:
+                    parts.append('\n')
+            # Drop the parsed subtree (also keeps a nested text-box paragraph from repeating in its parent)
+            para.clear()
+            text = ''.join(parts)
+            if text.strip():
+                paragraphs.append(text)
+                running_len += len(text) + 1
+                if limit is not None and running_len >= limit:
+                    break
+    return paragraphs
+
+
+def _join_capped(paragraphs: list[str], max_chars: int) -> str:
+    """'\n'.join(paragraphs)[:max_chars] without building the full joined string first."""
+    parts: list[str] = []
+    total = 0
+    for para in paragraphs:
+        sep = 1 if parts else 0
+        if total + sep + len(para) > max_chars:
+            # Keep the prefix of the paragraph that crosses the cap, as slicing would
+            room = max_chars - total - sep
+            if room > 0:
+                parts.append(para[:room])
+            elif room == 0 and sep:
+                parts.append('')
+            break
+        parts.append(para)
+        total += sep + len(para)
+    return '\n'.join(parts)
+
+
+def _rtf_esc(s: str) -> str:
+    # Most prose has no RTF metacharacters: skip the three replace passes entirely
+    if '\\' not in s and '{' not in s and '}' not in s:
+        return s
+    return s.replace('\\', r'\\').replace('{', r'\{').replace('}', r'\}')
+
+
+def _rtf_fmt_inline(s0: str, out: list[str]) -> None:
+    """Append RTF for raw markdown text to out: **bold**/__bold__ and *italic*/_italic_ runs, escaped once."""
+    idx = 0
+    for m in _INLINE_EMPH_RE.finditer(s0):
+        out.append(_rtf_esc(s0[idx:m.start()]))
+        tok = m.group(0)
+        # Trailing space after \b0/\i0 is the control-word delimiter, so following digits
+        # can't be read as its parameter
+        if tok[:2] in ('**', '__'):
+            out.append(r'\b ' + _rtf_esc(tok[2:-2]) + r'\b0 ')
+        else:
+            out.append(r'\i ' + _rtf_esc(tok[1:-1]) + r'\i0 ')
+        idx = m.end()
+    out.append(_rtf_esc(s0[idx:]))
+
+
 def _rtf_from_markdown(md: str) -> str:
     """Convert minimal Markdown to simple RTF supporting bold/italic and basic paragraphs/lists.
     This is not exhaustive but handles common inline formatting like **bold** and *italic*.
     """
-    def esc(s: str) -> str:
-        s = s.replace('\\', r'\\').replace('{', r'\{').replace('}', r'\}')
-        # Replace newlines with RTF paragraph breaks
-        return s
     s = _strip_think_blocks(md or '')
     lines = s.splitlines()
     parts = [r'{\rtf1\ansi\deff0']
     in_code = False
-    for raw in lines:
-        line = raw.rstrip('\r\n')
-        if line.strip().startswith('```'):
+    # splitlines() already drops terminators; left-strip once per line for every prefix check
+    for line in lines:
+        lstr = line.lstrip()
+        if lstr.startswith('```'):
             in_code = not in_code
             # Emit a paragraph break on fence toggle
             parts.append('\\par ')
             continue
-        txt = esc(line)
-        # Inline bold/italic
-        # Process bold first, then italic, using a scan loop to avoid overlap issues
-        def fmt_inline(s0: str) -> str:
-            out = ''
-            i = 0
-            while i < len(s0):
-                if s0.startswith('**', i):
-                    j = s0.find('**', i + 2)
-                    if j != -1:
-                        content = s0[i+2:j]
-                        out += r'\b ' + esc(content) + r'\b0'
-                        i = j + 2
-                        continue
-                if s0.startswith('__', i):
-                    j = s0.find('__', i + 2)
-                    if j != -1:
-                        content = s0[i+2:j]
-                        out += r'\b ' + esc(content) + r'\b0'
-                        i = j + 2
-                        continue
-                if s0.startswith('*', i):
-                    j = s0.find('*', i + 1)
-                    if j != -1:
-                        content = s0[i+1:j]
-                        out += r'\i ' + esc(content) + r'\i0'
-                        i = j + 1
-                        continue
-                if s0.startswith('_', i):
-                    j = s0.find('_', i + 1)
-                    if j != -1:
-                        content = s0[i+1:j]
-                        out += r'\i ' + esc(content) + r'\i0'
-                        i = j + 1
-                        continue
-                out += s0[i]
-                i += 1
-            return out
-        txt = fmt_inline(txt)
-        if _re.match(r'^\s*[-*]\s+', line):
-            content = _re.sub(r'^\s*[-*]\s+', '', line)
-            parts.append(r'\bullet\tab ' + fmt_inline(esc(content)) + r'\par ')
-        elif _re.match(r'^\s*\d+[\.)]\s+', line):
-            content = _re.sub(r'^\s*\d+[\.)]\s+', '', line)
-            parts.append(fmt_inline(esc(content)) + r'\par ')
+        # Cheap first-character probes instead of anchored regexes on every line
+        content = _md_bullet_item(lstr)
+        # Pieces go straight into the one output list; joined once at the end
+        if content is not None:
+            parts.append(r'\bullet\tab ')
         else:
-            parts.append(txt + r'\par ')
+            content = _md_ordered_item(lstr)
+            if content is None:
+                content = line
+        _rtf_fmt_inline(content, parts)
+        parts.append(r'\par ')
     parts.append('}')
     return ''.join(parts)
 
 
+# Exact opening-fence tags (through the end of the line), so ```json / ```jsx don't count as ```js
+_CODE_FENCE_LANGS = tuple(
+    (f"```{tag}{eol}", lang)
+    for tag, lang in (('python', 'python'), ('typescript', 'typescript'), ('javascript', 'javascript'), ('js', 'javascript'))
+    for eol in ('\n', '\r\n')
+)
+
+
+
+def _has_fence(lt: str, lang: str) -> bool:
+    return any(marker in lt for marker, fence_lang in _CODE_FENCE_LANGS if fence_lang == lang)
+
+
 def _guess_code_language(text: str) -> str:
-    lt = (text or '').lower()
+    text = text or ''
+    # LLM fences almost always open within the first few KB: decide from the head before touching the full text
+    head = text[:4096].lower()
+    # HTML first: a reply that holds a full page wins over a small JSON/Python snippet ahead of it
+    if '```html' in head or '<!doctype html' in head[:200] or '<html' in head:
+        return 'html'
+    for marker, lang in _CODE_FENCE_LANGS:
+        if marker in head:
+            return lang
+    lt = text.lower() if len(text) > 4096 else head
     if '```html' in lt or '<html' in lt or 'doctype html' in lt or 'html>' in lt:
         return 'html'
     if ('website' in lt or 'landing page' in lt or 'web page' in lt) and ('section' in lt or 'css' in lt or 'hero' in lt or 'navbar' in lt):
         return 'html'
-    if '```python' in lt or 'def ' in lt and 'import ' in lt:
+    if _has_fence(lt, 'python') or ('def ' in lt and 'import ' in lt):
         return 'python'
-    if '```typescript' in lt or 'typescript' in lt:
+    if _has_fence(lt, 'typescript') or 'typescript' in lt:
         return 'typescript'
-    if '```javascript' in lt or '```js' in lt or '<script' in lt:
+    if _has_fence(lt, 'javascript') or '<script' in lt:
         return 'javascript'
     return 'plain'
 
 
+def _fenced_blocks(s: str) -> list[tuple[str, str]]:
+    """(lang, body) for each ```lang ... ``` block, found by a single line scan.
+    Fences count only at the start of a line (after optional indentation), so backticks quoted
+    in prose never open or close a block; an opening fence's info string must be one word.
+    Linear even when the LLM leaves a fence unterminated (no regex backtracking to end-of-text).
+    """
+    blocks: list[tuple[str, str]] = []
+    open_lang: Optional[str] = None
+    body_start = 0
+    i = 0
+    n = len(s)
+    while i <= n:
+        nl = s.find("\n", i)
+        end = n if nl < 0 else nl
+        j = i
+        while j < end and s[j] in " \t":
+            j += 1
+        if s.startswith("```", j):
+            if open_lang is None:
+                info = s[j + 3:end].strip()
+                if not any(ch.isspace() or ch == "`" for ch in info):
+                    open_lang = info.lower()
+                    body_start = end + 1
+            else:
+                blocks.append((open_lang, s[body_start:i]))
+                open_lang = None
+        if nl < 0:
+            break
+        i = nl + 1
+    return blocks
+
+
 def _extract_code_from_llm(text: str, lang_hint: Optional[str] = None) -> str:
     """Extract code-only content from LLM output.
     - Prefer fenced code blocks for the detected or hinted language.
@@ -343,15 +533,12 @@ def _extract_code_from_llm(text: str, lang_hint: Optional[str] = None) -> str:
     lhint = (lang_hint or '').lower() if lang_hint else None
     # 1) Try fenced code blocks
     try:
-        fence_re = _re.compile(r"```([a-zA-Z0-9]+)?\n([\s\S]*?)```", _re.MULTILINE)
-        matches = list(fence_re.finditer(s))
-        if matches:
+        blocks = _fenced_blocks(s)
+        if blocks:
             # If language hinted, pick that; else pick the longest block
             best = None
             best_len = -1
-            for m in matches:
-                lang = (m.group(1) or '').lower()
-                body = m.group(2) or ''
+            for lang, body in blocks:
                 if lhint and lang and lhint in lang:
                     return body.strip()
                 if len(body) > best_len:
@@ -361,11 +548,12 @@ def _extract_code_from_llm(text: str, lang_hint: Optional[str] = None) -> str:
                 return best.strip()
     except Exception:
         pass
-    # 2) HTML region extraction
-    if (lhint == 'html') or ('<html' in s.lower() and '</html>' in s.lower()):
+    # 2) HTML region extraction (one lowercase snapshot; slice the original to keep casing)
+    sl = s.lower()
+    if (lhint == 'html') or ('<html' in sl and '</html>' in sl):
         try:
-            start = s.lower().find('<html')
-            end = s.lower().rfind('</html>')
+            start = sl.find('<html')
+            end = sl.rfind('</html>')
             if start != -1 and end != -1:
                 return s[start:end+7].strip()
         except Exception:
@@ -374,35 +562,53 @@ def _extract_code_from_llm(text: str, lang_hint: Optional[str] = None) -> str:
     lines = s.splitlines()
     out = []
     for line in lines:
-        if line.strip().startswith('```'):
+        ls = line.strip()
+        if ls.startswith('```'):
             continue
-        if line.strip().startswith(('#', '###', '####', 'Notes:', 'Note:', '>')):
+        if ls.startswith(('#', '###', '####', 'Notes:', 'Note:', '>')):
             continue
         # Skip list bullets unless it's HTML tags
-        if line.strip().startswith(('- ', '* ')) and not line.strip().startswith(('<', '</')):
+        if ls.startswith(('- ', '* ')) and not ls.startswith(('<', '</')):
             continue
         out.append(line)
     return '\n'.join(out).strip()
 
 
+_TITLE_RE = _re.compile(rb"<title[^>]*>(.*?)</title>", _re.I | _re.S)
+
+
+@lru_cache(maxsize=256)
+def _html_title_cached(path_str: str, mtime_ns: int, size: int) -> Optional[str]:
+    """Title lookup keyed by (path, mtime, size) so re-opening an unchanged file skips the read."""
+    import html as _html  # only needed here; keep it off the router import path
+    import mmap
+    try:
+        if size <= 0:
+            return None
+        # Scan the first 128KB (which should include <head>) as raw bytes straight from a
+        # read-only mapping; only the matched title is decoded
+        with open(path_str, 'rb') as f, mmap.mmap(f.fileno(), min(131072, size), access=mmap.ACCESS_READ) as mm:
+            m = _TITLE_RE.search(mm)
+            if not m:
+                return None
+            t = (m.group(1) or b'').decode('utf-8', 'ignore')
+        t = _html.unescape(t.strip())
+        # Normalize internal whitespace (str.split handles any whitespace run, no regex needed)
+        t = " ".join(t.split())
+        return t[:256] if t else None
+    except Exception:
+        return None
+
+
 def _html_title_from_file(path: Path) -> Optional[str]:
     """Best-effort extraction of the <title>...</title> from an HTML file.
     Returns a trimmed, HTML-unescaped title string or None.
     """
     try:
-        # Read the first 128KB which should include <head>
-        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-            chunk = f.read(131072)
-        m = _re.search(r"(?is)<title[^>]*>(.*?)</title>", chunk)
-        if not m:
-            return None
-        t = m.group(1) or ''
-        t = _html.unescape(t.strip())
-        # Normalize internal whitespace
-        t = _re.sub(r"\s+", " ", t)
-        return t[:256] if t else None
+        st = os.stat(path)
     except Exception:
         return None
+    return _html_title_cached(str(path), st.st_mtime_ns, st.st_size)
 
 
 # ---------------------------------------------------------------------------
@@ -416,9 +622,63 @@ class OpenDocIntelligentlyRequest(BaseModel):
     snap: bool | None = Field(True, description="Alias for split_screen; when True, attempt selection")
 
 
+@lru_cache(maxsize=512)
+def _open_doc_signature(abs_path: str) -> str:
+    import hashlib  # only needed here; keep it off the router import path
+    base = f"open_doc:{abs_path}".encode('utf-8')
+    try:
+        # Idempotency key, not a security digest: skip the FIPS-restricted path where enforced
+        return hashlib.md5(base, usedforsecurity=False).hexdigest()
+    except TypeError:  # Python < 3.9
+        return hashlib.md5(base).hexdigest()
+
+
 def compute_open_doc_signature(req: 'OpenDocIntelligentlyRequest') -> str:
-    base = f"open_doc:{os.path.abspath(req.abs_path)}"
-    return hashlib.md5(base.encode('utf-8')).hexdigest()
+    # Normalize before the cache lookup so relative paths can't go stale across cwd changes
+    return _open_doc_signature(os.path.abspath(req.abs_path))
+
+
+def _attempt_snap_select(primary: tuple[tuple[str, ...], ...], generic: tuple[tuple[str, ...], ...], side: str, budget: float, generic_budget: float = 2.0) -> Dict[str, Any]:
+    """Snap the foreground window to `side` and pick a browser tile for the other half.
+
+    1. Trigger snap once with `primary[0]`, then try the other primary variants in one tile walk within `budget` s.
+    2. If the snap diagnostics saw SarvajñaGPT-looking tiles, target up to 4 of them by name.
+    3. Otherwise re-trigger with `generic[0]` and try the rest in one walk within `generic_budget` s.
+    A walk that matches nothing falls back to the full select_snap_assist_tile() on its first set.
+    """
+    def _select_any(token_sets: list[list[str]], secs: float) -> None:
+        # One Snap Assist walk tests every candidate set (then the full matcher on the first set)
+        if snap.get("selected") or not token_sets or select_snap_assist_tile_any is None:
+            return
+        try:
+            res = select_snap_assist_tile_any(token_sets, timeout_ms=int(secs * 1000))
+            if res.get("selected"):
+                snap["selected"] = True
+                snap["tokens"] = res.get("tokens")
+        except Exception:
+            pass
+
+    # Trigger snap once using the first tokens
+    snap = snap_current_and_select(primary[0], snap_side=side)  # type: ignore[misc]
+    # Within the budget, try alternative tokens WITHOUT re-triggering snap
+    _select_any([list(t) for t in primary[1:]], budget)
+    # Diagnostics-guided retry: if a tile containing SarvajñaGPT was seen, target it explicitly
+    if not snap.get("selected") and isinstance(snap.get("diagnostics"), dict):
+        try:
+            diag = snap.get("diagnostics") or {}
+            sar_cands = [n for n in map(str, diag.get("unique_names") or ()) if any(t in n.lower() for t in _SARVAJ_NAME_TOKENS)]
+            # Exact name first, then with browser brand hints; up to 4 distinct candidates
+            _select_any([s for cand in sar_cands[:4] for s in ([cand], *([cand, brand] for brand in _BROWSER_BRANDS))], budget)
+        except Exception:
+            pass
+    # If still not selected, re-trigger once with generic browser tokens and allow brief follow-ups
+    if not snap.get("selected"):
+        try:
+            snap = snap_current_and_select(generic[0], snap_side=side)  # type: ignore[misc]
+        except Exception:
+            pass
+        _select_any([list(t) for t in generic[1:]], generic_budget)
+    return snap
 
 
 def open_doc_intelligently(req: 'OpenDocIntelligentlyRequest') -> Dict[str, Any]:
@@ -433,51 +693,50 @@ def open_doc_intelligently(req: 'OpenDocIntelligentlyRequest') -> Dict[str, Any]
         raise HTTPException(status_code=400, detail="abs_path not found")
     # Determine file type
     suffix = p.suffix.lower()
-    is_code_like = suffix in {".py", ".js", ".ts", ".tsx", ".jsx", ".html", ".css"}
-    is_word_like = suffix in {".doc", ".docx", ".rtf"}
+    is_code_like = suffix in _CODE_LIKE_SUFFIXES
+    is_word_like = suffix in _WORD_SUFFIXES
     # Launch: Word in background; Code via VS Code in a NEW window; others normal
-    if is_word_like and callable(cua_open_path_background):
+    if is_word_like and cua_open_path_background is not None:
         r_launch = cua_open_path_background(str(p))  # type: ignore[misc]
-        if not r_launch.get("ok") and callable(cua_open_path):
+        if not r_launch.get("ok") and cua_open_path is not None:
             r_launch = cua_open_path(str(p))  # fallback
-    elif is_code_like and callable(cua_open_vscode):
+    elif is_code_like and cua_open_vscode is not None:
         try:
             r_launch = cua_open_vscode(str(p), True)  # type: ignore[misc]
         except Exception:
             r_launch = {"ok": False, "error": "vscode_launch_failed"}
-        if not r_launch.get("ok") and callable(cua_open_path):
+        if not r_launch.get("ok") and cua_open_path is not None:
             r_launch = cua_open_path(str(p))
     else:
-        r_launch = cua_open_path(str(p)) if callable(cua_open_path) else {"ok": False, "error": "helper_missing"}
+        r_launch = cua_open_path(str(p)) if cua_open_path is not None else {"ok": False, "error": "helper_missing"}
     launched = bool(r_launch.get("ok"))
 
+    # Window-title token lists for this document, built once and shared by every wait/focus call
+    stem = p.stem
+    stem_space = stem.replace("-", " ")
+    code_tokens = [p.name, stem, "visual studio code", "code"]
+    word_tokens = [stem, "microsoft word", "word"]
+
     # If HTML: open a browser preview in a separate window to enable reliable selection
     browser_info = None
     tri_snap = None
-    if launched and suffix == '.html' and callable(cua_open_browser_to_path):
+    if launched and suffix == '.html' and cua_open_browser_to_path is not None:
         try:
             browser_info = cua_open_browser_to_path(str(p), new_window=True)
         except Exception:
             browser_info = {"ok": False, "error": "browser_launch_failed"}
         # Wait briefly for the preview window to appear so selection can target it by file stem
+        html_title = _html_title_from_file(p)
+        lead = [html_title] if html_title else []
         try:
-            stem = p.stem
-            html_title = _html_title_from_file(p)
-            stem_space = stem.replace("-", " ")
-            if callable(wait_for_window_appearance):
-                wait_tokens = [p.name, stem, stem_space, p.stem, "microsoft edge", "edge", "google chrome", "chrome", "mozilla firefox", "firefox", "brave"]
-                if html_title:
-                    wait_tokens = [html_title] + wait_tokens
-                _ = wait_for_window_appearance(wait_tokens, timeout_ms=7000)
+            if wait_for_window_appearance is not None:
+                _ = wait_for_window_appearance([*lead, p.name, stem, stem_space, *_BROWSER_TITLE_TOKENS], timeout_ms=7000)
         except Exception:
             pass
         # Pre-warm: ensure the preview window is in the recent MRU by briefly focusing it, then return to our app
         try:
-            if callable(focus_window_by_tokens):
-                focus_tokens = [stem, stem_space, "microsoft edge", "edge", "google chrome", "chrome", "mozilla firefox", "firefox", "brave"]
-                if html_title:
-                    focus_tokens = [html_title] + focus_tokens
-                focus_window_by_tokens(focus_tokens)  # bring preview forward once
+            if focus_window_by_tokens is not None:
+                focus_window_by_tokens([*lead, stem, stem_space, *_BROWSER_TITLE_TOKENS])  # bring preview forward once
                 # return focus to our app window before snapping
                 focus_window_by_tokens(["sarvajña", "sarvajna"])  # best-effort
         except Exception:
@@ -487,7 +746,6 @@ def open_doc_intelligently(req: 'OpenDocIntelligentlyRequest') -> Dict[str, Any]
     snap = None
     if want_snap:
         # Prefer exact document stem for Word selection; keep search minimal.
-        stem = p.stem
         tokens = [stem]
         # For Word files, only add a single Word hint. Avoid broad, noisy tokens.
         if is_word_like and not is_code_like:
@@ -495,231 +753,76 @@ def open_doc_intelligently(req: 'OpenDocIntelligentlyRequest') -> Dict[str, Any]
         # For Code: wait for VS Code window to appear and focus it (so we can snap Code LEFT)
         if is_code_like and suffix != '.html':
             try:
-                if callable(wait_for_window_appearance):
-                    _ = wait_for_window_appearance([p.name, p.stem, "visual studio code", "code"], timeout_ms=2000)
+                if wait_for_window_appearance is not None:
+                    _ = wait_for_window_appearance(code_tokens, timeout_ms=2000)
                 else:
                     _ = None
             except Exception:
                 _ = None
             try:
-                if callable(focus_window_by_tokens):
-                    focus_window_by_tokens([p.name, p.stem, "visual studio code", "code"])  # best-effort focus on Code
-                elif callable(wait_for_focus):
-                    wait_for_focus([p.name, p.stem, "visual studio code", "code"], timeout_ms=800)
+                if focus_window_by_tokens is not None:
+                    focus_window_by_tokens(code_tokens)  # best-effort focus on Code
+                elif wait_for_focus is not None:
+                    wait_for_focus(code_tokens, timeout_ms=800)
             except Exception:
                 pass
             try:
-                import time as _t
-                _t.sleep(0.08)
+                sleep(0.08)
             except Exception:
                 pass
         # For Word: wait for Word to appear, then focus Word so we can snap it LEFT
         if is_word_like and not is_code_like:
             try:
-                if callable(wait_for_window_appearance):
-                    _ = wait_for_window_appearance([stem, "microsoft word", "word"], timeout_ms=2000)
+                if wait_for_window_appearance is not None:
+                    _ = wait_for_window_appearance(word_tokens, timeout_ms=2000)
                 else:
                     _ = None
             except Exception:
                 _ = None
             # Focus the Word window explicitly
             try:
-                if callable(focus_window_by_tokens):
-                    focus_window_by_tokens([stem, "microsoft word", "word"])  # best-effort
-                elif callable(wait_for_focus):
-                    wait_for_focus([stem, "microsoft word", "word"], timeout_ms=800)
+                if focus_window_by_tokens is not None:
+                    focus_window_by_tokens(word_tokens)  # best-effort
+                elif wait_for_focus is not None:
+                    wait_for_focus(word_tokens, timeout_ms=800)
             except Exception:
                 pass
             try:
-                import time as _t
-                _t.sleep(0.08)
+                sleep(0.08)
             except Exception:
                 pass
         # Ensure Word remains focused for the snap (skip re-focusing our app)
         if is_word_like and not is_code_like:
             try:
-                if callable(focus_window_by_tokens):
-                    focus_window_by_tokens([stem, "microsoft word", "word"])  # re-affirm focus on Word
+                if focus_window_by_tokens is not None:
+                    focus_window_by_tokens(word_tokens)  # re-affirm focus on Word
             except Exception:
                 pass
         # Try snap+select; if grid not ready, retry once after a brief pause
-        if callable(snap_current_and_select):  # type: ignore[truthy-bool]
+        if snap_current_and_select is not None:
             # For Word: snap Word LEFT and select SarvajñaGPT browser on RIGHT; For Code: snap Code LEFT and select SarvajñaGPT browser on RIGHT; else, default
             is_word_like = is_word_like
             if (not is_code_like) and is_word_like:
-                side = 'left'
-                # Prefer selecting the SarvajñaGPT tab specifically on the RIGHT. Avoid generic browser-only fallbacks.
-                # Include common title variations and normalized forms to improve matching reliability.
-                attempt_sets: list[list[str]] = [
-                    ["sarvajnagpt", "microsoft edge"], ["sarvajna gpt", "microsoft edge"],
-                    ["sarvajña", "microsoft edge"], ["sarvajna", "microsoft edge"],
-                    ["sarvajnagpt", "google chrome"], ["sarvajna gpt", "google chrome"],
-                    ["sarvajña", "google chrome"], ["sarvajna", "google chrome"],
-                    ["sarvajnagpt", "mozilla firefox"], ["sarvajna gpt", "mozilla firefox"],
-                    ["sarvajña", "mozilla firefox"], ["sarvajna", "mozilla firefox"],
-                    ["sarvajnagpt", "brave"], ["sarvajna gpt", "brave"],
-                    ["sarvajña", "brave"], ["sarvajna", "brave"],
-                ]
-                # Fallback: generic browser-only tokens to at least complete the split
-                attempt_sets_generic: list[list[str]] = [
-                    ["microsoft edge"], ["google chrome"], ["mozilla firefox"], ["brave"],
-                ]
-                import time as _tlim
-                snap = {"attempted": True, "selected": False}
-                start = _tlim.time()
-                # Trigger snap once using the first tokens
-                snap = snap_current_and_select(attempt_sets[0], snap_side=side)  # type: ignore[misc]
-                if not snap.get("selected"):
-                    # Within the remaining 2s window, try alternative tokens WITHOUT re-triggering snap
-                    for toks in attempt_sets[1:]:
-                        if (_tlim.time() - start) > 3.0:
-                            break
-                        try:
-                            ok = bool(select_snap_assist_tile(toks)) if callable(select_snap_assist_tile) else False
-                            if ok:
-                                snap["selected"] = True
-                                snap["tokens"] = toks
-                                break
-                        except Exception:
-                            break
-                # Diagnostics-guided retry: if a tile containing SarvajñaGPT was seen, target it explicitly
-                if not snap.get("selected") and isinstance(snap.get("diagnostics"), dict):
-                    try:
-                        diag = snap.get("diagnostics") or {}
-                        names = [str(n) for n in (diag.get("unique_names") or [])]
-                        sar_cands = [n for n in names if ("sarvajna" in n.lower()) or ("sarvajña" in n.lower()) or ("sarvajnagpt" in n.lower())]
-                        if sar_cands and callable(select_snap_assist_tile):
-                            for cand in sar_cands[:4]:  # try up to 4 distinct candidates
-                                try:
-                                    # Try exact-name only, then with browser brand hints
-                                    if bool(select_snap_assist_tile([cand])):
-                                        snap["selected"] = True; snap["tokens"] = [cand]
-                                        break
-                                    for brand in ("microsoft edge", "google chrome", "mozilla firefox", "brave"):
-                                        if bool(select_snap_assist_tile([cand, brand])):
-                                            snap["selected"] = True; snap["tokens"] = [cand, brand]
-                                            break
-                                    if snap.get("selected"):
-                                        break
-                                except Exception:
-                                    continue
-                    except Exception:
-                        pass
-                # If still not selected, re-trigger once with generic tokens and allow brief follow-ups
-                if not snap.get("selected"):
-                    try:
-                        snap = snap_current_and_select(attempt_sets_generic[0], snap_side=side)  # type: ignore[misc]
-                    except Exception:
-                        pass
-                    if not snap.get("selected"):
-                        g_start = _tlim.time()
-                        for toks in attempt_sets_generic[1:]:
-                            if (_tlim.time() - g_start) > 2.0:
-                                break
-                            try:
-                                ok = bool(select_snap_assist_tile(toks)) if callable(select_snap_assist_tile) else False
-                                if ok:
-                                    snap["selected"] = True
-                                    snap["tokens"] = toks
-                                    break
-                            except Exception:
-                                break
+                # Snap Word LEFT, then pick the SarvajñaGPT browser tile on the RIGHT (generic browser fallback)
+                snap = _attempt_snap_select(_SAR_BROWSER_TOKENS, _GENERIC_BROWSER_TOKENS, 'left', 3.0)
             elif is_code_like and suffix != '.html':
-                side = 'left'
-                # Prefer SarvajñaGPT tab for right-side selection in double-split with VS Code
-                attempt_sets: list[list[str]] = [
-                    ["sarvajnagpt", "microsoft edge"], ["sarvajna gpt", "microsoft edge"],
-                    ["sarvajña", "microsoft edge"], ["sarvajna", "microsoft edge"],
-                    ["sarvajnagpt", "google chrome"], ["sarvajna gpt", "google chrome"],
-                    ["sarvajña", "google chrome"], ["sarvajna", "google chrome"],
-                    ["sarvajnagpt", "mozilla firefox"], ["sarvajna gpt", "mozilla firefox"],
-                    ["sarvajña", "mozilla firefox"], ["sarvajna", "mozilla firefox"],
-                    ["sarvajnagpt", "brave"], ["sarvajna gpt", "brave"],
-                    ["sarvajña", "brave"], ["sarvajna", "brave"],
-                ]
-                # Fallback: generic browser tokens to ensure split completes if SarvajñaGPT not visible
-                attempt_sets_generic: list[list[str]] = [["microsoft edge"], ["google chrome"], ["mozilla firefox"], ["brave"]]
-                import time as _tlim
-                snap = {"attempted": True, "selected": False}
-                start = _tlim.time()
-                # Trigger snap once using the first tokens
-                snap = snap_current_and_select(attempt_sets[0], snap_side=side)  # type: ignore[misc]
-                if not snap.get("selected"):
-                    # Within the remaining window, try alternative tokens WITHOUT re-triggering snap
-                    for toks in attempt_sets[1:]:
-                        if (_tlim.time() - start) > 2.2:
-                            break
-                        try:
-                            ok = bool(select_snap_assist_tile(toks)) if callable(select_snap_assist_tile) else False
-                            if ok:
-                                snap["selected"] = True
-                                snap["tokens"] = toks
-                                break
-                        except Exception:
-                            break
-                # Diagnostics-guided retry: explicitly target any visible SarvajñaGPT tiles
-                if not snap.get("selected") and isinstance(snap.get("diagnostics"), dict):
-                    try:
-                        diag = snap.get("diagnostics") or {}
-                        names = [str(n) for n in (diag.get("unique_names") or [])]
-                        sar_cands = [n for n in names if ("sarvajna" in n.lower()) or ("sarvajña" in n.lower()) or ("sarvajnagpt" in n.lower())]
-                        if sar_cands and callable(select_snap_assist_tile):
-                            for cand in sar_cands[:4]:
-                                try:
-                                    if bool(select_snap_assist_tile([cand])):
-                                        snap["selected"] = True; snap["tokens"] = [cand]
-                                        break
-                                    for brand in ("microsoft edge", "google chrome", "mozilla firefox", "brave"):
-                                        if bool(select_snap_assist_tile([cand, brand])):
-                                            snap["selected"] = True; snap["tokens"] = [cand, brand]
-                                            break
-                                    if snap.get("selected"):
-                                        break
-                                except Exception:
-                                    continue
-                    except Exception:
-                        pass
-                # Final generic fallback: re-trigger and try generic brand tokens
-                if not snap.get("selected"):
-                    try:
-                        snap = snap_current_and_select(attempt_sets_generic[0], snap_side=side)  # type: ignore[misc]
-                    except Exception:
-                        pass
-                    if not snap.get("selected"):
-                        g_start = _tlim.time()
-                        for toks in attempt_sets_generic[1:]:
-                            if (_tlim.time() - g_start) > 2.0:
-                                break
-                            try:
-                                ok = bool(select_snap_assist_tile(toks)) if callable(select_snap_assist_tile) else False
-                                if ok:
-                                    snap["selected"] = True
-                                    snap["tokens"] = toks
-                                    break
-                            except Exception:
-                                break
+                # Snap Code LEFT, then pick the SarvajñaGPT browser tile on the RIGHT (generic browser fallback)
+                snap = _attempt_snap_select(_SAR_BROWSER_TOKENS, _GENERIC_BROWSER_TOKENS, 'left', 2.2)
             elif is_code_like and suffix == '.html':
                 # New generic, order-agnostic flow per user request:
                 # 1) Ensure browser+code windows exist, then perform right snap and select tiles without predetermined roles.
                 try:
-                    from .cua_adapter import layout_any_right_stack  # type: ignore
-                except Exception:
-                    try:
-                        from cua_adapter import layout_any_right_stack  # type: ignore
-                    except Exception:
-                        layout_any_right_stack = None  # type: ignore
-                try:
-                    stem_space_arr = p.stem.replace("-", " ")
-                    page_title = html_title if 'html_title' in locals() else _html_title_from_file(p)
-                    code_title1 = f"{p.name} - Visual Studio Code"; code_title2 = f"{p.stem} - Visual Studio Code"
-                    edge_title1 = f"{p.name} - Microsoft Edge"; edge_title2 = f"{p.stem} - Microsoft Edge"
-                    app_tokens_arr = ["sarvajña", "sarvajna", "sarvajnagpt", "sarvajna gpt"]
-                    browser_tokens_arr = [edge_title1, edge_title2, p.name, p.stem, stem_space_arr, "microsoft edge", "edge", "google chrome", "chrome"]
+                    # Title is memoized by (path, mtime, size), so this is free if the preview branch ran
+                    page_title = _html_title_from_file(p)
+                    code_title1 = f"{p.name} - Visual Studio Code"; code_title2 = f"{stem} - Visual Studio Code"
+                    edge_title1 = f"{p.name} - Microsoft Edge"; edge_title2 = f"{stem} - Microsoft Edge"
+                    app_tokens_arr = list(_SAR_APP_TOKENS)
+                    browser_tokens_arr = [edge_title1, edge_title2, p.name, stem, stem_space, *_EDGE_CHROME_TOKENS]
                     if page_title:
                         browser_tokens_arr = [f"{page_title} - Microsoft Edge", page_title] + browser_tokens_arr
-                    code_tokens_arr = [code_title1, code_title2, "visual studio code", "vs code", "vscode", "code"]
+                    code_tokens_arr = [code_title1, code_title2, *_VSCODE_TOKENS]
                     tri_snap = {"attempted": True}
-                    if callable(layout_any_right_stack):  # type: ignore[truthy-bool]
+                    if layout_any_right_stack is not None:
                         laidg = layout_any_right_stack(app_tokens_arr, browser_tokens_arr, code_tokens_arr)  # type: ignore[misc]
                         tri_snap["generic_stack"] = laidg
                         snap = {"attempted": True, "selected": bool(isinstance(laidg, dict) and laidg.get("ok")), "tri": True, "method": "generic_right_stack"}
@@ -732,38 +835,38 @@ def open_doc_intelligently(req: 'OpenDocIntelligentlyRequest') -> Dict[str, Any]
                 snap = snap_current_and_select(tokens, snap_side=side)  # type: ignore[misc]
             try:
                 if not snap.get("selected") and not is_code_like and is_word_like:
-                    import time as _t
-                    _t.sleep(0.12)
+                    sleep(0.12)
                 # For non-Word flows, keep a minimal browser fallback
                 if ((is_code_like or not is_word_like) and (not snap.get("selected")) and isinstance(snap.get("diagnostics"), dict)):
                     diag = snap.get("diagnostics") or {}
-                    names = [str(n).lower() for n in (diag.get("unique_names") or [])]
-                    def _has_sarvaj_browser(n: str) -> bool:
-                        return (
-                            ("sarvajna" in n or "sarvajña" in n)
-                            and ("chrome" in n or "edge" in n or "firefox" in n or "brave" in n)
-                        )
-                    has_sarvaj_browser = any(_has_sarvaj_browser(n) for n in names)
-                    if has_sarvaj_browser and callable(select_snap_assist_tile):
+                    unique_lower = tuple(str(n).lower() for n in (diag.get("unique_names") or ()))
+                    has_sarvaj_browser = any(
+                        any(t in n for t in _SARVAJ_NAME_TOKENS) and any(b in n for b in _BROWSER_NAME_TOKENS)
+                        for n in unique_lower
+                    )
+                    if has_sarvaj_browser and select_snap_assist_tile is not None:
                         ok_br = bool(select_snap_assist_tile(["sarvajña", "sarvajna", "microsoft edge", "google chrome", "mozilla firefox", "brave"]))  # type: ignore[misc]
                         if ok_br:
                             snap["selected"] = True
                             snap["fallback"] = "browser_sarvaj_selected"
             except Exception:
                 pass
-        elif callable(select_snap_assist_tile):  # type: ignore[truthy-bool]
+        elif select_snap_assist_tile is not None:
             sel = bool(select_snap_assist_tile(tokens))  # type: ignore[misc]
             snap = {"attempted": True, "selected": sel, "tokens": tokens}
         else:
             snap = {"attempted": False, "selected": False, "reason": "no_selector"}
+    snap = snap or _EMPTY_SNAP
+    selected = snap.get("selected")
+    snap_sent = snap.get("snap_sent")
     result = {
         "opened": launched,
         "path": str(p),
         # Consider split_screen true only if selection happened and verification passed
-        "split_screen": bool(snap and (snap.get("selected") and (snap.get("verified") or snap.get("snap_sent")))),
-        "cua_attempted": bool(snap and (snap.get("attempted") or snap.get("snap_sent"))),
-        "cua_selected": bool(snap and (snap.get("selected") is True)),
-        "snap": snap or {"attempted": False, "selected": False},
+        "split_screen": bool(selected and (snap.get("verified") or snap_sent)),
+        "cua_attempted": bool(snap.get("attempted") or snap_sent),
+        "cua_selected": selected is True,
+        "snap": snap,
         "flow": "cua_only",
         "side": (req.side or 'right'),
     }
@@ -774,19 +877,37 @@ def open_doc_intelligently(req: 'OpenDocIntelligentlyRequest') -> Dict[str, Any]
     return result
 
 
+# cua_runtime_status() re-probes imports and pyproject files; the UI polls the status endpoint,
+# so serve a snapshot that is at most _STATUS_TTL seconds old.
+_STATUS_TTL = 0.5
+_STATUS_CACHE: Dict[str, Any] = {"ts": 0.0, "val": None}
+_STATUS_LOCK = threading.Lock()
+
+
 def _cua_status() -> Dict[str, Any]:
-    if callable(cua_runtime_status):  # type: ignore[truthy-bool]
-        try:
-            st = cua_runtime_status()  # type: ignore[misc]
-            if isinstance(st, dict):
-                return st
-        except Exception:
-            pass
-    return {"available": False, "detail": "cua_runtime_status unavailable"}
+    v = _STATUS_CACHE["val"]
+    if v is not None and monotonic() - _STATUS_CACHE["ts"] < _STATUS_TTL:
+        return v
+    with _STATUS_LOCK:
+        # Another request may have refreshed it while we waited
+        v = _STATUS_CACHE["val"]
+        if v is not None and monotonic() - _STATUS_CACHE["ts"] < _STATUS_TTL:
+            return v
+        v = {"available": False, "detail": "cua_runtime_status unavailable"}
+        if cua_runtime_status is not None:
+            try:
+                st = cua_runtime_status()  # type: ignore[misc]
+                if isinstance(st, dict):
+                    v = st
+            except Exception:
+                pass
+        _STATUS_CACHE["val"] = v
+        _STATUS_CACHE["ts"] = monotonic()
+        return v
 
 
 def _select_tokens(tokens: list[str]) -> Dict[str, Any]:
-    if not callable(select_snap_assist_tile):  # type: ignore[truthy-bool]
+    if select_snap_assist_tile is None:
         return {"attempted": False, "selected": False, "reason": "select_snap_assist_tile_unavailable"}
     try:
         ok = bool(select_snap_assist_tile(tokens))  # type: ignore[misc]
@@ -809,13 +930,13 @@ def open_doc_cua_only(req: OpenDocCUARequest) -> Dict[str, Any]:
     try:
         # For Word, prefer background launch so our app stays active
         suffix = p.suffix.lower()
-        is_word_like = suffix in {".doc", ".docx", ".rtf"}
-        if is_word_like and callable(cua_open_path_background):
+        is_word_like = suffix in _WORD_SUFFIXES
+        if is_word_like and cua_open_path_background is not None:
             r = cua_open_path_background(str(p))  # type: ignore[misc]
-            if not r.get("ok") and callable(cua_open_path):
+            if not r.get("ok") and cua_open_path is not None:
                 r = cua_open_path(str(p))
         else:
-            r = cua_open_path(str(p)) if callable(cua_open_path) else {"ok": False, "error": "helper_missing"}
+            r = cua_open_path(str(p)) if cua_open_path is not None else {"ok": False, "error": "helper_missing"}
         launched = bool(r.get("ok"))
         if not launched and r.get("error"):
             raise HTTPException(status_code=500, detail=str(r.get("error")))
@@ -828,104 +949,34 @@ def open_doc_cua_only(req: OpenDocCUARequest) -> Dict[str, Any]:
         stem = p.stem
         # Wait for Word window to appear and focus it
         try:
-            if callable(wait_for_window_appearance):
+            if wait_for_window_appearance is not None:
                 _ = wait_for_window_appearance([stem, "microsoft word", "word"], timeout_ms=2000)
             else:
                 _ = None
         except Exception:
             _ = None
         try:
-            if callable(focus_window_by_tokens):
+            if focus_window_by_tokens is not None:
                 focus_window_by_tokens([stem, "microsoft word", "word"])  # best-effort focus on Word
-            elif callable(wait_for_focus):
+            elif wait_for_focus is not None:
                 wait_for_focus([stem, "microsoft word", "word"], timeout_ms=800)
         except Exception:
             pass
         try:
-            import time as _t
-            _t.sleep(0.08)
+            sleep(0.08)
         except Exception:
             pass
         # Snap Word LEFT and select SarvajñaGPT tab on RIGHT; fallback to generic browser-only tokens if needed
-        attempt_sets: list[list[str]] = [
-            ["sarvajnagpt", "microsoft edge"], ["sarvajna gpt", "microsoft edge"],
-            ["sarvajña", "microsoft edge"], ["sarvajna", "microsoft edge"],
-            ["sarvajnagpt", "google chrome"], ["sarvajna gpt", "google chrome"],
-            ["sarvajña", "google chrome"], ["sarvajna", "google chrome"],
-            ["sarvajnagpt", "mozilla firefox"], ["sarvajna gpt", "mozilla firefox"],
-            ["sarvajña", "mozilla firefox"], ["sarvajna", "mozilla firefox"],
-            ["sarvajnagpt", "brave"], ["sarvajna gpt", "brave"],
-            ["sarvajña", "brave"], ["sarvajna", "brave"],
-        ]
-        attempt_sets_generic: list[list[str]] = [["microsoft edge"], ["google chrome"], ["mozilla firefox"], ["brave"]]
-        if callable(snap_current_and_select):  # type: ignore[truthy-bool]
-            import time as _tlim
-            snap = {"attempted": True, "selected": False}
-            start = _tlim.time()
-            # Trigger snap once using the first tokens
-            snap = snap_current_and_select(attempt_sets[0], snap_side='left')  # type: ignore[misc]
-            if not snap.get("selected"):
-                # Within the remaining 2s window, try alternative tokens WITHOUT re-triggering snap
-                for toks in attempt_sets[1:]:
-                    if (_tlim.time() - start) > 2.0:
-                        break
-                    try:
-                        ok = bool(select_snap_assist_tile(toks)) if callable(select_snap_assist_tile) else False
-                        if ok:
-                            snap["selected"] = True
-                            snap["tokens"] = toks
-                            break
-                    except Exception:
-                        break
-            # Diagnostics-guided retry: if a tile containing SarvajñaGPT was seen, target it explicitly
-            if not snap.get("selected") and isinstance(snap.get("diagnostics"), dict):
-                try:
-                    diag = snap.get("diagnostics") or {}
-                    names = [str(n) for n in (diag.get("unique_names") or [])]
-                    sar_cands = [n for n in names if ("sarvajna" in n.lower()) or ("sarvajña" in n.lower()) or ("sarvajnagpt" in n.lower())]
-                    if sar_cands and callable(select_snap_assist_tile):
-                        for cand in sar_cands[:4]:
-                            try:
-                                if bool(select_snap_assist_tile([cand])):
-                                    snap["selected"] = True; snap["tokens"] = [cand]
-                                    break
-                                for brand in ("microsoft edge", "google chrome", "mozilla firefox", "brave"):
-                                    if bool(select_snap_assist_tile([cand, brand])):
-                                        snap["selected"] = True; snap["tokens"] = [cand, brand]
-                                        break
-                                if snap.get("selected"):
-                                    break
-                            except Exception:
-                                continue
-                except Exception:
-                    pass
-            # If still not selected, re-trigger once with generic browser tokens
-            if not snap.get("selected"):
-                try:
-                    snap = snap_current_and_select(attempt_sets_generic[0], snap_side='left')  # type: ignore[misc]
-                except Exception:
-                    pass
-                if not snap.get("selected"):
-                    g_start = _tlim.time()
-                    for toks in attempt_sets_generic[1:]:
-                        if (_tlim.time() - g_start) > 1.8:
-                            break
-                        try:
-                            ok = bool(select_snap_assist_tile(toks)) if callable(select_snap_assist_tile) else False
-                            if ok:
-                                snap["selected"] = True
-                                snap["tokens"] = toks
-                                break
-                        except Exception:
-                            break
+        if snap_current_and_select is not None:
+            snap = _attempt_snap_select(_SAR_BROWSER_TOKENS, _GENERIC_BROWSER_TOKENS, 'left', 2.0, 1.8)
         else:
             # Fallback single-shot using first attempt tokens
-            snap = _select_tokens(attempt_sets[0])
+            snap = _select_tokens(_SAR_BROWSER_TOKENS[0])
     return {
         "ok": True,
         "launched": launched,
         "path": str(p),
-        "snap": snap or {"attempted": False, "selected": False},
+        "snap": snap or _EMPTY_SNAP,
         "note": "CUA-only open; no Win32/COM/UIAutomation involved.",
     }
 
@@ -949,7 +1000,7 @@ class OpenCodeCUARequest(BaseModel):
 def open_code_cua_only(req: OpenCodeCUARequest) -> Dict[str, Any]:
     try:
         # Force new window even if an existing Code window is present
-        result = cua_open_vscode(req.path, True) if callable(cua_open_vscode) else {"ok": False, "error": "helper_missing"}
+        result = cua_open_vscode(req.path, True) if cua_open_vscode is not None else {"ok": False, "error": "helper_missing"}
         if not result.get("ok"):
             raise HTTPException(status_code=500, detail=str(result.get("error")))
         return {"ok": True, **result}
@@ -965,55 +1016,84 @@ class ReopenTriSplitRequest(BaseModel):
     service: Optional[str] = Field(None, description="Service name; defaults to 'power_mode'")
 
 
-def _find_html_artifact_for_chat(chat_id: str, service: Optional[str]) -> Optional[str]:
-    """Return best HTML path for a chat via chat_state.doc_path or latest chat_artifact .html."""
-    DBP = os.path.join(os.path.dirname(__file__), 'chat_embeddings.db')
+_DB_PATH = os.path.join(os.path.dirname(__file__), 'chat_embeddings.db')
+# One long-lived connection for the power-mode chat_state/chat_artifact lookups; the tables are
+# ensured once when it is opened instead of on every call. Handed to one thread at a time.
+_DB_LOCK = threading.Lock()
+_DB_CONN: Optional[_sqlite3.Connection] = None
+
+
+def _db_open() -> _sqlite3.Connection:
+    conn = _sqlite3.connect(_DB_PATH, check_same_thread=False)
+    try:
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA busy_timeout=5000')
+    except Exception:
+        pass
     try:
-        conn = _sqlite3.connect(DBP)
+        conn.execute('''CREATE TABLE IF NOT EXISTS chat_state (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT,
+            service TEXT,
+            persistent_tags TEXT,
+            doc_path TEXT,
+            created_at INTEGER,
+            updated_at INTEGER
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS chat_artifact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT,
+            service TEXT,
+            path TEXT,
+            created_at INTEGER
+        )''')
+        # Same lookup indexes as main.init_db, for databases it has not migrated yet
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_state_lookup ON chat_state(chat_id, service, id DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_artifact_lookup ON chat_artifact(chat_id, service, id DESC)')
+        conn.commit()
+    except Exception:
+        pass
+    return conn
+
+
+@contextmanager
+def _db_conn():
+    global _DB_CONN
+    with _DB_LOCK:
+        if _DB_CONN is None:
+            _DB_CONN = _db_open()
         try:
-            c = conn.cursor()
-            svc = service or 'power_mode'
-            # 1) chat_state.doc_path
+            yield _DB_CONN
+        finally:
             try:
-                c.execute('''CREATE TABLE IF NOT EXISTS chat_state (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id TEXT,
-                    service TEXT,
-                    persistent_tags TEXT,
-                    doc_path TEXT,
-                    created_at INTEGER,
-                    updated_at INTEGER
-                )''')
+                if _DB_CONN.in_transaction:
+                    _DB_CONN.rollback()
             except Exception:
                 pass
-            c.execute('SELECT doc_path FROM chat_state WHERE chat_id=? AND service=? ORDER BY id DESC LIMIT 1', (chat_id, svc))
-            row = c.fetchone()
+
+
+def _find_html_artifact_for_chat(chat_id: str, service: Optional[str]) -> Optional[str]:
+    """Return best HTML path for a chat via chat_state.doc_path or latest chat_artifact .html."""
+    svc = service or 'power_mode'
+    try:
+        with _db_conn() as conn:
+            # 1) chat_state.doc_path
+            row = conn.execute('SELECT doc_path FROM chat_state WHERE chat_id=? AND service=? ORDER BY id DESC LIMIT 1', (chat_id, svc)).fetchone()
             if row and row[0]:
                 p = str(row[0])
                 if p.lower().endswith('.html') and os.path.isfile(p):
                     return p
             # 2) Latest chat_artifact .html
-            try:
-                c.execute('''CREATE TABLE IF NOT EXISTS chat_artifact (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id TEXT,
-                    service TEXT,
-                    path TEXT,
-                    created_at INTEGER
-                )''')
-            except Exception:
-                pass
-            c.execute('SELECT path FROM chat_artifact WHERE chat_id=? AND service=? ORDER BY id DESC', (chat_id, svc))
-            rows = c.fetchall() or []
-            for r in rows:
-                try:
-                    p = str(r[0] or '')
-                    if p.lower().endswith('.html') and os.path.isfile(p):
-                        return p
-                except Exception:
-                    continue
-        finally:
-            conn.close()
+            # LIKE is ASCII case-insensitive, matching the .lower().endswith('.html') check below
+            # Rows stream from the cursor, so the first existing file ends the scan
+            for (raw,) in conn.execute(
+                "SELECT path FROM chat_artifact WHERE chat_id=? AND service=? AND path LIKE '%.html' ORDER BY id DESC LIMIT 20",
+                (chat_id, svc),
+            ):
+                p = str(raw or '')
+                if p.lower().endswith('.html') and os.path.isfile(p):
+                    return p
     except Exception:
         return None
     return None
@@ -1037,41 +1117,34 @@ def reopen_trisplit_for_chat(req: ReopenTriSplitRequest) -> Dict[str, Any]:
         raise HTTPException(status_code=404, detail='html_path_missing')
     opened = None
     try:
-        opened = cua_open_vscode(str(target), True) if callable(cua_open_vscode) else {"ok": False}
+        opened = cua_open_vscode(str(target), True) if cua_open_vscode is not None else {"ok": False}
     except Exception:
         opened = {"ok": False, "error": "vscode_launch_failed"}
     browser = None
     tri_snap = None
     try:
-        if callable(cua_open_browser_to_path):
+        if cua_open_browser_to_path is not None:
             browser = cua_open_browser_to_path(str(target), new_window=True)
             try:
-                if callable(wait_for_window_appearance):
+                if wait_for_window_appearance is not None:
                     stem = target.stem
                     stem_space = stem.replace("-", " ")
-                    _ = wait_for_window_appearance([target.name, stem, stem_space, "microsoft edge", "edge", "google chrome", "chrome", "mozilla firefox", "firefox", "brave"], timeout_ms=7000)
+                    _ = wait_for_window_appearance([target.name, stem, stem_space, *_BROWSER_TITLE_TOKENS], timeout_ms=7000)
             except Exception:
                 pass
         # Generic, order-agnostic right stack per request
-        try:
-            from .cua_adapter import layout_any_right_stack  # type: ignore
-        except Exception:
-            try:
-                from cua_adapter import layout_any_right_stack  # type: ignore
-            except Exception:
-                layout_any_right_stack = None  # type: ignore
         try:
             stem = target.stem
             stem_space = stem.replace("-", " ")
             page_title = _html_title_from_file(target)
             code_title1 = f"{target.name} - Visual Studio Code"; code_title2 = f"{stem} - Visual Studio Code"
             edge_title1 = f"{target.name} - Microsoft Edge"; edge_title2 = f"{stem} - Microsoft Edge"
-            app_tokens_arr = ["sarvajña", "sarvajna", "sarvajnagpt", "sarvajna gpt"]
-            browser_tokens_arr = [edge_title1, edge_title2, target.name, stem, stem_space, "microsoft edge", "edge", "google chrome", "chrome"]
+            app_tokens_arr = list(_SAR_APP_TOKENS)
+            browser_tokens_arr = [edge_title1, edge_title2, target.name, stem, stem_space, *_EDGE_CHROME_TOKENS]
             if page_title:
                 browser_tokens_arr = [f"{page_title} - Microsoft Edge", page_title] + browser_tokens_arr
-            code_tokens_arr = [code_title1, code_title2, "visual studio code", "vs code", "vscode", "code"]
-            if callable(layout_any_right_stack):  # type: ignore[truthy-bool]
+            code_tokens_arr = [code_title1, code_title2, *_VSCODE_TOKENS]
+            if layout_any_right_stack is not None:
                 tri_snap = {"attempted": True, "generic_stack": layout_any_right_stack(app_tokens_arr, browser_tokens_arr, code_tokens_arr)}  # type: ignore[misc]
             else:
                 tri_snap = {"attempted": True, "generic_stack": {"ok": False, "reason": "generic_stack_unavailable"}}
@@ -1135,143 +1208,92 @@ def word_enhance_selection(req: WordEnhanceSelectionRequest) -> Dict[str, Any]:
     Returns diagnostics and paste status.
     """
     import time as _t
-    
-    print("\n" + "="*80)
-    print("WORD ENHANCEMENT DEBUG - START")
-    print("="*80)
-    
+
     # 1) Use the selection text provided by frontend
     selected_preview = (req.selection_text or '').strip()
-    print(f"\n1. SELECTION TEXT RECEIVED:")
-    print(f"   Length: {len(selected_preview)}")
-    print(f"   Preview: {selected_preview[:200]}")
-    print(f"   Chat ID: {req.chat_id}")
-    print(f"   Prompt: {req.prompt}")
-    
+    _log.debug("word_enhance: selection length=%d chat_id=%s prompt=%r preview=%r",
+               len(selected_preview), req.chat_id, req.prompt, selected_preview[:200])
+
     if not selected_preview:
         raise HTTPException(status_code=400, detail="no_selection_provided - selection_text is empty")
-    
+
     # 2) Try to get full document from database if chat_id provided
     full_text = ''
     doc_source = 'none'
-    
-    print(f"\n2. DOCUMENT LOOKUP:")
+
+    # Context cap, known up front so the document read can stop early
+    max_ctx = max(10000, int(req.max_full_context_chars or 60000))
+
     if req.chat_id:
-        print(f"   Chat ID provided: {req.chat_id}")
         # Look up document path from chat_state
-        DBP = os.path.join(os.path.dirname(__file__), 'chat_embeddings.db')
-        print(f"   Database path: {DBP}")
         try:
-            conn = _sqlite3.connect(DBP)
-            try:
-                c = conn.cursor()
-                c.execute('''CREATE TABLE IF NOT EXISTS chat_state (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id TEXT,
-                    service TEXT,
-                    persistent_tags TEXT,
-                    doc_path TEXT,
-                    created_at INTEGER,
-                    updated_at INTEGER
-                )''')
+            with _db_conn() as conn:
                 # Look for doc_path in chat_state (service defaults to 'power_mode')
-                c.execute('SELECT doc_path FROM chat_state WHERE chat_id=? ORDER BY id DESC LIMIT 1', (req.chat_id,))
-                row = c.fetchone()
-                print(f"   Database query result: {row}")
-                if row and row[0]:
-                    doc_path = str(row[0])
-                    print(f"   Found doc_path: {doc_path}")
-                    print(f"   File exists: {os.path.isfile(doc_path)}")
-                    print(f"   Is Word file: {doc_path.lower().endswith(('.doc', '.docx'))}")
-                    # Check if it's a Word document
-                    if doc_path.lower().endswith(('.doc', '.docx')) and os.path.isfile(doc_path):
-                        # Read the Word document
-                        try:
-                            from docx import Document  # type: ignore
-                            doc = Document(doc_path)
-                            paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-                            full_text = '\n'.join(paragraphs)
-                            doc_source = f'database:{os.path.basename(doc_path)}'
-                            print(f"   Successfully read from file!")
-                            print(f"   Paragraphs found: {len(paragraphs)}")
-                            print(f"   Total chars: {len(full_text)}")
-                        except ImportError as e:
-                            print(f"   ERROR: python-docx not available: {e}")
-                            # python-docx not available, fall back to clipboard method
-                            pass
-                        except Exception as e:
-                            print(f"   ERROR reading file: {e}")
-                            # Error reading file, fall back to clipboard method
-                            pass
+                row = conn.execute('SELECT doc_path FROM chat_state WHERE chat_id=? ORDER BY id DESC LIMIT 1', (req.chat_id,)).fetchone()
+            _log.debug("word_enhance: chat_state row=%s (db %s)", row, _DB_PATH)
+            if row and row[0]:
+                doc_path = str(row[0])
+                # Check if it's a Word document
+                if doc_path.lower().endswith(('.doc', '.docx')) and os.path.isfile(doc_path):
+                    # Read the Word document
+                    try:
+                        paragraphs = _docx_paragraph_texts(doc_path, max_chars=max_ctx)
+                        full_text = _join_capped(paragraphs, max_ctx)
+                        doc_source = f'database:{os.path.basename(doc_path)}'
+                        _log.debug("word_enhance: read %s (%d paragraphs, %d chars)", doc_path, len(paragraphs), len(full_text))
+                    except Exception as e:
+                        # Error reading file, fall back to clipboard method
+                        _log.debug("word_enhance: could not read %s: %s", doc_path, e)
                 else:
-                    print(f"   No doc_path found in database")
-            finally:
-                conn.close()
+                    _log.debug("word_enhance: doc_path %s is not an existing Word file", doc_path)
         except Exception as e:
-            print(f"   Database error: {e}")
-            pass
-    else:
-        print(f"   No chat_id provided, skipping database lookup")
-    
+            _log.debug("word_enhance: database error: %s", e)
+
     # 3) If no full text from database, use clipboard method (focus Word and capture)
     restored = False
-    print(f"\n3. FULL DOCUMENT CAPTURE:")
-    print(f"   Doc source so far: {doc_source}")
-    print(f"   Full text length: {len(full_text)}")
-    
     if not full_text:
-        print(f"   No text from database, using clipboard method...")
         # Ensure Word is focused
         focused = False
+        word_tokens = ["microsoft word", "word"]
         try:
-            if callable(focus_window_by_tokens):
-                focused = focus_window_by_tokens(["microsoft word", "word"])  # type: ignore[misc]
-                print(f"   focus_window_by_tokens result: {focused}")
-            if not focused and callable(ensure_focus):
-                focused = ensure_focus(["microsoft word", "word"])  # type: ignore[misc]
-                print(f"   ensure_focus result: {focused}")
-            _t.sleep(0.15)  # Let focus settle
+            if focus_window_by_tokens is not None:
+                focused = focus_window_by_tokens(word_tokens)  # type: ignore[misc]
+            if not focused and ensure_focus is not None:
+                focused = ensure_focus(word_tokens)  # type: ignore[misc]
+            _log.debug("word_enhance: Word focused=%s", focused)
+            # Let focus settle: returns as soon as Word holds focus, waits at most 150 ms
+            if wait_for_focus is not None:
+                wait_for_focus(word_tokens, timeout_ms=150)  # type: ignore[misc]
+            else:
+                _t.sleep(0.15)
         except Exception as e:
-            print(f"   Focus error: {e}")
-            pass  # Continue anyway
-        
+            _log.debug("word_enhance: focus error: %s", e)  # Continue anyway
+
         # Capture full-document text and restore selection
         try:
-            if callable(capture_full_document_text_and_restore_selection):
-                print(f"   Calling capture_full_document_text_and_restore_selection...")
+            if capture_full_document_text_and_restore_selection is not None:
                 caps = capture_full_document_text_and_restore_selection(selected_preview, max_chars=(req.max_full_context_chars or 60000))  # type: ignore[misc]
-                print(f"   Capture result: {caps}")
                 if isinstance(caps, dict):
                     full_text = str(caps.get('text') or '')
                     restored = bool(caps.get('restored'))
                     doc_source = 'clipboard'
-                    print(f"   Clipboard capture successful!")
-                    print(f"   Full text length: {len(full_text)}")
-                    print(f"   Selection restored: {restored}")
+                    _log.debug("word_enhance: clipboard capture %d chars, restored=%s", len(full_text), restored)
         except Exception as e:
-            print(f"   Clipboard capture error: {e}")
+            _log.debug("word_enhance: clipboard capture error: %s", e)
             full_text = ''
             restored = False
-    else:
-        print(f"   Using text from database, skipping clipboard capture")
-    
+
     # 4) Build LLM prompt with clear instructions
     user_prompt = (req.prompt or '').strip()
     if not user_prompt:
         user_prompt = 'Rewrite in more detail while preserving meaning and style.'
-    
+
     # Keep context manageable
-    max_ctx = max(10000, int(req.max_full_context_chars or 60000))
     ctx = (full_text or '')
     if len(ctx) > max_ctx:
         ctx = ctx[:max_ctx]
-    
-    print(f"\n4. LLM PROMPT CONSTRUCTION:")
-    print(f"   User prompt: {user_prompt}")
-    print(f"   Context length (before truncation): {len(full_text)}")
-    print(f"   Context length (after truncation): {len(ctx)}")
-    print(f"   Max context allowed: {max_ctx}")
-    
+    _log.debug("word_enhance: context %d of %d chars (cap %d)", len(ctx), len(full_text), max_ctx)
+
     # Enhanced LLM prompt - Just enhance the selected text
     llm_input = f"""You are a text enhancement assistant. Your ONLY job is to improve the selected text based on the user's request.
 
@@ -1290,23 +1312,12 @@ FULL DOCUMENT CONTEXT (for reference only):
 {ctx}
 
 Now return ONLY the enhanced version of the selected text:"""
-    
-    print(f"\n   FULL LLM INPUT:")
-    print("   " + "-"*76)
-    print("   " + llm_input.replace("\n", "\n   "))
-    print("   " + "-"*76)
-    
+
     # 5) Call LLM
-    print(f"\n5. CALLING LLM...")
     try:
         out_text = _power_llm(llm_input) if callable(_power_llm) else ''  # type: ignore[misc]
-        print(f"   LLM Response received!")
-        print(f"   Response length: {len(out_text)}")
-        print(f"   Response preview (first 500 chars):")
-        print("   " + "-"*76)
-        print("   " + out_text[:500].replace("\n", "\n   "))
-        print("   " + "-"*76)
-        
+        _log.debug("word_enhance: LLM returned %d chars", len(out_text))
+
         # Clean up LLM response - remove <think> tags and extra commentary
         import re
         # Remove <think>...</think> blocks
@@ -1317,36 +1328,23 @@ Now return ONLY the enhanced version of the selected text:"""
         out_text = re.sub(r'^```.*?\n', '', out_text, flags=re.MULTILINE)
         out_text = re.sub(r'\n```$', '', out_text)
         out_text = out_text.strip()
-        
-        print(f"   After cleanup:")
-        print(f"   Cleaned length: {len(out_text)}")
-        print(f"   Cleaned preview (first 500 chars):")
-        print("   " + "-"*76)
-        print("   " + out_text[:500].replace("\n", "\n   "))
-        print("   " + "-"*76)
-        
     except Exception as e:
-        print(f"   LLM ERROR: {e}")
+        _log.warning("word_enhance: LLM error: %s", e)
         raise HTTPException(status_code=500, detail=f"llm_failed:{e}")
-    
+
     out_text = (out_text or '').strip()
     if not out_text:
-        print(f"   ERROR: LLM returned empty output!")
         raise HTTPException(status_code=500, detail="llm_empty_output")
-    
-    print(f"   LLM output ready for pasting")
-    
+
     # 6) Copy the enhanced text to clipboard for manual pasting
-    print(f"\n6. COPYING TO CLIPBOARD:")
     try:
         import pyperclip  # type: ignore
         pyperclip.copy(out_text)
-        print(f"   ✓ Enhanced text copied to clipboard ({len(out_text)} chars)")
         clipboard_copied = True
     except Exception as e:
-        print(f"   ✗ Failed to copy to clipboard: {e}")
+        _log.debug("word_enhance: clipboard copy failed: %s", e)
         clipboard_copied = False
-    
+
     result = {
         'ok': True,
         'selection': {'length': len(selected_preview), 'preview': selected_preview[:240]},
@@ -1359,13 +1357,7 @@ Now return ONLY the enhanced version of the selected text:"""
         'enhanced_text_preview': out_text[:500],  # Preview for debugging
         'instructions': 'Select the text in Word → Press Ctrl+V to replace with enhanced version',
     }
-    
-    print(f"\n7. FINAL RESULT:")
-    print(f"   {result}")
-    print("\n" + "="*80)
-    print("WORD ENHANCEMENT DEBUG - END")
-    print("="*80 + "\n")
-    
+    _log.info("word_enhance: chat_id=%s doc_source=%s output=%d chars", req.chat_id, doc_source, len(out_text))
     return result
 
 
@@ -1775,10 +1767,10 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
                     toks = [stem] + word_tokens
                     cleaned = _plain_from_markdown(text)
                     rtf = _rtf_from_markdown(text)
-                    if callable(paste_rich_text_to_foreground_app):
+                    if paste_rich_text_to_foreground_app is not None:
                         paste_info = paste_rich_text_to_foreground_app(cleaned, rtf, click_center=True, focus_tokens=toks)
                     else:
-                        paste_info = paste_text_to_foreground_app(cleaned, click_center=True, focus_tokens=toks) if callable(paste_text_to_foreground_app) else None
+                        paste_info = paste_text_to_foreground_app(cleaned, click_center=True, focus_tokens=toks) if paste_text_to_foreground_app is not None else None
                 except Exception:
                     paste_info = {"ok": False, "error": "paste_failed"}
             else:
@@ -1810,7 +1802,7 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
                 except Exception:
                     # As a last resort, try to focus Word and paste into the active doc
                     try:
-                        paste_info = paste_text_to_foreground_app(text, click_center=True, focus_tokens=word_tokens) if callable(paste_text_to_foreground_app) else None
+                        paste_info = paste_text_to_foreground_app(text, click_center=True, focus_tokens=word_tokens) if paste_text_to_foreground_app is not None else None
                     except Exception:
                         paste_info = {"ok": False, "error": "paste_failed"}
                     execute_block = {
@@ -1863,29 +1855,22 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
             opened = None
             try:
                 # Always open in a NEW VS Code window for deterministic snapping
-                opened = cua_open_vscode(str(target), True) if callable(cua_open_vscode) else {"ok": False}
+                opened = cua_open_vscode(str(target), True) if cua_open_vscode is not None else {"ok": False}
             except Exception:
                 opened = {"ok": False, "error": "vscode_launch_failed"}
             # If HTML, open a browser preview of the file (prefer Chrome) in its own window (avoid duplicate tabs)
             browser = None
             tri_snap = None
-            if ext == '.html' and callable(cua_open_browser_to_path):
+            if ext == '.html' and cua_open_browser_to_path is not None:
                 try:
                     browser = cua_open_browser_to_path(str(target), new_window=True)
                     # Order-agnostic right-stack flow per user request
-                    try:
-                        from .cua_adapter import layout_any_right_stack  # type: ignore
-                    except Exception:
-                        try:
-                            from cua_adapter import layout_any_right_stack  # type: ignore
-                        except Exception:
-                            layout_any_right_stack = None  # type: ignore
                     try:
                         stem = target.stem
                         stem_space = stem.replace("-", " ")
                         page_title = _html_title_from_file(target)
-                        if callable(wait_for_window_appearance):
-                            wait_tokens = [target.name, stem, stem_space, "microsoft edge", "edge", "google chrome", "chrome", "mozilla firefox", "firefox", "brave"]
+                        if wait_for_window_appearance is not None:
+                            wait_tokens = [target.name, stem, stem_space, *_BROWSER_TITLE_TOKENS]
                             if page_title:
                                 wait_tokens = [page_title] + wait_tokens
                             _ = wait_for_window_appearance(wait_tokens, timeout_ms=7000)
@@ -1897,12 +1882,12 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
                                 pass
                         code_title1 = f"{target.name} - Visual Studio Code"; code_title2 = f"{stem} - Visual Studio Code"
                         edge_title1 = f"{target.name} - Microsoft Edge"; edge_title2 = f"{stem} - Microsoft Edge"
-                        app_tokens_arr = ["sarvajña", "sarvajna", "sarvajnagpt", "sarvajna gpt"]
-                        browser_tokens_arr = [edge_title1, edge_title2, target.name, stem, stem_space, "microsoft edge", "edge", "google chrome", "chrome"]
+                        app_tokens_arr = list(_SAR_APP_TOKENS)
+                        browser_tokens_arr = [edge_title1, edge_title2, target.name, stem, stem_space, *_EDGE_CHROME_TOKENS]
                         if page_title:
                             browser_tokens_arr = [f"{page_title} - Microsoft Edge", page_title] + browser_tokens_arr
-                        code_tokens_arr = [code_title1, code_title2, "visual studio code", "vs code", "vscode", "code"]
-                        if callable(layout_any_right_stack):  # type: ignore[truthy-bool]
+                        code_tokens_arr = [code_title1, code_title2, *_VSCODE_TOKENS]
+                        if layout_any_right_stack is not None:
                             tri_first = layout_any_right_stack(app_tokens_arr, browser_tokens_arr, code_tokens_arr)  # type: ignore[misc]
                             tri_snap = {"attempted": True, "generic_stack": tri_first}
                             try:
@@ -1940,26 +1925,26 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
             # For non-HTML code, attempt a simple two-pane split: App (left) | Code (right)
             if ext != '.html':
                 try:
-                    app_tokens_arr = ["sarvajña", "sarvajna", "sarvajnagpt", "sarvajna gpt"]
+                    app_tokens_arr = list(_SAR_APP_TOKENS)
                     code_title1 = f"{target.name} - Visual Studio Code"; code_title2 = f"{target.stem} - Visual Studio Code"
-                    code_tokens_arr = [code_title1, code_title2, "visual studio code", "vs code", "vscode", "code"]
+                    code_tokens_arr = [code_title1, code_title2, *_VSCODE_TOKENS]
                     steps = []
                     # Focus app and snap left
                     try:
-                        ok_app = (ensure_focus_top(app_tokens_arr) or ensure_focus(app_tokens_arr)) if callable(ensure_focus_top) else False
+                        ok_app = (ensure_focus_top(app_tokens_arr) or ensure_focus(app_tokens_arr)) if ensure_focus_top is not None else False
                     except Exception:
                         ok_app = False
-                    if callable(snap_to):
+                    if snap_to is not None:
                         left_ok = snap_to('left') if ok_app else False
                     else:
                         left_ok = False
                     steps.append({'action': 'app_left', 'focus_ok': bool(ok_app), 'snap_left_ok': bool(left_ok)})
                     # Focus code and snap right
                     try:
-                        ok_code = (ensure_focus_top(code_tokens_arr) or ensure_focus(code_tokens_arr)) if callable(ensure_focus_top) else False
+                        ok_code = (ensure_focus_top(code_tokens_arr) or ensure_focus(code_tokens_arr)) if ensure_focus_top is not None else False
                     except Exception:
                         ok_code = False
-                    if callable(snap_to):
+                    if snap_to is not None:
                         right_ok = snap_to('right') if ok_code else False
                     else:
                         right_ok = False
@@ -2026,28 +2011,21 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
                 pass
             opened = None
             try:
-                opened = cua_open_vscode(str(target), True) if callable(cua_open_vscode) else {"ok": False}
+                opened = cua_open_vscode(str(target), True) if cua_open_vscode is not None else {"ok": False}
             except Exception:
                 opened = {"ok": False, "error": "vscode_launch_failed"}
             browser = None
             tri_snap = None
-            if target.suffix.lower() == '.html' and callable(cua_open_browser_to_path):
+            if target.suffix.lower() == '.html' and cua_open_browser_to_path is not None:
                 try:
                     browser = cua_open_browser_to_path(str(target), new_window=True)
                     # Attempt tri-split with the same robust fallbacks as the non-fallback path
-                    try:
-                        from .cua_adapter import layout_any_right_stack  # type: ignore
-                    except Exception:
-                        try:
-                            from cua_adapter import layout_any_right_stack  # type: ignore
-                        except Exception:
-                            layout_any_right_stack = None  # type: ignore
                     try:
                         stem = target.stem
                         stem_space = stem.replace("-", " ")
                         page_title = _html_title_from_file(target)
-                        if callable(wait_for_window_appearance):
-                            wait_tokens = [target.name, stem, stem_space, "microsoft edge", "edge", "google chrome", "chrome", "mozilla firefox", "firefox", "brave"]
+                        if wait_for_window_appearance is not None:
+                            wait_tokens = [target.name, stem, stem_space, *_BROWSER_TITLE_TOKENS]
                             if page_title:
                                 wait_tokens = [page_title] + wait_tokens
                             _ = wait_for_window_appearance(wait_tokens, timeout_ms=7000)
@@ -2058,12 +2036,12 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
                                 pass
                         code_title1 = f"{target.name} - Visual Studio Code"; code_title2 = f"{stem} - Visual Studio Code"
                         edge_title1 = f"{target.name} - Microsoft Edge"; edge_title2 = f"{stem} - Microsoft Edge"
-                        app_tokens_arr = ["sarvajña", "sarvajna", "sarvajnagpt", "sarvajna gpt"]
-                        browser_tokens_arr = [edge_title1, edge_title2, target.name, stem, stem_space, "microsoft edge", "edge", "google chrome", "chrome"]
+                        app_tokens_arr = list(_SAR_APP_TOKENS)
+                        browser_tokens_arr = [edge_title1, edge_title2, target.name, stem, stem_space, *_EDGE_CHROME_TOKENS]
                         if page_title:
                             browser_tokens_arr = [f"{page_title} - Microsoft Edge", page_title] + browser_tokens_arr
-                        code_tokens_arr = [code_title1, code_title2, "visual studio code", "vs code", "vscode", "code"]
-                        if callable(layout_any_right_stack):  # type: ignore[truthy-bool]
+                        code_tokens_arr = [code_title1, code_title2, *_VSCODE_TOKENS]
+                        if layout_any_right_stack is not None:
                             tri_first = layout_any_right_stack(app_tokens_arr, browser_tokens_arr, code_tokens_arr)  # type: ignore[misc]
                             tri_snap = {"attempted": True, "generic_stack": tri_first}
                             try:
@@ -2099,24 +2077,24 @@ def power_chat(req: PowerChatRequest) -> Dict[str, Any]:
             # For non-HTML code fallback path, attempt two-pane split as well
             if target.suffix.lower() != '.html':
                 try:
-                    app_tokens_arr = ["sarvajña", "sarvajna", "sarvajnagpt", "sarvajna gpt"]
+                    app_tokens_arr = list(_SAR_APP_TOKENS)
                     code_title1 = f"{target.name} - Visual Studio Code"; code_title2 = f"{target.stem} - Visual Studio Code"
-                    code_tokens_arr = [code_title1, code_title2, "visual studio code", "vs code", "vscode", "code"]
+                    code_tokens_arr = [code_title1, code_title2, *_VSCODE_TOKENS]
                     steps = []
                     try:
-                        ok_app = (ensure_focus_top(app_tokens_arr) or ensure_focus(app_tokens_arr)) if callable(ensure_focus_top) else False
+                        ok_app = (ensure_focus_top(app_tokens_arr) or ensure_focus(app_tokens_arr)) if ensure_focus_top is not None else False
                     except Exception:
                         ok_app = False
-                    if callable(snap_to):
+                    if snap_to is not None:
                         left_ok = snap_to('left') if ok_app else False
                     else:
                         left_ok = False
                     steps.append({'action': 'app_left', 'focus_ok': bool(ok_app), 'snap_left_ok': bool(left_ok)})
                     try:
-                        ok_code = (ensure_focus_top(code_tokens_arr) or ensure_focus(code_tokens_arr)) if callable(ensure_focus_top) else False
+                        ok_code = (ensure_focus_top(code_tokens_arr) or ensure_focus(code_tokens_arr)) if ensure_focus_top is not None else False
                     except Exception:
                         ok_code = False
-                    if callable(snap_to):
+                    if snap_to is not None:
                         right_ok = snap_to('right') if ok_code else False
                     else:
                         right_ok = False
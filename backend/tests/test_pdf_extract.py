@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# main.py imports its siblings by bare name, so the backend folder must be importable
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sentence_transformers")
+fitz = pytest.importorskip("fitz")
+
+BODY = "The quick brown fox jumps over the lazy dog. " * 6
+
+
+@pytest.fixture(scope="module")
+def main_mod(tmp_path_factory):
+    # main runs init_db() against ./chat_embeddings.db on import; keep it out of the repo
+    old_cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("db"))
+    try:
+        import main  # type: ignore
+    finally:
+        os.chdir(old_cwd)
+    return main
+
+
+def test_sparse_first_pages_fall_through_to_next_extractor(main_mod, tmp_path):
+    # First 5 pages carry only a page number (< _PDF_PROBE_MIN_CHARS in total), the rest real text
+    pdf_path = tmp_path / "sparse_head.pdf"
+    doc = fitz.open()
+    for n in range(1, 11):
+        page = doc.new_page()
+        page.insert_text((72, 72), str(n) if n <= 5 else BODY)
+    doc.save(str(pdf_path))
+    doc.close()
+
+    text = main_mod._extract_text_pdf_best_effort(str(pdf_path))
+
+    assert "quick brown fox" in text
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# power_router falls back to bare-name sibling imports when not loaded as a package
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+pytest.importorskip("fastapi")
+pytest.importorskip("pydantic")
+
+import power_router  # type: ignore  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "reply, expected",
+    [
+        # A bare ``` mentioned in prose must not pair with the real block's opening fence
+        ("Use ``` to fence code, like this:\n```python\nprint(1)\n```", "print(1)"),
+        # An inline ```js``` is not a fence (not at line start, info string holds a backtick)
+        ("Wrap with ```js``` fences.\n```html\n<p>hi</p>\n```", "<p>hi</p>"),
+    ],
+)
+def test_extract_code_ignores_backticks_in_prose(reply, expected):
+    assert power_router._extract_code_from_llm(reply) == expected
+
+
+def test_fenced_blocks_are_line_anchored():
+    text = "```c++\nint x;\n```\nsee ``` here\n  ```py\nx = 1\n  ```\n```\nunterminated"
+    assert power_router._fenced_blocks(text) == [("c++", "int x;\n"), ("py", "x = 1\n")]